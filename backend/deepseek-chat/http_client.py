@@ -0,0 +1,105 @@
+"""Общий HTTP-клиент backend-функций: один requests.Session на инстанс
+
+Соединения (TCP+TLS) остаются открытыми между вызовами прогретого инстанса,
+поэтому повторный запрос к тому же API не платит за установку соединения.
+Функции деплоятся по отдельности, и копия модуля лежит в каталоге каждой
+из них — правки вносятся во все копии. Копия в chatgpt-polza написана
+по-английски; scripts/check_shared_modules.py проверяет, что код всех копий
+совпадает.
+"""
+
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+
+# pool_connections — число хостов с отдельным пулом, pool_maxsize — соединений
+# на хост: не меньше числа одновременных запросов (DEEPSEEK_CONCURRENCY)
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', '4'))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '16'))
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Сессия модуля: создается при первом запросе и живет, пока жив инстанс"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Повторы делает request() сам: urllib3 не умеет jitter и Retry-After для POST
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Пауза из заголовка Retry-After (только в секундах, дату не разбираем)"""
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int, hint: Optional[float] = None) -> float:
+    """Пауза перед повтором: Retry-After сервера или экспонента с полным jitter"""
+    if hint is not None:
+        return min(hint, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+@lru_cache(maxsize=64)
+def url_host(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+def request(method: str, url: str, read_timeout: float, retries: int = MAX_RETRIES, **kwargs: Any) -> requests.Response:
+    """Запрос через общую сессию с раздельными таймаутами соединения и чтения
+
+    Повторяются ответы 429/5xx и ошибки соединения, не больше retries раз.
+    Таймаут чтения не повторяется: запрос мог уже выполниться, а ждать ответ
+    модели второй раз дороже, чем отдать ошибку. Последний ответ возвращается
+    как есть — статус проверяет вызывающий код (raise_for_status).
+    Каждая попытка попадает в гистограмму задержек хоста (metrics); для
+    stream=True это время до заголовков ответа.
+    """
+    session = get_session()
+    host = url_host(url)
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=(CONNECT_TIMEOUT, read_timeout), **kwargs)
+        except requests.exceptions.RequestException as e:
+            METRICS.upstream(host, 'error', time.perf_counter() - started)
+            # ReadTimeout не повторяется: это не ConnectionError
+            if not isinstance(e, requests.exceptions.ConnectionError) or attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            METRICS.upstream(host, str(response.status_code), time.perf_counter() - started)
+            if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                return response
+            # Соединение возвращается в пул только после чтения или закрытия ответа
+            response.close()
+            delay = backoff_delay(attempt, retry_after(response))
+        time.sleep(delay)
+        attempt += 1
@@ -1,11 +1,36 @@
 import json
 import os
+import time
+from typing import Any, Dict
+
 import requests
 
+from completion_cache import CompletionCache, completion_key
+from http_client import request
+from metrics import METRICS, current, instrumented
+from singleflight import SingleFlight, flight_key
+
+DEEPSEEK_URL = os.environ.get('DEEPSEEK_URL', 'https://api.deepseek.com/v1/chat/completions')
+DEEPSEEK_TIMEOUT = 30
+
+# Живет, пока жив инстанс; на диск — только при заданном COMPLETION_CACHE_DIR
+COMPLETION_CACHE = CompletionCache()
+# Одинаковые запросы, пришедшие одновременно, ждут один ответ API
+UPSTREAM_FLIGHTS = SingleFlight()
+
+@instrumented('deepseek-chat', lambda event: 'options' if event.get('httpMethod') == 'OPTIONS' else 'chat')
 def handler(event: dict, context) -> dict:
     """
     DeepSeek API интеграция для чата (работает без VPN из России)
     Использует официальный API DeepSeek: https://api.deepseek.com
+    
+    cache=true включает кэш ответов для запросов с низкой temperature; в
+    ответе появляются cache (hit/miss) и cacheStats.
+    
+    Одинаковые одновременные запросы уходят в API один раз;
+    ответ, полученный из чужого запроса, помечен coalesced: true.
+    
+    GET ?action=metrics&token=<METRICS_TOKEN> отдает метрики инстанса в формате Prometheus.
     """
     method = event.get('httpMethod', 'POST')
     
@@ -29,6 +54,8 @@ def handler(event: dict, context) -> dict:
     
     try:
         body = json.loads(event.get('body', '{}'))
+        timer = current()
+        timer.lap('body_parse')
         messages = body.get('messages', [])
         model = body.get('model', 'deepseek-chat')
         temperature = body.get('temperature', 0.8)
@@ -41,6 +68,14 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({'error': 'messages required'})
             }
         
+        # Строка вместо числа сломала бы сравнение в кэше ответов
+        if isinstance(temperature, bool) or not isinstance(temperature, (int, float)):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'temperature must be a number'})
+            }
+        
         api_key = os.environ.get('DEEPSEEK_API_KEY')
         if not api_key:
             return {
@@ -49,35 +84,56 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({'error': 'DEEPSEEK_API_KEY not configured'})
             }
         
-        response = requests.post(
-            'https://api.deepseek.com/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': model,
-                'messages': messages,
-                'temperature': temperature,
-                'max_tokens': max_tokens
-            },
-            timeout=30
-        )
+        payload = {
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }
+        
+        cache_key = None
+        if COMPLETION_CACHE.enabled(body, temperature):
+            cache_key = completion_key(model, messages, temperature, max_tokens)
+            cached = COMPLETION_CACHE.get(cache_key)
+            if cached is not None:
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({**cached, 'cache': 'hit', 'cacheStats': COMPLETION_CACHE.stats()},
+                                       ensure_ascii=False)
+                }
         
-        response.raise_for_status()
-        result = response.json()
+        timer.lap('prepare')
+        started = time.perf_counter()
+        result, coalesced = UPSTREAM_FLIGHTS.do(
+            flight_key(DEEPSEEK_URL, api_key, payload),
+            lambda: complete(api_key, payload)
+        )
+        timer.lap('upstream')
+        usage = result.get('usage', {})
+        # Токены склеенного запроса уже учел тот, кто ходил в API
+        if not coalesced:
+            METRICS.tokens(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0),
+                           time.perf_counter() - started)
         
         content = result['choices'][0]['message']['content']
         
+        response_body = {
+            'success': True,
+            'content': content,
+            'model': model,
+            'usage': usage
+        }
+        if cache_key is not None:
+            COMPLETION_CACHE.put(cache_key, response_body, time.perf_counter() - started)
+            response_body = {**response_body, 'cache': 'miss', 'cacheStats': COMPLETION_CACHE.stats()}
+        if coalesced:
+            response_body['coalesced'] = True
+        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'content': content,
-                'model': model,
-                'usage': result.get('usage', {})
-            }, ensure_ascii=False)
+            'body': json.dumps(response_body, ensure_ascii=False)
         }
         
     except requests.exceptions.RequestException as e:
@@ -92,3 +148,20 @@ def handler(event: dict, context) -> dict:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': f'Internal error: {str(e)}'})
         }
+
+
+def complete(api_key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Один запрос completion; ответ API как есть"""
+    response = request(
+        'POST',
+        DEEPSEEK_URL,
+        headers={
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        },
+        json=payload,
+        read_timeout=DEEPSEEK_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()
+
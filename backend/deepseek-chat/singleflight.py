@@ -0,0 +1,104 @@
+"""Склейка одинаковых одновременных запросов к внешним API (single-flight)
+
+Пока запрос с некоторым ключом выполняется, такие же запросы с тем же ключом
+не уходят наружу, а ждут его результата: ответ (или исключение) получают все.
+Так группа стажеров, одновременно открывшая один сценарий, делает один запрос
+к модели, а не по одному на каждого. Ключ снимается, как только запрос
+завершился, — результаты не кэшируются, для этого есть completion_cache.
+
+Результат общий для всех ожидающих, менять его нельзя. Исключение тоже
+общее, поэтому ожидающие поднимают его копию: иначе потоки одновременно
+дописывали бы кадры в __traceback__ одного объекта. SINGLE_FLIGHT=0
+отключает склейку.
+
+Функции деплоятся по отдельности, и копия модуля лежит в каталоге каждой
+из них — правки вносятся во все копии. Копия в chatgpt-polza написана
+по-английски; scripts/check_shared_modules.py проверяет, что код всех копий
+совпадает.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT', '1') == '1'
+
+
+def flight_key(*parts: Any) -> str:
+    """Канонический ключ запроса: не зависит от порядка полей и пробелов в JSON"""
+    canonical = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """Одинаковые по ключу вызовы, идущие одновременно, выполняются один раз"""
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls: Dict[str, Future] = {}
+        self._callers: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: str, call: Callable[[], Any],
+           share: Optional[Callable[[Any, int], None]] = None) -> Tuple[Any, bool]:
+        """(результат call, получен ли он из чужого вызова)
+
+        Исключение call пробрасывается и вызвавшему, и всем ожидавшим.
+        share(result, callers) вызывается один раз до того, как результат
+        получат ожидающие: callers — сколько вызовов его получат, включая
+        вызвавший. Так общий ресурс можно закрыть за последним из них.
+        """
+        if not self.enabled:
+            result = call()
+            if share is not None:
+                share(result, 1)
+            return result, False
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._callers[key] = 1
+                self.calls += 1
+            else:
+                self._callers[key] += 1
+                self.shared += 1
+        if not leader:
+            # exception() ждет так же, как result(), но не поднимает общий объект
+            error = future.exception()
+            if error is not None:
+                raise copy.copy(error).with_traceback(None) from error
+            return future.result(), True
+
+        try:
+            result = call()
+        except BaseException as e:
+            self._forget(key)
+            future.set_exception(e)
+            raise
+        callers = self._forget(key)
+        if share is not None:
+            try:
+                share(result, callers)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+        future.set_result(result)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'inFlight': len(self._calls)}
+
+    def _forget(self, key: str) -> int:
+        """Снимает ключ и возвращает число вызовов, ждущих его результата"""
+        # Снимается до публикации результата: кто пришел после — идет наружу сам
+        with self._lock:
+            del self._calls[key]
+            return self._callers.pop(key)
@@ -0,0 +1,83 @@
+"""
+Bounded concurrent fan-out for batch actions.
+
+Items run on a pool of `concurrency` worker threads, so at most that many
+upstream calls are in flight; results come back in input order. An item
+that runs longer than item_timeout is reported as failed and the batch does
+not wait for it. Its worker thread cannot be interrupted and finishes in the
+background.
+"""
+
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from http_client import POOL_MAXSIZE
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+# More workers than pooled connections would only queue for a connection
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", str(POOL_MAXSIZE)))
+BATCH_ITEM_TIMEOUT = float(os.environ.get("BATCH_ITEM_TIMEOUT", "90"))
+
+# (HTTP status, response body) of one item
+Result = Tuple[int, dict]
+
+
+def parse_concurrency(value) -> int:
+    """Requested concurrency capped by BATCH_MAX_CONCURRENCY; ValueError unless a positive integer."""
+    try:
+        concurrency = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("concurrency must be a number")
+    if concurrency <= 0:
+        raise ValueError("concurrency must be positive")
+    return min(BATCH_MAX_CONCURRENCY, concurrency)
+
+
+def parse_item_timeout(value) -> float:
+    """Per-item timeout in seconds; ValueError unless a positive finite number."""
+    try:
+        item_timeout = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("item_timeout must be a number")
+    if not 0 < item_timeout < math.inf:
+        raise ValueError("item_timeout must be a positive number of seconds")
+    return item_timeout
+
+
+def run_batch(items: list, worker: Callable[[dict], Result], concurrency: int, item_timeout: float) -> List[Result]:
+    """Run worker(item) for every item; an exception becomes a 500 result."""
+    results: List[Optional[Result]] = [None] * len(items)
+    started: Dict[int, float] = {}
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+
+    def run(index: int, item: dict) -> Result:
+        # The timeout counts from the start of the item, not from the time it was queued
+        started[index] = time.monotonic()
+        return worker(item)
+
+    pending = {executor.submit(run, index, item): index for index, item in enumerate(items)}
+    try:
+        while pending:
+            now = time.monotonic()
+            for future, index in list(pending.items()):
+                if index in started and now - started[index] >= item_timeout:
+                    del pending[future]
+                    results[index] = (504, {"error": f"Item timed out after {item_timeout:g}s"})
+
+            # An item started later than now cannot expire before now + item_timeout
+            deadlines = [started[index] + item_timeout for index in pending.values() if index in started]
+            timeout = max(0.0, min(deadlines) - now) if deadlines else item_timeout
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = (500, {"error": str(e)})
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
@@ -0,0 +1,174 @@
+"""Cache of chat completion responses for deterministic requests.
+
+The key is a hash of the canonical JSON of model, messages, temperature and
+max_tokens. Entries live in an in-memory LRU of COMPLETION_CACHE_SIZE entries;
+when COMPLETION_CACHE_DIR is set they are also written to SQLite and survive an
+instance restart. Requests with temperature above
+COMPLETION_CACHE_MAX_TEMPERATURE are not cached: their answers are meant to
+differ.
+
+The cache is enabled per request (cache: true in the body) or for every
+request with COMPLETION_CACHE=always; cache: false in the body always bypasses
+it.
+
+deepseek-chat keeps a Russian copy of this module; change both together.
+scripts/check_shared_modules.py checks that their code matches.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+COMPLETION_CACHE_MODE = os.environ.get("COMPLETION_CACHE", "request")
+COMPLETION_CACHE_SIZE = int(os.environ.get("COMPLETION_CACHE_SIZE", "512"))
+COMPLETION_CACHE_TTL = int(os.environ.get("COMPLETION_CACHE_TTL", str(24 * 3600)))
+COMPLETION_CACHE_MAX_TEMPERATURE = float(os.environ.get("COMPLETION_CACHE_MAX_TEMPERATURE", "0.3"))
+COMPLETION_CACHE_DIR = os.environ.get("COMPLETION_CACHE_DIR", "")
+# The disk keeps more entries than memory: it survives a cold start
+COMPLETION_CACHE_DISK_ENTRIES = int(os.environ.get("COMPLETION_CACHE_DISK_ENTRIES", "10000"))
+
+
+def completion_key(model: str, messages: List[Dict[str, Any]], temperature: Optional[float],
+                   max_tokens: Optional[int]) -> str:
+    """The key does not depend on field order in the messages or on JSON whitespace."""
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """In-memory LRU of responses with an optional SQLite copy and hit counters.
+
+    SQLite errors do not fail the request: a read becomes a miss and a write
+    is skipped.
+    """
+
+    def __init__(self, size: int = COMPLETION_CACHE_SIZE, ttl: int = COMPLETION_CACHE_TTL,
+                 max_temperature: float = COMPLETION_CACHE_MAX_TEMPERATURE,
+                 directory: str = COMPLETION_CACHE_DIR, mode: str = COMPLETION_CACHE_MODE):
+        self.size = size
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.path = os.path.join(directory, "completions.sqlite3") if directory else None
+        self.mode = mode
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def enabled(self, body: Dict[str, Any], temperature: Optional[float]) -> bool:
+        """Whether to cache the request: the cache is on and the temperature is low enough."""
+        requested = body.get("cache")
+        if requested is False or self.size <= 0:
+            return False
+        if not requested and self.mode != "always":
+            return False
+        return temperature is not None and temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["created"] <= now - self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.path:
+            entry = self._load(key, now)
+            if entry is not None:
+                self._remember(key, entry)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry["elapsed"]
+        return entry["value"]
+
+    def put(self, key: str, value: Dict[str, Any], elapsed: float) -> None:
+        """value is the upstream response as sent to the client, elapsed how long it took."""
+        entry = {"value": value, "elapsed": elapsed, "created": time.time()}
+        self._remember(key, entry)
+        if self.path:
+            self._store(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "savedMs": round(self.saved_seconds * 1000),
+                "entries": len(self._entries),
+            }
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, elapsed REAL NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        return connection
+
+    def _load(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    row = connection.execute(
+                        "SELECT value, elapsed, created FROM completions WHERE key = ? AND created > ?",
+                        (key, now - self.ttl)
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    connection.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+                return {"value": json.loads(row[0]), "elapsed": row[1], "created": row[2]}
+            finally:
+                connection.close()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"Completion cache unavailable: {str(e)}")
+            return None
+
+    def _store(self, key: str, entry: Dict[str, Any]) -> None:
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO completions (key, value, elapsed, created, accessed) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, json.dumps(entry["value"], ensure_ascii=False), entry["elapsed"],
+                         entry["created"], entry["created"])
+                    )
+                    connection.execute("DELETE FROM completions WHERE created <= ?", (entry["created"] - self.ttl,))
+                    # Least recently used entries over the limit
+                    connection.execute(
+                        "DELETE FROM completions WHERE key IN ("
+                        "SELECT key FROM completions ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (COMPLETION_CACHE_DISK_ENTRIES,)
+                    )
+            finally:
+                connection.close()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Failed to store the response in the cache: {str(e)}")
@@ -0,0 +1,195 @@
+"""
+Token-budgeted conversation history for generate requests.
+
+Trainer sessions resend the whole conversation on every turn. To keep the
+upstream prompt bounded, the system prompt and the most recent turns are kept
+verbatim within a token budget, and older turns are folded into a rolling
+summary that is generated once and reused on later turns of the same session.
+Trimming is opt-in, per request (history_budget) or per instance
+(HISTORY_TOKEN_BUDGET).
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Prompt budget for system prompt + summary + recent turns. Trimming is opt-in:
+# 0 (the default) sends the history as is, unless a request sets history_budget
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "0"))
+# After a cut the recent window shrinks to this share of the budget, so a new
+# summary is needed only every few turns rather than on every turn
+HISTORY_LOW_WATERMARK = 0.6
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_CACHE_SIZE = 1024
+SUMMARY_CACHE_TTL = 6 * 3600
+# Per-message framing overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the earlier part of a customer support conversation so it can replace "
+    "those messages. Keep the customer's problem, order details, emotions and every "
+    "promise or solution offered by the support agent. Write in the language of the "
+    "conversation, at most {max_words} words, plain text."
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+WORD = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+Messages = List[Dict[str, str]]
+Summarize = Callable[[Messages], Tuple[str, dict]]
+
+
+def count_tokens(text: str) -> int:
+    """BPE-like token estimate.
+
+    Words and punctuation are split apart and long words are charged extra
+    pieces; Cyrillic words split into more tokens than Latin ones. It errs
+    slightly high, which keeps the budget safe.
+    """
+    tokens = 0
+    for piece in WORD.findall(text):
+        tokens += 1 + len(piece) // (4 if piece.isascii() else 3)
+    return tokens
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content") or "")
+
+
+def messages_digest(messages: Messages) -> str:
+    canonical = json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """Rolling summaries keyed by session; LRU-bounded, expires idle sessions.
+
+    An entry stores how many turns it covers and a digest of those turns, so
+    it is reused only if the client resent the same history prefix.
+    """
+
+    def __init__(self, size: int = SUMMARY_CACHE_SIZE, ttl: int = SUMMARY_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(session_key)
+            if entry is None or entry["updated"] <= time.time() - self.ttl:
+                self._entries.pop(session_key, None)
+                return None
+            self._entries.move_to_end(session_key)
+            return entry
+
+    def put(self, session_key: str, covered: int, digest: str, summary: str) -> None:
+        with self._lock:
+            self._entries[session_key] = {
+                "covered": covered,
+                "digest": digest,
+                "summary": summary,
+                "updated": time.time(),
+            }
+            self._entries.move_to_end(session_key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+def summary_request(model: str, messages: Messages) -> dict:
+    """Chat completion payload that summarizes messages (earlier summary included)."""
+    transcript = "\n".join(f"{message.get('role')}: {message.get('content')}" for message in messages)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT.format(max_words=SUMMARY_MAX_TOKENS // 2)},
+            {"role": "user", "content": transcript},
+        ],
+        "temperature": 0.2,
+        "max_tokens": SUMMARY_MAX_TOKENS,
+    }
+
+
+def session_key(system: Messages, turns: Messages, session_id: Optional[str]) -> str:
+    """Explicit session id, or the scenario prompt plus the opening turn.
+
+    Sessions that share a derived key also share their history prefix, and
+    the prefix digest check keeps them from reusing each other's summary.
+    """
+    if session_id:
+        return f"id:{session_id}"
+    return "prefix:" + messages_digest(system + turns[:1])
+
+
+def fit_history(
+    messages: Messages,
+    summarize: Summarize,
+    summaries: SummaryCache,
+    budget: int = HISTORY_TOKEN_BUDGET,
+    session_id: Optional[str] = None,
+) -> Tuple[Messages, dict]:
+    """Fit messages into the token budget; returns (messages, report).
+
+    Leading system messages and the latest turn are always kept. When the
+    history is over budget, the oldest turns are cut until the recent window
+    drops to the low watermark, and the cut turns are summarized. The summary
+    is extended incrementally: only turns cut since the cached summary go to
+    summarize(). If summarization fails the cut turns are simply dropped.
+    """
+    total = sum(message_tokens(message) for message in messages)
+    report = {"prompt_tokens_estimate": total, "summarized_messages": 0, "summary": "none"}
+    if budget <= 0 or total <= budget:
+        return messages, report
+
+    leading = 0
+    while leading < len(messages) and messages[leading].get("role") == "system":
+        leading += 1
+    system, turns = messages[:leading], messages[leading:]
+    key = session_key(system, turns, session_id)
+
+    # Keep the previous cut while the window still fits: the summary stays valid
+    cached = summaries.get(key)
+    covered = 0
+    if cached and cached["covered"] < len(turns) and messages_digest(turns[:cached["covered"]]) == cached["digest"]:
+        covered = cached["covered"]
+
+    fixed = sum(message_tokens(message) for message in system) + SUMMARY_MAX_TOKENS + MESSAGE_OVERHEAD_TOKENS
+    turn_tokens = [message_tokens(message) for message in turns]
+    if fixed + sum(turn_tokens[covered:]) > budget:
+        # Cut down to the low watermark so the next few turns fit without a new summary
+        target = max(0, int(budget * HISTORY_LOW_WATERMARK) - fixed)
+        window = sum(turn_tokens[covered:])
+        cut = covered
+        while cut < len(turns) - 1 and window > target:
+            window -= turn_tokens[cut]
+            cut += 1
+    else:
+        cut = covered
+
+    summary = cached["summary"] if covered else ""
+    if covered:
+        report["summary"] = "cached"
+    if cut > covered:
+        previous = [{"role": "system", "content": SUMMARY_PREFIX + summary}] if summary else []
+        try:
+            summary, usage = summarize(previous + turns[covered:cut])
+            summaries.put(key, cut, messages_digest(turns[:cut]), summary)
+            report["summary"] = "updated"
+            report["summary_usage"] = usage
+        except Exception as e:
+            print(f"History summary failed, dropping {cut - covered} old messages: {e}")
+            report["summary"] = "failed"
+
+    fitted = list(system)
+    if summary:
+        fitted.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+    fitted.extend(turns[cut:])
+
+    report["prompt_tokens_estimate"] = sum(message_tokens(message) for message in fitted)
+    report["summarized_messages"] = cut
+    return fitted, report
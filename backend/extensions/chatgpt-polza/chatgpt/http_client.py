@@ -0,0 +1,105 @@
+"""Shared HTTP client for the backend functions: one requests.Session per instance.
+
+Connections (TCP+TLS) stay open between calls on a warm instance, so a repeat
+request to the same API does not pay for connection setup again.
+Functions are deployed separately, so each function that needs this module
+keeps its own copy; change all copies together. The other copies are in
+Russian, and scripts/check_shared_modules.py checks that the code of all
+copies matches.
+"""
+
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+
+# pool_connections is the number of hosts with their own pool, pool_maxsize the
+# connections per host: at least the number of concurrent requests (DEEPSEEK_CONCURRENCY)
+POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "16"))
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Module session: created on the first request and kept for the instance lifetime."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # request() retries by itself: urllib3 cannot do jitter or Retry-After for POST
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Delay from the Retry-After header (seconds only, HTTP dates are not parsed)."""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int, hint: Optional[float] = None) -> float:
+    """Delay before a retry: the server's Retry-After or exponential backoff with full jitter."""
+    if hint is not None:
+        return min(hint, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+@lru_cache(maxsize=64)
+def url_host(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+def request(method: str, url: str, read_timeout: float, retries: int = MAX_RETRIES, **kwargs: Any) -> requests.Response:
+    """Request through the shared session with separate connect and read timeouts.
+
+    429/5xx responses and connection errors are retried at most retries times.
+    A read timeout is not retried: the request may already have run, and
+    waiting for the model a second time costs more than returning the error.
+    The last response is returned as is; the caller checks the status
+    (raise_for_status). Every attempt goes into the host latency histogram
+    (metrics); with stream=True that is the time to the response headers.
+    """
+    session = get_session()
+    host = url_host(url)
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=(CONNECT_TIMEOUT, read_timeout), **kwargs)
+        except requests.exceptions.RequestException as e:
+            METRICS.upstream(host, "error", time.perf_counter() - started)
+            # ReadTimeout is not retried: it is not a ConnectionError
+            if not isinstance(e, requests.exceptions.ConnectionError) or attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            METRICS.upstream(host, str(response.status_code), time.perf_counter() - started)
+            if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                return response
+            # The connection returns to the pool only once the response is read or closed
+            response.close()
+            delay = backoff_delay(attempt, retry_after(response))
+        time.sleep(delay)
+        attempt += 1
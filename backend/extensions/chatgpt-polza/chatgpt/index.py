@@ -5,27 +5,64 @@ OpenAI GPT models via Polza.ai provider.
 
 Actions:
 - generate: Generate text completion
+- batch_generate: Run several generate requests concurrently
+- score_sessions: Score stored trainer sessions in bulk
 - models: List available GPT models
 - test: Test API connection
+- metrics: Instance metrics in Prometheus text format (GET, ?token=<METRICS_TOKEN>)
 """
 
 import json
 import os
+import threading
+import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Tuple
 
 import requests
 
+from batch import (
+    BATCH_CONCURRENCY,
+    BATCH_ITEM_TIMEOUT,
+    BATCH_MAX_ITEMS,
+    parse_concurrency,
+    parse_item_timeout,
+    run_batch,
+)
+from completion_cache import CompletionCache, completion_key
+from history import HISTORY_TOKEN_BUDGET, SummaryCache, fit_history, summary_request
+from http_client import MAX_RETRIES, request
+from metrics import METRICS, current, instrumented
+from model_catalog import ModelCatalog
+from router import Provider, Router
+from scoring import JUDGE_BATCH_SIZE, SCORING_MAX_SESSIONS, judge_request, lexical_scores, parse_verdicts
+from singleflight import SingleFlight, flight_key
+
 
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
 
 # Provider: Polza.ai (OpenAI-compatible API)
-PROVIDER_BASE_URL = "https://api.polza.ai/api/v1"
+PROVIDER_BASE_URL = os.environ.get("POLZA_BASE_URL", "https://api.polza.ai/api/v1")
 DEFAULT_MODEL = "openai/gpt-4o-mini"
 DEFAULT_TIMEOUT = 60
 
+# Fallback provider for latency-aware routing (route: "auto" or LLM_ROUTING=auto)
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+DEEPSEEK_MODEL = os.environ.get("DEEPSEEK_MODEL", "deepseek-chat")
+LLM_ROUTING = os.environ.get("LLM_ROUTING", "off")
+
+# Opt-in cache for low-temperature completions, kept for the instance lifetime
+COMPLETION_CACHE = CompletionCache()
+# Rolling summaries of old turns, reused across turns of the same session
+HISTORY_SUMMARIES = SummaryCache()
+# Identical provider requests in flight at the same time share one upstream call
+UPSTREAM_FLIGHTS = SingleFlight()
+
+# Metric labels: anything else is counted as "unknown" to keep the series count bounded
+ACTIONS = frozenset({"generate", "batch_generate", "score_sessions", "models", "test"})
+
 
 
 @dataclass
@@ -74,21 +111,53 @@ def get_api_key() -> str:
     return api_key
 
 
-def make_request(endpoint: str, method: str = "POST", data: Optional[dict] = None) -> dict:
-    """Make request to provider API."""
-    api_key = get_api_key()
-    url = f"{PROVIDER_BASE_URL}/{endpoint}"
+def make_request(
+    endpoint: str,
+    method: str = "POST",
+    data: Optional[dict] = None,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    retries: int = MAX_RETRIES,
+) -> dict:
+    """Make request to provider API (Polza unless base_url/api_key are given)."""
+    return make_shared_request(endpoint, method, data, base_url, api_key, retries)[0]
+
+
+def make_shared_request(
+    endpoint: str,
+    method: str = "POST",
+    data: Optional[dict] = None,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    retries: int = MAX_RETRIES,
+) -> Tuple[dict, bool]:
+    """make_request that also tells whether the result was shared.
+
+    A request identical to one already in flight (same URL, key and payload)
+    waits for that call instead of going upstream; its result or error is
+    returned to every caller. Returns (result, coalesced).
+    """
+    api_key = api_key or get_api_key()
+    url = f"{base_url or PROVIDER_BASE_URL}/{endpoint}"
+    return UPSTREAM_FLIGHTS.do(
+        flight_key(method, url, api_key, data),
+        lambda: send_request(method, url, api_key, data, retries),
+    )
+
 
+def send_request(method: str, url: str, api_key: str, data: Optional[dict], retries: int) -> dict:
+    """Send one request upstream; HTTP and transport errors become builtin exceptions."""
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}",
     }
 
     try:
+        # Shared pooled session: warm invocations reuse the TLS connection
         if method == "GET":
-            response = requests.get(url, headers=headers, timeout=DEFAULT_TIMEOUT)
+            response = request("GET", url, read_timeout=DEFAULT_TIMEOUT, retries=retries, headers=headers)
         else:
-            response = requests.post(url, headers=headers, json=data, timeout=DEFAULT_TIMEOUT)
+            response = request("POST", url, read_timeout=DEFAULT_TIMEOUT, retries=retries, headers=headers, json=data)
 
         response.raise_for_status()
         return response.json()
@@ -105,6 +174,31 @@ def make_request(endpoint: str, method: str = "POST", data: Optional[dict] = Non
         raise ValueError(error_body.get("error", {}).get("message", str(e)))
 
 
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    """Router over the providers that have API keys, created on first use."""
+    global _router
+    with _router_lock:
+        if _router is not None:
+            return _router
+        providers = []
+        if os.environ.get("POLZA_AI_API_KEY"):
+            providers.append(Provider("polza", PROVIDER_BASE_URL, os.environ["POLZA_AI_API_KEY"], lambda model: model))
+        if os.environ.get("DEEPSEEK_API_KEY"):
+            providers.append(Provider("deepseek", DEEPSEEK_BASE_URL, os.environ["DEEPSEEK_API_KEY"],
+                                      lambda model: DEEPSEEK_MODEL))
+        if not providers:
+            raise ValueError("POLZA_AI_API_KEY not configured")
+        # Hedging replaces retries: a slow or failing provider is covered by the other one
+        _router = Router(providers, lambda provider, data: make_request(
+            "chat/completions", data=data, base_url=provider.base_url, api_key=provider.api_key, retries=0
+        ))
+        return _router
+
+
 # =============================================================================
 # ACTION HANDLERS
 # =============================================================================
@@ -119,10 +213,23 @@ def handle_generate(body: dict) -> dict:
     - model: string - optional (default: openai/gpt-4o-mini)
     - temperature: float - optional (default: 0.7)
     - max_tokens: int - optional
+    - cache: bool - optional, reuse identical low-temperature completions
+    - session_id: string - optional, trainer session for the history summary
+    - history_budget: int >= 0 - optional prompt token budget; history is trimmed only
+      when this or HISTORY_TOKEN_BUDGET is above 0 (default: off)
+    - route: "auto" - optional, route between Polza and DeepSeek by latency
+
+    An identical request already in flight is not sent again: its result is
+    returned with coalesced: true.
     """
+    return cors_response(*generate(body))
+
+
+def generate(body: dict) -> Tuple[int, dict]:
+    """Run one generate request; returns (status, response body)."""
     messages = body.get("messages", [])
     if not messages:
-        return cors_response(400, {"error": "messages is required"})
+        return 400, {"error": "messages is required"}
 
     model = body.get("model", DEFAULT_MODEL)
     temperature = body.get("temperature", 0.7)
@@ -130,27 +237,62 @@ def handle_generate(body: dict) -> dict:
 
     # Validate model starts with openai/
     if not model.startswith("openai/"):
-        return cors_response(400, {
-            "error": "This extension only supports OpenAI models (openai/*)"
-        })
+        return 400, {"error": "This extension only supports OpenAI models (openai/*)"}
 
-    request_data = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-    }
+    # A string here would break the cache's temperature comparison
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)):
+        return 400, {"error": "temperature must be a number"}
+
+    history_budget = body.get("history_budget", HISTORY_TOKEN_BUDGET)
+    if isinstance(history_budget, bool) or not isinstance(history_budget, int) or history_budget < 0:
+        return 400, {"error": "history_budget must be a non-negative integer"}
 
-    if max_tokens:
-        request_data["max_tokens"] = max_tokens
+    cache_key = None
+    if COMPLETION_CACHE.enabled(body, temperature):
+        cache_key = completion_key(model, messages, temperature, max_tokens)
+        cached = COMPLETION_CACHE.get(cache_key)
+        if cached is not None:
+            return 200, {**cached, "cache": "hit", "cacheStats": COMPLETION_CACHE.stats()}
 
     try:
-        result = make_request("chat/completions", data=request_data)
+        # Long sessions: old turns are replaced by a cached rolling summary
+        messages, history = fit_history(
+            messages,
+            lambda old: summarize_history(model, old),
+            HISTORY_SUMMARIES,
+            budget=history_budget,
+            session_id=body.get("session_id"),
+        )
+        current().lap("history")
+
+        request_data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+        }
+
+        if max_tokens:
+            request_data["max_tokens"] = max_tokens
+
+        started = time.perf_counter()
+        routing = None
+        coalesced = False
+        if body.get("route", LLM_ROUTING) == "auto":
+            result, provider, routing = get_router().complete(request_data)
+            routing["provider"] = provider
+        else:
+            result, coalesced = make_shared_request("chat/completions", data=request_data)
+        current().lap("upstream")
 
         choice = result.get("choices", [{}])[0]
         message = choice.get("message", {})
         usage = result.get("usage", {})
+        # Tokens of a shared call are counted once, by the caller that sent it
+        if not coalesced:
+            METRICS.tokens(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                           time.perf_counter() - started)
 
-        return cors_response(200, {
+        response_body = {
             "success": True,
             "content": message.get("content", ""),
             "model": result.get("model", model),
@@ -160,37 +302,231 @@ def handle_generate(body: dict) -> dict:
                 "total_tokens": usage.get("total_tokens", 0),
             },
             "finish_reason": choice.get("finish_reason", "stop"),
-        })
+        }
+        if routing:
+            response_body["routing"] = routing
+        if coalesced:
+            response_body["coalesced"] = True
+        if history["summarized_messages"]:
+            response_body["history"] = history
+        if cache_key is not None:
+            COMPLETION_CACHE.put(cache_key, response_body, time.perf_counter() - started)
+            response_body = {**response_body, "cache": "miss", "cacheStats": COMPLETION_CACHE.stats()}
+
+        return 200, response_body
     except (TimeoutError, ConnectionError) as e:
-        return cors_response(503, {"error": str(e)})
+        return 503, {"error": str(e)}
     except ValueError as e:
-        return cors_response(400, {"error": str(e)})
+        return 400, {"error": str(e)}
     except Exception as e:
-        return cors_response(500, {"error": str(e)})
+        return 500, {"error": str(e)}
+
+
+def handle_batch_generate(body: dict) -> dict:
+    """
+    POST ?action=batch_generate
+    Run several generate requests concurrently.
+
+    Body:
+    - items: list of generate bodies (see handle_generate) - required
+    - concurrency: int > 0 - optional, requests in flight (default: 8, capped by BATCH_MAX_CONCURRENCY)
+    - item_timeout: float > 0 - optional, seconds per item (default: 90)
+
+    Results keep the order of items. A failed item carries its own status and
+    error and does not fail the batch. usage sums the tokens of items answered
+    by the provider (cache hits and coalesced duplicates are not billed and
+    not counted).
+    """
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        return cors_response(400, {"error": "items must be a non-empty list"})
+    if len(items) > BATCH_MAX_ITEMS:
+        return cors_response(400, {"error": f"Too many items: {len(items)} > {BATCH_MAX_ITEMS}"})
+
+    try:
+        concurrency = parse_concurrency(body.get("concurrency", BATCH_CONCURRENCY))
+        item_timeout = parse_item_timeout(body.get("item_timeout", BATCH_ITEM_TIMEOUT))
+    except ValueError as e:
+        return cors_response(400, {"error": str(e)})
+
+    def run_item(item) -> Tuple[int, dict]:
+        if not isinstance(item, dict):
+            return 400, {"error": "item must be an object"}
+        # Items run on pool threads: each gets its own timer, phases and log line
+        timer = METRICS.begin("batch_generate_item")
+        status, result = 500, {}
+        try:
+            status, result = generate(item)
+            return status, result
+        finally:
+            METRICS.end(timer, status)
+
+    started = time.perf_counter()
+    outcomes = run_batch(items, run_item, concurrency, item_timeout)
+
+    results = []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for index, (status, result) in enumerate(outcomes):
+        results.append({"index": index, "status": status, **result})
+        if status == 200 and result.get("cache") != "hit" and not result.get("coalesced"):
+            for field in usage:
+                usage[field] += result["usage"][field]
+    succeeded = sum(status == 200 for status, _ in outcomes)
+
+    return cors_response(200, {
+        "success": True,
+        "results": results,
+        "usage": usage,
+        "succeeded": succeeded,
+        "failed": len(outcomes) - succeeded,
+        "concurrency": concurrency,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+
+
+def handle_score_sessions(body: dict) -> dict:
+    """
+    POST ?action=score_sessions
+    Score trainer sessions: lexical tier for all, LLM judge for ambiguous ones.
+
+    Body:
+    - sessions: list of {id, messages: [{sender, text, ts}]} - required, messages a list of objects
+      (sender "user" is the trainee, as in TrainerTab; ts in seconds, optional)
+    - judge: bool - optional (default: true), escalate ambiguous sessions to the LLM
+    - model: string - optional judge model (default: openai/gpt-4o-mini)
+    - concurrency: int - optional judge requests in flight (default: 8)
+    """
+    sessions = body.get("sessions")
+    if not isinstance(sessions, list) or not sessions:
+        return cors_response(400, {"error": "sessions must be a non-empty list"})
+    if not all(isinstance(session, dict) for session in sessions):
+        return cors_response(400, {"error": "every session must be an object"})
+    for session in sessions:
+        messages = session.get("messages")
+        if messages is None:
+            continue
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            return cors_response(400, {"error": "session messages must be a list of objects"})
+    if len(sessions) > SCORING_MAX_SESSIONS:
+        return cors_response(400, {"error": f"Too many sessions: {len(sessions)} > {SCORING_MAX_SESSIONS}"})
+    model = body.get("model", DEFAULT_MODEL)
+    if not model.startswith("openai/"):
+        return cors_response(400, {"error": "This extension only supports OpenAI models (openai/*)"})
+    try:
+        concurrency = parse_concurrency(body.get("concurrency", BATCH_CONCURRENCY))
+    except ValueError as e:
+        return cors_response(400, {"error": str(e)})
+
+    started = time.perf_counter()
+    scores = lexical_scores(sessions)
+    lexical_ms = (time.perf_counter() - started) * 1000
+    current().lap("lexical")
+
+    def score(value) -> Optional[float]:
+        return None if value is None else round(value, 1)
+
+    results = [{
+        "id": session.get("id", index),
+        "tier": "lexical" if lexical["messages"] else "none",
+        "messages": lexical["messages"],
+        "empathy": score(lexical["empathy"]),
+        "professionalism": score(lexical["professionalism"]),
+        "speed": score(lexical["speed"]),
+    } for index, (session, lexical) in enumerate(zip(sessions, scores))]
+
+    escalated = [index for index, lexical in enumerate(scores) if lexical["ambiguous"]] if body.get("judge", True) else []
+    batches = [escalated[start:start + JUDGE_BATCH_SIZE] for start in range(0, len(escalated), JUDGE_BATCH_SIZE)]
+
+    def judge(batch: list) -> Tuple[int, dict]:
+        started = time.perf_counter()
+        result = make_request("chat/completions", data=judge_request(model, [sessions[index] for index in batch]))
+        usage = result.get("usage", {})
+        METRICS.tokens(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                       time.perf_counter() - started, action="score_sessions")
+        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        return 200, {"verdicts": parse_verdicts(content, len(batch)), "usage": result.get("usage", {})}
+
+    started = time.perf_counter()
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    judged = judge_errors = 0
+    for batch, (status, outcome) in zip(batches, run_batch(batches, judge, concurrency, BATCH_ITEM_TIMEOUT)):
+        if status != 200:
+            judge_errors += 1
+            for index in batch:
+                results[index]["judge_error"] = outcome["error"]
+            continue
+        for field in usage:
+            usage[field] += outcome["usage"].get(field, 0)
+        for index, verdict in zip(batch, outcome["verdicts"]):
+            if verdict is None:
+                results[index]["judge_error"] = "session missing from judge reply"
+                continue
+            result = results[index]
+            result["lexical"] = {"empathy": result["empathy"], "professionalism": result["professionalism"]}
+            result["empathy"], result["professionalism"] = verdict
+            result["tier"] = "llm"
+            judged += 1
+    current().lap("judge")
+
+    return cors_response(200, {
+        "success": True,
+        "results": results,
+        "summary": {
+            "sessions": len(sessions),
+            "escalated": len(escalated),
+            "escalated_share": round(len(escalated) / len(sessions), 4),
+            "judged": judged,
+            "judge_requests": len(batches),
+            "judge_errors": judge_errors,
+            "lexical_ms": round(lexical_ms, 1),
+            "judge_ms": round((time.perf_counter() - started) * 1000, 1),
+            "usage": usage,
+        },
+    })
+
+
+def summarize_history(model: str, messages: list) -> tuple:
+    """Summarize old turns upstream; returns (summary, usage)."""
+    result = make_request("chat/completions", data=summary_request(model, messages))
+    content = result.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+    if not content:
+        raise ValueError("empty summary")
+    return content, result.get("usage", {})
+
+
+def fetch_openai_models() -> list:
+    """Fetch the provider's model list, keeping only OpenAI models."""
+    result = make_request("models", method="GET")
+
+    models = []
+    for model in result.get("data", []):
+        model_id = model.get("id", "")
+        if model_id.startswith("openai/"):
+            models.append({
+                "id": model_id,
+                "name": model_id.replace("openai/", "").upper(),
+            })
+    return models
+
+
+# Survives warm invocations; the file snapshot speeds up cold starts
+MODEL_CATALOG = ModelCatalog(fetch_openai_models)
 
 
 def handle_models(body: dict) -> dict:
     """
     GET/POST ?action=models
-    List available GPT models from Polza.ai.
+    List available GPT models from Polza.ai (cached, refreshed in the background).
     """
     try:
-        result = make_request("models", method="GET")
-
-        # Filter only OpenAI models
-        models = []
-        for model in result.get("data", []):
-            model_id = model.get("id", "")
-            if model_id.startswith("openai/"):
-                models.append({
-                    "id": model_id,
-                    "name": model_id.replace("openai/", "").upper(),
-                })
+        models, cache_status = MODEL_CATALOG.get()
+        current().lap("catalog")
 
         return cors_response(200, {
             "success": True,
             "models": models,
             "provider": "polza.ai",
+            "cache": cache_status,
         })
     except (TimeoutError, ConnectionError) as e:
         return cors_response(503, {"error": str(e)})
@@ -213,6 +549,7 @@ def handle_test(body: dict) -> dict:
             "messages": [{"role": "user", "content": "Say 'OK' if you can hear me."}],
             "max_tokens": 10,
         })
+        current().lap("upstream")
 
         choice = result.get("choices", [{}])[0]
         content = choice.get("message", {}).get("content", "")
@@ -235,6 +572,14 @@ def handle_test(body: dict) -> dict:
 # MAIN HANDLER
 # =============================================================================
 
+def metrics_action(event: dict) -> str:
+    if event.get("httpMethod") == "OPTIONS":
+        return "options"
+    action = (event.get("queryStringParameters") or {}).get("action", "")
+    return action if action in ACTIONS else "unknown"
+
+
+@instrumented("chatgpt-polza", metrics_action)
 def handler(event: dict, context) -> dict:
     """Main entry point."""
     method = event.get("httpMethod", "POST")
@@ -255,9 +600,14 @@ def handler(event: dict, context) -> dict:
             body = json.loads(raw_body) if raw_body else {}
         except json.JSONDecodeError:
             return cors_response(400, {"error": "Invalid JSON"})
+    current().lap("body_parse")
 
     if action == "generate":
         return handle_generate(body)
+    elif action == "batch_generate":
+        return handle_batch_generate(body)
+    elif action == "score_sessions":
+        return handle_score_sessions(body)
     elif action == "models":
         return handle_models(body)
     elif action == "test":
@@ -0,0 +1,343 @@
+"""In-memory metrics of a function instance: request phases, API latency, tokens.
+
+Fixed-size histograms in the spirit of HDR Histogram: a value falls into a
+bucket of a logarithmic scale with SUB_BUCKETS buckets per octave (quantile
+error at most 1/SUB_BUCKETS), so memory does not grow with the request count.
+Phases and tokens of a request accumulate in RequestTimer and are written to
+the histograms in one pass under the lock at the end of the request: the extra
+work is about a microsecond per phase, and the JSON log line adds about ten
+more. GET ?action=metrics returns everything in the Prometheus text format,
+only with ?token=<METRICS_TOKEN>; without METRICS_TOKEN it is closed (403).
+A JSON line per request goes to stdout only with METRICS_LOG=1.
+
+Functions are deployed separately, so each function that needs this module
+keeps its own copy; change all copies together. The other copies are in
+Russian, and scripts/check_shared_modules.py checks that the code of all
+copies matches.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+METRICS_PREFIX = os.environ.get("METRICS_PREFIX", "backend")
+METRICS_LOG = os.environ.get("METRICS_LOG", "0") == "1"
+# Metrics are served only with ?token=<METRICS_TOKEN>; while it is unset they are closed
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+# Values up to 2^40 units (12 days in microseconds); larger ones go to the last bucket
+MAX_BITS = 40
+BUCKETS = (MAX_BITS - SUB_BITS) * SUB_BUCKETS + 2 * SUB_BUCKETS
+
+# le bounds in the Prometheus output: the fine buckets are folded into them
+SECONDS_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                  0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """[lower, upper) bounds of a bucket in histogram units."""
+    shift = max(0, (index >> SUB_BITS) - 1)
+    top = index - (shift << SUB_BITS)
+    return top << shift, (top + 1) << shift
+
+
+class Histogram:
+    """Histogram of non-negative values; scale is units per value unit.
+
+    For seconds scale=1e6, so buckets are in microseconds. Recording does not
+    take a lock: the caller (Metrics) holds it.
+    """
+
+    def __init__(self, scale: float):
+        self.scale = scale
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, value: float) -> None:
+        # Bucket index: exact below 2·SUB_BUCKETS, then SUB_BUCKETS per octave
+        scaled = int(value * self.scale) if value > 0 else 0
+        bits = scaled.bit_length()
+        if bits <= SUB_BITS + 1:
+            index = scaled
+        elif bits > MAX_BITS:
+            index = BUCKETS - 1
+        else:
+            shift = bits - SUB_BITS - 1
+            index = (shift << SUB_BITS) + (scaled >> shift)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Middle of the bucket that holds quantile q."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                lower, upper = bucket_bounds(index)
+                return (lower + upper) / 2 / self.scale
+        return 0.0
+
+    def cumulative(self, bounds: Tuple[float, ...]) -> List[int]:
+        """Count of values not above each bound (a bucket counts whole, by its upper bound)."""
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            limit = bound * self.scale
+            while index < BUCKETS and bucket_bounds(index)[1] <= limit:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class RequestTimer:
+    """Phases of one request: lap(phase) assigns the time since the last mark to phase."""
+
+    __slots__ = ("action", "started", "last", "phases", "tokens", "token_seconds")
+
+    def __init__(self, action: str):
+        self.action = action
+        self.started = self.last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.tokens: Optional[Tuple[int, int]] = None
+        self.token_seconds = 0.0
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+
+class _NullTimer:
+    """Stand-in outside a request (e.g. in pool threads): marks do nothing."""
+
+    action = None
+
+    def lap(self, phase: str) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+_current: contextvars.ContextVar = contextvars.ContextVar("request_timer", default=_NULL_TIMER)
+
+
+def current():
+    """Timer of the current request, or the stand-in."""
+    return _current.get()
+
+
+class _ActionSeries:
+    """Histograms and counters of one action, so the end of a request builds no labels."""
+
+    __slots__ = ("request", "phases", "statuses", "tokens_in", "tokens_out", "rate")
+
+    def __init__(self, metrics: "Metrics", action: str):
+        labels = (("action", action),)
+        self.request = metrics._histogram("request_seconds", labels, 1e6)
+        self.phases: Dict[str, Histogram] = {}
+        self.statuses: Dict[int, Labels] = {}
+        self.tokens_in = ("tokens_total", labels + (("direction", "in"),))
+        self.tokens_out = ("tokens_total", labels + (("direction", "out"),))
+        self.rate = metrics._histogram("tokens_per_second", labels, 1e3)
+
+
+class Metrics:
+    def __init__(self):
+        self.function = ""
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._actions: Dict[str, _ActionSeries] = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, name: str, labels: Labels, scale: float) -> Histogram:
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = Histogram(scale)
+        return histogram
+
+    def _add(self, name: str, labels: Labels, amount: float) -> None:
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _series(self, action: str) -> _ActionSeries:
+        """Called with the lock held."""
+        series = self._actions.get(action)
+        if series is None:
+            series = self._actions[action] = _ActionSeries(self, action)
+        return series
+
+    def _record_tokens(self, series: _ActionSeries, prompt_tokens: int, completion_tokens: int,
+                       seconds: Optional[float]) -> None:
+        """Called with the lock held."""
+        counters = self._counters
+        counters[series.tokens_in] = counters.get(series.tokens_in, 0) + prompt_tokens
+        counters[series.tokens_out] = counters.get(series.tokens_out, 0) + completion_tokens
+        if seconds and completion_tokens:
+            series.rate.record(completion_tokens / seconds)
+
+    def begin(self, action: str) -> RequestTimer:
+        timer = RequestTimer(action)
+        _current.set(timer)
+        return timer
+
+    def end(self, timer: RequestTimer, status: int) -> None:
+        elapsed = time.perf_counter() - timer.started
+        action = timer.action
+        phases = timer.phases
+        with self._lock:
+            series = self._series(action)
+            key = series.statuses.get(status)
+            if key is None:
+                key = series.statuses[status] = ("requests_total", (("action", action), ("status", str(status))))
+            self._counters[key] = self._counters.get(key, 0) + 1
+            series.request.record(elapsed)
+            for phase, seconds in phases.items():
+                histogram = series.phases.get(phase)
+                if histogram is None:
+                    histogram = series.phases[phase] = self._histogram(
+                        "phase_seconds", (("action", action), ("phase", phase)), 1e6)
+                histogram.record(seconds)
+            if timer.tokens:
+                self._record_tokens(series, timer.tokens[0], timer.tokens[1], timer.token_seconds)
+        _current.set(_NULL_TIMER)
+
+        if METRICS_LOG:
+            record = {
+                "function": self.function,
+                "action": action,
+                "status": status,
+                "ms": round(elapsed * 1000, 3),
+                "phases": {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+            }
+            if timer.tokens:
+                record["tokens"] = {"in": timer.tokens[0], "out": timer.tokens[1]}
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def upstream(self, host: str, status: str, seconds: float) -> None:
+        """One request to an external API (each attempt separately); status is the code or error."""
+        with self._lock:
+            self._histogram("upstream_seconds", (("host", host), ("status", status)), 1e6).record(seconds)
+
+    def tokens(self, prompt_tokens: int, completion_tokens: int, seconds: Optional[float] = None,
+               action: Optional[str] = None) -> None:
+        """Tokens of a model response; seconds is the API request time for tokens/s.
+
+        Inside a request the tokens accumulate in the timer and are recorded
+        with it in end(). Outside a request (in pool threads) they are recorded
+        at once, and action is passed explicitly.
+        """
+        timer = current()
+        if timer is not _NULL_TIMER and action in (None, timer.action):
+            previous = timer.tokens or (0, 0)
+            timer.tokens = (previous[0] + prompt_tokens, previous[1] + completion_tokens)
+            if seconds and completion_tokens:
+                timer.token_seconds += seconds
+            return
+        with self._lock:
+            self._record_tokens(self._series(action or timer.action or "unknown"),
+                                prompt_tokens, completion_tokens, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Quantiles and counters as a dict, for benchmarks and debugging."""
+        with self._lock:
+            histograms = {
+                (name, labels): (histogram.count, histogram.quantile(0.5), histogram.quantile(0.95),
+                                 histogram.quantile(0.99))
+                for (name, labels), histogram in self._histograms.items()
+            }
+            counters = dict(self._counters)
+        return {"histograms": histograms, "counters": counters}
+
+    def render(self) -> str:
+        """Prometheus text format (exposition format 0.0.4)."""
+        function = (("function", self.function),) if self.function else ()
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{METRICS_PREFIX}_{name}{_labels(function + labels)} {value:g}")
+            for name in sorted({name for name, _ in self._histograms}):
+                bounds = RATE_BOUNDS if name == "tokens_per_second" else SECONDS_BOUNDS
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+                    series = function + labels
+                    for bound, count in zip(bounds, histogram.cumulative(bounds)):
+                        lines.append(f'{METRICS_PREFIX}_{name}_bucket{_labels(series + (("le", f"{bound:g}"),))} {count}')
+                    lines.append(f'{METRICS_PREFIX}_{name}_bucket{_labels(series + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f"{METRICS_PREFIX}_{name}_sum{_labels(series)} {histogram.total:.6f}")
+                    lines.append(f"{METRICS_PREFIX}_{name}_count{_labels(series)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Labels) -> str:
+    escaped = (
+        key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+METRICS = Metrics()
+
+
+def metrics_response(event: dict) -> dict:
+    params = event.get("queryStringParameters") or {}
+    if not METRICS_TOKEN or params.get("token") != METRICS_TOKEN:
+        return {
+            "statusCode": 403,
+            "headers": {"Content-Type": "application/json", "Access-Control-Allow-Origin": "*"},
+            "body": json.dumps({"error": "Forbidden"})
+        }
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        "body": METRICS.render()
+    }
+
+
+def instrumented(function: str, action: Callable[[dict], str]):
+    """Handler decorator: a timer per request, plus GET/POST ?action=metrics.
+
+    action(event) names the action for the labels; the handler may refine it
+    through current().action. Time after the last mark goes to the serialize
+    phase (building the response), and a handler exception is recorded as
+    status 500.
+    """
+    METRICS.function = function
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            if (event.get("queryStringParameters") or {}).get("action") == "metrics":
+                return metrics_response(event)
+            timer = METRICS.begin(action(event))
+            try:
+                response = handler(event, context)
+            except BaseException:
+                METRICS.end(timer, 500)
+                raise
+            timer.lap("serialize")
+            METRICS.end(timer, response.get("statusCode", 200))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,108 @@
+"""
+Cached model catalogue for the models action.
+
+The filtered model list is served from memory. After MODELS_CACHE_TTL it is
+still served (stale-while-revalidate) while one background refresh fetches a
+new list; concurrent callers never start a second upstream call. A JSON
+snapshot on local disk lets a cold instance answer without waiting for the
+provider.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+MODELS_CACHE_TTL = int(os.environ.get("MODELS_CACHE_TTL", "600"))
+# Older than this the list is not served even as stale: callers wait for a refresh
+MODELS_CACHE_MAX_STALE = int(os.environ.get("MODELS_CACHE_MAX_STALE", str(24 * 3600)))
+MODELS_SNAPSHOT_PATH = os.environ.get("MODELS_SNAPSHOT_PATH", "/tmp/chatgpt-polza/models.json")
+
+
+class ModelCatalog:
+    """Model list with TTL, stale-while-revalidate and single-flight refresh.
+
+    fetch() returns the filtered model list and raises on failure. A failed
+    background refresh keeps the stale list; a failed blocking refresh raises
+    to every caller waiting on it.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], List[dict]],
+        ttl: int = MODELS_CACHE_TTL,
+        max_stale: int = MODELS_CACHE_MAX_STALE,
+        snapshot_path: str = MODELS_SNAPSHOT_PATH,
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.snapshot_path = snapshot_path
+        self._models: Optional[List[dict]] = None
+        self._fetched_at = 0.0
+        self._snapshot_checked = False
+        self._refresh: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Tuple[List[dict], str]:
+        """Returns (models, status); status is fresh, stale or miss."""
+        with self._lock:
+            if not self._snapshot_checked:
+                self._snapshot_checked = True
+                self._load_snapshot()
+            models, age = self._models, time.time() - self._fetched_at
+
+        if models is not None and age < self.ttl:
+            return models, "fresh"
+        if models is not None and age < self.max_stale:
+            self._start_refresh()
+            return models, "stale"
+        return self._start_refresh().result(), "miss"
+
+    def _start_refresh(self) -> Future:
+        with self._lock:
+            if self._refresh is None:
+                self._refresh = Future()
+                threading.Thread(target=self._run_refresh, args=(self._refresh,), daemon=True).start()
+            return self._refresh
+
+    def _run_refresh(self, future: Future) -> None:
+        try:
+            models = self.fetch()
+        except Exception as e:
+            print(f"Model catalogue refresh failed: {e}")
+            with self._lock:
+                self._refresh = None
+            future.set_exception(e)
+            return
+
+        fetched_at = time.time()
+        with self._lock:
+            self._models, self._fetched_at = models, fetched_at
+            self._refresh = None
+        self._save_snapshot(models, fetched_at)
+        future.set_result(models)
+
+    def _load_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as snapshot:
+                data = json.load(snapshot)
+            self._models, self._fetched_at = data["models"], float(data["fetched_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save_snapshot(self, models: List[dict], fetched_at: float) -> None:
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            temporary = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as snapshot:
+                json.dump({"fetched_at": fetched_at, "models": models}, snapshot, ensure_ascii=False)
+            os.replace(temporary, self.snapshot_path)
+        except OSError as e:
+            print(f"Model catalogue snapshot not saved: {e}")
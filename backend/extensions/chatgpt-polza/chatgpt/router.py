@@ -0,0 +1,195 @@
+"""
+Latency-aware routing of chat completions between OpenAI-compatible providers.
+
+Each provider/model pair keeps a sliding window of recent latencies and
+outcomes. A request goes to the healthy provider with the lowest median
+latency; if it has not answered by that provider's p95, a hedged duplicate
+is sent to the next provider and whichever answers first wins. A failed
+primary triggers the hedge immediately.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+STATS_WINDOW = 200
+MIN_SAMPLES = 10
+# Share of requests sent to a provider that is not the fastest, to keep its stats fresh
+EXPLORE_RATE = 0.05
+UNHEALTHY_ERROR_RATE = 0.5
+HEDGE_PERCENTILE = 0.95
+HEDGE_DEFAULT_DELAY = 2.0
+HEDGE_MIN_DELAY = 0.05
+HEDGE_MAX_DELAY = 10.0
+
+
+@dataclass
+class Provider:
+    name: str
+    base_url: str
+    api_key: str
+    # Model sent upstream for the requested model, e.g. openai/gpt-4o-mini -> deepseek-chat
+    model_for: Callable[[str], str]
+
+
+class ProviderStats:
+    """Sliding window of latencies (successful calls) and outcomes (all calls)."""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(latency)
+
+    def samples(self) -> int:
+        with self._lock:
+            return len(self._latencies)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    def healthy(self) -> bool:
+        with self._lock:
+            enough = len(self._outcomes) >= 5
+        return not enough or self.error_rate() < UNHEALTHY_ERROR_RATE
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+            "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+            "error_rate": round(self.error_rate(), 3),
+            "samples": self.samples(),
+        }
+
+
+Call = Callable[[Provider, dict], dict]
+
+
+class Router:
+    """Routes completions to the fastest healthy provider with hedging.
+
+    call(provider, data) performs one upstream request and raises on failure.
+    The losing request of a hedge cannot be aborted mid-flight; its result is
+    discarded (its latency still feeds the stats).
+    """
+
+    def __init__(self, providers: List[Provider], call: Call, max_workers: int = 16):
+        self.providers = providers
+        self.call = call
+        self._stats: Dict[str, ProviderStats] = {}
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="router")
+
+    def stats(self, provider: Provider, model: str) -> ProviderStats:
+        key = f"{provider.name}:{model}"
+        with self._stats_lock:
+            if key not in self._stats:
+                self._stats[key] = ProviderStats()
+            return self._stats[key]
+
+    def report(self) -> dict:
+        with self._stats_lock:
+            items = list(self._stats.items())
+        return {key: stats.snapshot() for key, stats in items}
+
+    def order(self, model: str) -> List[Provider]:
+        """Healthy providers by median latency (unmeasured first), then unhealthy ones."""
+        def rank(provider: Provider) -> Tuple[bool, float]:
+            stats = self.stats(provider, provider.model_for(model))
+            p50 = stats.percentile(0.5) if stats.samples() >= MIN_SAMPLES else 0.0
+            return (not stats.healthy(), p50)
+
+        ordered = sorted(self.providers, key=rank)
+        if len(ordered) > 1 and random.random() < EXPLORE_RATE:
+            ordered[0], ordered[1] = ordered[1], ordered[0]
+        return ordered
+
+    def hedge_delay(self, provider: Provider, model: str) -> float:
+        stats = self.stats(provider, provider.model_for(model))
+        if stats.samples() < MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, stats.percentile(HEDGE_PERCENTILE)))
+
+    def _submit(self, provider: Provider, data: dict) -> Future:
+        upstream_data = {**data, "model": provider.model_for(data["model"])}
+        stats = self.stats(provider, upstream_data["model"])
+
+        def run() -> dict:
+            started = time.perf_counter()
+            try:
+                result = self.call(provider, upstream_data)
+            except Exception:
+                stats.record(time.perf_counter() - started, False)
+                raise
+            stats.record(time.perf_counter() - started, True)
+            return result
+
+        return self._executor.submit(run)
+
+    def complete(self, data: dict) -> Tuple[dict, str, dict]:
+        """Returns (upstream result, provider name, routing report).
+
+        Raises the last provider error if every provider failed.
+        """
+        candidates = self.order(data["model"])
+        started = time.perf_counter()
+        pending: Dict[Future, Provider] = {}
+        last_error: Optional[Exception] = None
+        launched = 0
+
+        def launch() -> float:
+            nonlocal launched
+            provider = candidates[launched]
+            pending[self._submit(provider, data)] = provider
+            launched += 1
+            return self.hedge_delay(provider, data["model"])
+
+        delay = launch()
+        while pending:
+            timeout = delay if launched < len(candidates) else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than this provider's p95: hedge to the next one
+                delay = launch()
+                continue
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                return result, provider.name, {
+                    "hedged": launched > 1,
+                    "attempts": launched,
+                    "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                }
+
+            # A provider failed: fail over without waiting for the hedge delay
+            if launched < len(candidates):
+                delay = launch()
+
+        raise last_error
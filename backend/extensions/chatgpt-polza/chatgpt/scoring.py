@@ -0,0 +1,169 @@
+"""
+Batch scoring of stored trainer sessions.
+
+Lexical tier: analyzeResponse (TrainerTab) in a plain loop, session scores
+are the means over operator messages. Each word list is compiled once into
+one alternation regex, so a message is scanned once per list rather than
+once per phrase. A plain loop beat a numpy version on 10k sessions and does
+not add numpy to the cold start. Sessions whose overall lexical score is close to the pass
+mark, or that mix empathy with rudeness, are ambiguous: they go to an LLM
+judge, several transcripts per prompt.
+
+A session is {id, messages: [{sender, text, ts}]} as in TrainerTab: sender
+"user" is the trainee operator, anything else is the simulated customer; ts
+(seconds, optional) gives the reply delay used for the speed score.
+"""
+
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+EMPATHY_WORDS = ("понимаю", "извините", "приношу извинения", "сожалею", "помогу", "поддержка")
+PROFESSIONAL_WORDS = ("заказ", "доставка", "возврат", "проверю", "уточню", "система", "статус")
+RUDE_WORDS = ("ваша вина", "не моя проблема", "сами виноваты", "что вы хотите")
+
+# Points added once per phrase of the list present in a message, as in analyzeResponse
+EMPATHY_BONUS = 15
+PROFESSIONAL_BONUS = 12
+RUDE_EMPATHY_PENALTY = 30
+RUDE_PROFESSIONAL_PENALTY = 20
+BASE_SCORE = 50
+SHORT_MESSAGE_CHARS = 20
+SHORT_MESSAGE_PENALTY = 10
+# Speed drops by 20 points per minute of reply delay, down to this floor
+SPEED_FLOOR = 30
+
+SCORING_MAX_SESSIONS = int(os.environ.get("SCORING_MAX_SESSIONS", "20000"))
+# Pass mark for the mean of empathy and professionalism
+SCORING_PASS_SCORE = float(os.environ.get("SCORING_PASS_SCORE", "60"))
+# Sessions this close to the pass mark are escalated to the judge: in a session of
+# about five replies one phrase more or less moves the mean by about 3 points
+SCORING_AMBIGUOUS_MARGIN = float(os.environ.get("SCORING_AMBIGUOUS_MARGIN", "3"))
+JUDGE_BATCH_SIZE = int(os.environ.get("JUDGE_BATCH_SIZE", "8"))
+# Each transcript is cut to its last characters to bound the prompt size
+JUDGE_TRANSCRIPT_CHARS = int(os.environ.get("JUDGE_TRANSCRIPT_CHARS", "2000"))
+
+JUDGE_PROMPT = (
+    "You review customer support training sessions. In each session an agent (the trainee) "
+    "answers a simulated customer. Score every agent's empathy and professionalism from 0 to "
+    "100. Reply with JSON only: "
+    '{"scores": [{"session": <session number>, "empathy": <0-100>, "professionalism": <0-100>}]}'
+)
+
+
+def _matcher(words: Tuple[str, ...]) -> re.Pattern:
+    # Longest first, so a phrase is not cut short by a shorter phrase it starts with
+    return re.compile("|".join(map(re.escape, sorted(words, key=len, reverse=True))))
+
+
+_EMPATHY_RE = _matcher(EMPATHY_WORDS)
+_PROFESSIONAL_RE = _matcher(PROFESSIONAL_WORDS)
+_RUDE_RE = _matcher(RUDE_WORDS)
+
+
+def _distinct(pattern: re.Pattern, text: str) -> int:
+    """Distinct phrases of the list in text: a repeated phrase counts once."""
+    found = pattern.findall(text)
+    return len(set(found)) if len(found) > 1 else len(found)
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+def _session_scores(messages: List[dict]) -> Dict[str, object]:
+    empathy_scores: List[float] = []
+    professionalism_scores: List[float] = []
+    speed_scores: List[float] = []
+    has_empathy = has_rude = False
+    previous_ts = None
+    for message in messages:
+        ts = message.get("ts")
+        if isinstance(ts, bool) or not isinstance(ts, (int, float)):
+            ts = None
+        if message.get("sender") == "user":
+            text = str(message.get("text") or "")
+            lower = text.lower()
+            empathy_phrases = _distinct(_EMPATHY_RE, lower)
+            professional_phrases = _distinct(_PROFESSIONAL_RE, lower)
+            rude_phrases = _distinct(_RUDE_RE, lower)
+            empathy = BASE_SCORE + EMPATHY_BONUS * empathy_phrases - RUDE_EMPATHY_PENALTY * rude_phrases
+            professionalism = (BASE_SCORE + PROFESSIONAL_BONUS * professional_phrases
+                               - RUDE_PROFESSIONAL_PENALTY * rude_phrases)
+            has_empathy = has_empathy or empathy_phrases > 0
+            has_rude = has_rude or rude_phrases > 0
+            if len(text) < SHORT_MESSAGE_CHARS:
+                professionalism -= SHORT_MESSAGE_PENALTY
+            empathy_scores.append(min(100, max(0, empathy)))
+            professionalism_scores.append(min(100, max(0, professionalism)))
+            # Reply delay: time since the closest earlier message of the session that has ts
+            if ts is not None and previous_ts is not None:
+                speed_scores.append(min(100, max(SPEED_FLOOR, 100 - (ts - previous_ts) / 60 * 20)))
+        if ts is not None:
+            previous_ts = ts
+
+    empathy, professionalism = _mean(empathy_scores), _mean(professionalism_scores)
+    near_pass = empathy is not None and abs((empathy + professionalism) / 2 - SCORING_PASS_SCORE) <= SCORING_AMBIGUOUS_MARGIN
+    return {
+        "empathy": empathy,
+        "professionalism": professionalism,
+        "speed": _mean(speed_scores),
+        "messages": len(empathy_scores),
+        # Empathy and rudeness in the same session: the word counts cannot tell which one dominates
+        "ambiguous": bool(empathy_scores) and (near_pass or (has_empathy and has_rude)),
+    }
+
+
+def lexical_scores(sessions: List[dict]) -> List[Dict[str, object]]:
+    """Scores of every session, in the order of sessions.
+
+    Keys: empathy, professionalism, speed (None where unknown), messages
+    (operator messages in the session) and ambiguous.
+    """
+    return [_session_scores(session.get("messages") or []) for session in sessions]
+
+
+def judge_request(model: str, sessions: List[dict]) -> dict:
+    """Chat completion payload that scores several sessions in one prompt.
+
+    Sessions are numbered within the prompt, so caller ids never reach the model.
+    """
+    parts = []
+    for number, session in enumerate(sessions, 1):
+        transcript = "\n".join(
+            f"{'agent' if message.get('sender') == 'user' else 'customer'}: {message.get('text') or ''}"
+            for message in session.get("messages") or []
+        )
+        parts.append(f"Session {number}:\n{transcript[-JUDGE_TRANSCRIPT_CHARS:]}")
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": JUDGE_PROMPT},
+            {"role": "user", "content": "\n\n".join(parts)},
+        ],
+        "temperature": 0,
+        "max_tokens": 40 * len(sessions) + 50,
+    }
+
+
+def parse_verdicts(content: str, count: int) -> List[Optional[Tuple[float, float]]]:
+    """(empathy, professionalism) per session of a judge request; None if it was skipped.
+
+    Raises ValueError if the reply is not the requested JSON.
+    """
+    # Models sometimes wrap JSON in a code fence or add a sentence around it
+    start, end = content.find("{"), content.rfind("}")
+    try:
+        data = json.loads(content[start:end + 1])
+        verdicts: List[Optional[Tuple[float, float]]] = [None] * count
+        for item in data["scores"]:
+            number = int(item["session"])
+            if 1 <= number <= count:
+                verdicts[number - 1] = (
+                    min(100.0, max(0.0, float(item["empathy"]))),
+                    min(100.0, max(0.0, float(item["professionalism"]))),
+                )
+        return verdicts
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Unexpected judge reply: {e}")
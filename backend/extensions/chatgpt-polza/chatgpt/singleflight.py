@@ -0,0 +1,105 @@
+"""Coalescing of identical concurrent requests to external APIs (single-flight).
+
+While a request with some key is running, identical requests with the same
+key are not sent out; they wait for its result, and all of them get the
+response (or the exception). A group of trainees who open the same scenario at
+once thus makes one request to the model instead of one each. The key is
+dropped as soon as the request finishes: results are not cached, that is what
+completion_cache is for.
+
+The result is shared by all waiters and must not be mutated. So is the
+exception, so waiters raise a copy of it: otherwise threads would append
+frames to the __traceback__ of one object at the same time. SINGLE_FLIGHT=0
+disables coalescing.
+
+Functions are deployed separately, so each function that needs this module
+keeps its own copy; change all copies together. The other copies are in
+Russian, and scripts/check_shared_modules.py checks that the code of all
+copies matches.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT", "1") == "1"
+
+
+def flight_key(*parts: Any) -> str:
+    """Canonical request key: independent of field order and JSON whitespace."""
+    canonical = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key run once."""
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls: Dict[str, Future] = {}
+        self._callers: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: str, call: Callable[[], Any],
+           share: Optional[Callable[[Any, int], None]] = None) -> Tuple[Any, bool]:
+        """(result of call, whether it came from another caller's call).
+
+        An exception from call is raised to the caller and to every waiter.
+        share(result, callers) is called once before waiters get the result:
+        callers is how many calls receive it, this one included. This lets a
+        shared resource be closed after the last of them.
+        """
+        if not self.enabled:
+            result = call()
+            if share is not None:
+                share(result, 1)
+            return result, False
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._callers[key] = 1
+                self.calls += 1
+            else:
+                self._callers[key] += 1
+                self.shared += 1
+        if not leader:
+            # exception() waits like result() but does not raise the shared object
+            error = future.exception()
+            if error is not None:
+                raise copy.copy(error).with_traceback(None) from error
+            return future.result(), True
+
+        try:
+            result = call()
+        except BaseException as e:
+            self._forget(key)
+            future.set_exception(e)
+            raise
+        callers = self._forget(key)
+        if share is not None:
+            try:
+                share(result, callers)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+        future.set_result(result)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "inFlight": len(self._calls)}
+
+    def _forget(self, key: str) -> int:
+        """Drops the key and returns the number of calls waiting for its result."""
+        # Dropped before the result is published: later callers make their own request
+        with self._lock:
+            del self._calls[key]
+            return self._callers.pop(key)
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from result_cache import CACHE_DIR
+
+
+def dialog_fingerprint(dialog: Dict[str, Any]) -> str:
+    digest = hashlib.sha1()
+    for message in dialog['messages']:
+        digest.update(message['source'].encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(message['content'].encode('utf-8'))
+        digest.update(b'\1')
+    return digest.hexdigest()
+
+
+def knowledge_key(item: str) -> str:
+    return ' '.join(item.split()).casefold()
+
+
+class DialogDelta:
+    """Поток только новых и изменившихся диалогов одной загрузки
+
+    Итерация по объекту пропускает диалоги, отпечаток которых совпадает с
+    сохраненным, и считает статистику. Отпечатки записываются в хранилище
+    только через DialogStore.merge.
+    """
+
+    def __init__(self, source: str, dialogs: Iterable[Dict[str, Any]], known: Dict[str, str]):
+        self.source = source
+        self._dialogs = dialogs
+        self._known = known
+        self.fingerprints: List[Tuple[str, str]] = []
+        self.total = 0
+        self.added = 0
+        self.changed = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        occurrences = {}
+        for dialog in self._dialogs:
+            self.total += 1
+            # dialog_id может встретиться несколькими сериями строк — различаем их по номеру
+            dialog_id = dialog['dialog_id']
+            occurrence = occurrences.get(dialog_id, 0)
+            occurrences[dialog_id] = occurrence + 1
+            key = dialog_id if occurrence == 0 else f'{dialog_id}#{occurrence}'
+
+            fingerprint = dialog_fingerprint(dialog)
+            known = self._known.get(key)
+            if known == fingerprint:
+                continue
+            if known is None:
+                self.added += 1
+            else:
+                self.changed += 1
+            self.fingerprints.append((key, fingerprint))
+            yield dialog
+
+
+class DialogStore:
+    """Хранилище отпечатков диалогов и накопленных знаний по источникам
+
+    Источник — таблица, в которую операторы дописывают диалоги. При повторной
+    загрузке анализируются только новые и изменившиеся диалоги, их результат
+    добавляется к накопленному. Знания только накапливаются: вклад старой
+    версии изменившегося диалога не вычитается.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, 'dialogs.sqlite3')
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.executescript(
+            'CREATE TABLE IF NOT EXISTS dialogs ('
+            'source TEXT NOT NULL, dialog_key TEXT NOT NULL, fingerprint TEXT NOT NULL, '
+            'PRIMARY KEY (source, dialog_key));'
+            'CREATE TABLE IF NOT EXISTS knowledge ('
+            'source TEXT NOT NULL, field TEXT NOT NULL, item_key TEXT NOT NULL, '
+            'item TEXT NOT NULL, count INTEGER NOT NULL, '
+            'PRIMARY KEY (source, field, item_key));'
+        )
+        return connection
+
+    def delta(self, source: str, dialogs: Iterable[Dict[str, Any]]) -> DialogDelta:
+        connection = self._connect()
+        try:
+            known = dict(connection.execute(
+                'SELECT dialog_key, fingerprint FROM dialogs WHERE source = ?', (source,)
+            ))
+        finally:
+            connection.close()
+        return DialogDelta(source, dialogs, known)
+
+    def merge(self, delta: DialogDelta, extracted: Dict[str, List[str]], persist: bool = True) -> Dict[str, List[str]]:
+        """Добавляет результат анализа изменений к накопленным знаниям источника
+
+        Возвращает накопленные problems/products без почти-дублей, частые
+        первыми. При persist=False хранилище не меняется (например, если
+        DeepSeek был недоступен и изменения стоит проанализировать заново).
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                accumulated = {}
+                for field in ('problems', 'products'):
+                    rows = connection.execute(
+                        'SELECT item_key, item, count FROM knowledge WHERE source = ? AND field = ? ORDER BY rowid',
+                        (delta.source, field)
+                    ).fetchall()
+                    items = {key: [item, count] for key, item, count in rows}
+                    for item in extracted.get(field, []):
+                        key = knowledge_key(item)
+                        if key in items:
+                            items[key][1] += 1
+                        else:
+                            items[key] = [item, 1]
+                    accumulated[field] = items
+
+                if persist:
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO dialogs (source, dialog_key, fingerprint) VALUES (?, ?, ?)',
+                        [(delta.source, key, fingerprint) for key, fingerprint in delta.fingerprints]
+                    )
+                    for field, items in accumulated.items():
+                        connection.executemany(
+                            'INSERT INTO knowledge (source, field, item_key, item, count) VALUES (?, ?, ?, ?, ?) '
+                            'ON CONFLICT (source, field, item_key) DO UPDATE SET count = excluded.count',
+                            [(delta.source, field, key, item, count) for key, (item, count) in items.items()]
+                        )
+        finally:
+            connection.close()
+
+        from near_duplicates import collapse_near_duplicates  # numpy не нужен до этого места
+        return {
+            field: collapse_near_duplicates((item, count) for item, count in items.values())
+            for field, items in accumulated.items()
+        }
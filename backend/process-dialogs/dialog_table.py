@@ -0,0 +1,107 @@
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+
+class DialogTable:
+    """Компактное хранилище диалогов вместо списка словарей
+
+    Тексты сообщений лежат в одном UTF-8 буфере со смещениями, источники
+    (Клиент/Оператор) — короткими кодами, границы диалогов — массивом
+    индексов первого сообщения. Итерация отдает те же словари
+    {'dialog_id', 'messages': [{'source', 'content'}]}, что и раньше, но
+    создает их только для текущего диалога.
+    """
+
+    def __init__(self):
+        self._content = bytearray()
+        self._content_offsets = array('q', [0])
+        self._source_names: List[str] = []
+        self._source_codes: Dict[str, int] = {}
+        self._sources = array('B')
+        self._dialog_ids: List[str] = []
+        self._dialog_starts = array('q')
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, str]]) -> 'DialogTable':
+        """Строки (source, content, dialog_id); новый диалог — при каждой смене dialog_id"""
+        table = cls()
+        for source, content, dialog_id in rows:
+            table.append(source, content, dialog_id)
+        return table
+
+    @classmethod
+    def from_dialogs(cls, dialogs: Iterable[Dict[str, Any]]) -> 'DialogTable':
+        """Упаковывает уже сгруппированные диалоги, сохраняя их границы"""
+        table = cls()
+        for dialog in dialogs:
+            table._dialog_starts.append(len(table._sources))
+            table._dialog_ids.append(dialog['dialog_id'])
+            for message in dialog['messages']:
+                code = table._source_code(message['source'])
+                table._sources.append(code)
+                table._content += message['content'].encode('utf-8')
+                table._content_offsets.append(len(table._content))
+        return table
+
+    def _source_code(self, source: str) -> int:
+        code = self._source_codes.get(source)
+        if code is None:
+            code = len(self._source_names)
+            self._source_names.append(source)
+            self._source_codes[source] = code
+            if code == 256:
+                # Источников больше, чем влезает в байт — расширяем коды
+                self._sources = array('I', self._sources)
+        return code
+
+    def append(self, source: str, content: str, dialog_id: str) -> None:
+        if not self._dialog_ids or self._dialog_ids[-1] != dialog_id:
+            self._dialog_starts.append(len(self._sources))
+            self._dialog_ids.append(dialog_id)
+
+        code = self._source_code(source)
+        self._sources.append(code)
+        self._content += content.encode('utf-8')
+        self._content_offsets.append(len(self._content))
+
+    @property
+    def message_count(self) -> int:
+        return len(self._sources)
+
+    def __len__(self) -> int:
+        return len(self._dialog_ids)
+
+    def _end(self, index: int) -> int:
+        # Последний диалог закрывается общим числом сообщений
+        if index + 1 < len(self._dialog_starts):
+            return self._dialog_starts[index + 1]
+        return len(self._sources)
+
+    def _dialog(self, index: int, start: int, end: int) -> Dict[str, Any]:
+        content = self._content
+        names = self._source_names
+        offsets = self._content_offsets[start:end + 1].tolist()
+        return {
+            'dialog_id': self._dialog_ids[index],
+            'messages': [
+                {'source': names[code], 'content': content[begin:finish].decode('utf-8')}
+                for code, begin, finish in zip(self._sources[start:end], offsets, offsets[1:])
+            ],
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for index in range(len(self._dialog_ids)):
+            yield self._dialog(index, self._dialog_starts[index], self._end(index))
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if index < 0:
+            index += len(self._dialog_ids)
+        if not 0 <= index < len(self._dialog_ids):
+            raise IndexError('dialog index out of range')
+        return self._dialog(index, self._dialog_starts[index], self._end(index))
+
+    def memory_size(self) -> int:
+        """Примерный объем буферов в байтах (без строк dialog_id)"""
+        return (len(self._content) + self._content_offsets.itemsize * len(self._content_offsets)
+                + self._sources.itemsize * len(self._sources)
+                + self._dialog_starts.itemsize * len(self._dialog_starts))
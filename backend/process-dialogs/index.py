@@ -1,17 +1,87 @@
 import json
 import os
 import re
-import base64
-from typing import Dict, List, Any
-from io import BytesIO
-import requests
-import pandas as pd
+import binascii
+import codecs
+import csv
+import hashlib
+import io
+import mmap
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
+from typing import TYPE_CHECKING, Callable, Dict, List, Any, IO, Iterable, Iterator, Optional, Tuple
 
+from dialog_store import DialogStore
+from dialog_table import DialogTable
+from job_queue import JobProgress, JobQueue
+from knowledge import KnowledgeCollector, extract_knowledge
+from metrics import METRICS, current, instrumented
+from result_cache import ResultCache, make_cache_key
+from singleflight import SingleFlight, flight_key
+from situations import SituationStager, pending_path
+from upload import Buffer, is_json_request, open_buffer, read_binary_upload
+
+# requests (http_client), openpyxl и numpy (vector_index, near_duplicates) импортируются
+# внутри функций, которым они нужны: preflight не платит за них на холодном старте,
+# а загрузка не трогает vector_index — индекс собирается первым action=query
+if TYPE_CHECKING:
+    import requests
+
+# Меняется при любом изменении логики разбора или анализа: старые записи кэша перестают совпадать
+EXTRACTOR_VERSION = '2'
+
+CSV_CHUNK_SIZE = 64 * 1024
+SHEET_SPOOL_MEMORY = 8 * 1024 * 1024  # больше — выгрузка таблицы уходит во временный файл
+
+# Адреса переопределяются окружением, чтобы бенчмарки ходили в локальные заглушки
+DEEPSEEK_URL = os.environ.get('DEEPSEEK_URL', 'https://api.deepseek.com/chat/completions')
+GOOGLE_SHEETS_EXPORT_URL = os.environ.get(
+    'GOOGLE_SHEETS_EXPORT_URL', 'https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv'
+)
+DEEPSEEK_TIMEOUT = 120
+# Бюджет одного запроса к DeepSeek: диалоги режутся на куски по границам диалогов
+DEEPSEEK_CHUNK_TOKENS = int(os.environ.get('DEEPSEEK_CHUNK_TOKENS', '20000'))
+DEEPSEEK_CONCURRENCY = int(os.environ.get('DEEPSEEK_CONCURRENCY', '4'))
+# Столько кусков подряд с ошибкой — и остаток загрузки разбирается без API
+DEEPSEEK_MAX_FAILURES = int(os.environ.get('DEEPSEEK_MAX_FAILURES', '3'))
+CHARS_PER_TOKEN = 3  # грубая оценка для русского текста
+# Значения ячеек, которые pandas считает пропусками (плюс 'nan' после astype(str))
+MISSING_CELL_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+])
+XLSX_HEADER_SCAN_ROWS = 20  # в скольких первых строках листа искать заголовок
+MAX_PROBLEMS = 30
+MAX_PRODUCTS = 100
+
+RESULT_CACHE = ResultCache()
+DIALOG_STORE = DialogStore()
+JOB_QUEUE = JobQueue()
+# Одновременные одинаковые запросы к DeepSeek и выгрузки одной таблицы идут наружу один раз
+UPSTREAM_FLIGHTS = SingleFlight()
+VECTOR_INDEX_ENABLED = os.environ.get('VECTOR_INDEX_ENABLED', '1') == '1'
+QUERY_MAX_TOP_K = 50
+INDEX_BUILD_LOCK = threading.Lock()
+
+@instrumented('process-dialogs', lambda event: 'options' if event.get('httpMethod') == 'OPTIONS' else 'analyse')
 def handler(event: dict, context) -> dict:
     """
     Обрабатывает загрузку таблицы с диалогами (Excel/CSV/Google Sheets)
     Извлекает знания: товары, проблемы, правильные ответы
     Создает векторную базу для поиска похожих ситуаций
+    
+    action=query в теле ищет похожие сообщения клиентов в векторной базе источника
+    
+    async=true ставит анализ в очередь и сразу возвращает jobId;
+    action=status с jobId отдает фазу, счетчики и итоговый результат задачи
+    
+    Файл можно прислать без JSON и base64-строки внутри него: как
+    multipart/form-data или сырым телом (параметры — в query string)
+    
+    GET ?action=metrics&token=<METRICS_TOKEN> отдает метрики инстанса в формате Prometheus
     """
     method = event.get('httpMethod', 'POST')
     
@@ -21,7 +91,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, X-File-Name'
             },
             'body': ''
         }
@@ -35,52 +105,65 @@ def handler(event: dict, context) -> dict:
     
     try:
         raw_body = event.get('body', '{}')
-        is_base64 = event.get('isBase64Encoded', False)
         
-        if not raw_body or raw_body.strip() == '':
+        # isspace не копирует тело, в отличие от strip — важно для больших загрузок
+        if not raw_body or raw_body.isspace():
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': 'Пустое тело запроса'})
             }
         
-        body = json.loads(raw_body)
-        google_sheets_url = body.get('googleSheetsUrl')
-        file_data = body.get('file')
-        file_name = body.get('fileName', 'file.xlsx')
-        system_prompt = body.get('systemPrompt', '')
-        
-        if google_sheets_url:
-            dialogs = parse_google_sheets(google_sheets_url)
-        elif file_data:
-            dialogs = parse_excel_file(file_data, file_name)
+        file_payload: Optional[Buffer] = None
+        if is_json_request(event):
+            if event.get('isBase64Encoded'):
+                raw_body = binascii.a2b_base64(raw_body)
+            body = json.loads(raw_body)
         else:
+            body, file_payload = read_binary_upload(event)
+        timer = current()
+        timer.lap('body_parse')
+        
+        if body.get('action') in ('query', 'status'):
+            timer.action = body['action']
+        elif body.get('async'):
+            timer.action = 'analyse_async'
+        
+        if body.get('action') == 'query':
+            return handle_query(body)
+        
+        if body.get('action') == 'status':
+            return handle_job_status(body)
+        
+        file_bytes = file_payload
+        if file_bytes is None and body.get('file'):
+            file_bytes = decode_file(body['file'])
+            timer.lap('file_decode')
+        
+        if not body.get('googleSheetsUrl') and file_bytes is None:
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Требуется googleSheetsUrl или file (base64)'})
+                'body': json.dumps({'error': 'Требуется googleSheetsUrl, file (base64) или файл в теле запроса'})
             }
         
-        # Обработка через DeepSeek API (полноценный анализ)
-        try:
-            extracted_data = process_with_deepseek(dialogs, system_prompt)
-        except Exception as e:
-            print(f'DeepSeek недоступен, используем fallback парсер: {str(e)}')
-            knowledge_base = extract_knowledge(dialogs)
-            extracted_data = {
-                'problems': knowledge_base['problems'][:30],
-                'products': knowledge_base['products'][:100]
+        params = analysis_params(body)
+        
+        if body.get('async'):
+            # Большие таблицы: файл уходит в очередь, анализ идет в фоне, клиент опрашивает action=status
+            job_id = JOB_QUEUE.submit(params, file_bytes)
+            JOB_QUEUE.start_worker(run_job)
+            return {
+                'statusCode': 202,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'jobId': job_id, 'status': 'queued'})
             }
         
+        result = analyse_source(params, file_bytes)
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'dialogsCount': len(dialogs),
-                'problems': extracted_data.get('problems', []),
-                'products': extracted_data.get('products', [])
-            }, ensure_ascii=False)
+            'body': json.dumps(result, ensure_ascii=False)
         }
         
     except Exception as e:
@@ -91,56 +174,279 @@ def handler(event: dict, context) -> dict:
         }
 
 
-def parse_excel_file(file_base64: str, file_name: str) -> List[Dict[str, Any]]:
+def analysis_params(body: dict) -> Dict[str, Any]:
+    """Параметры анализа из тела запроса — в том виде, в каком они сохраняются в задаче"""
+    file_name = body.get('fileName', 'file.xlsx')
+    return {
+        'googleSheetsUrl': body.get('googleSheetsUrl'),
+        'fileName': file_name,
+        'systemPrompt': body.get('systemPrompt', ''),
+        # incremental: анализировать только новые и изменившиеся диалоги источника
+        'incremental': bool(body.get('incremental')),
+        'sourceId': resolve_source_id(body) or f'file:{file_name}',
+    }
+
+
+def open_source(params: Dict[str, Any], file_bytes: Optional[Buffer]) -> Tuple[Callable[[], Iterable[Dict[str, Any]]], str, str, Callable[[], None]]:
+    """Возвращает (загрузчик диалогов, вид источника, sha256 содержимого, закрытие источника)
+    
+    Источник закрывается, даже если диалоги так и не читались (например,
+    результат нашелся в кэше).
+    """
+    if params.get('googleSheetsUrl'):
+        sheet, encoding, content_digest = download_google_sheet(params['googleSheetsUrl'])
+        return lambda: iter_csv_dialogs(iter_file_chunks(sheet), encoding), 'google-sheets', content_digest, sheet.close
+    
+    content_digest = hashlib.sha256(file_bytes).hexdigest()
+    file_name = params['fileName']
+    if file_name.endswith('.csv'):
+        return lambda: parse_excel_bytes(file_bytes, file_name), 'csv', content_digest, lambda: None
+    # Excel читается потоково: в памяти только текущий диалог, а не вся книга
+    return lambda: stream_excel_dialogs(file_bytes), 'excel', content_digest, lambda: None
+
+
+def analyse_source(params: Dict[str, Any], file_bytes: Optional[Buffer],
+                   progress: Optional[JobProgress] = None) -> Dict[str, Any]:
+    """Полный анализ таблицы — общий для синхронного запроса и фоновой задачи"""
+    load_dialogs, source_kind, content_digest, close_source = open_source(params, file_bytes)
+    try:
+        return _analyse_source(params, load_dialogs, source_kind, content_digest, progress)
+    finally:
+        close_source()
+
+
+def _analyse_source(params: Dict[str, Any], load_dialogs: Callable[[], Iterable[Dict[str, Any]]],
+                    source_kind: str, content_digest: str, progress: Optional[JobProgress]) -> Dict[str, Any]:
+    source_id = params['sourceId']
+    system_prompt = params['systemPrompt']
+    
+    def dialogs():
+        items = load_dialogs()
+        return progress.track(items) if progress else items
+    
+    if params['incremental']:
+        result = with_vector_index(
+            source_id, dialogs(),
+            lambda items: process_incremental(items, source_id, system_prompt, progress)
+        )
+        return {'success': True, **result}
+    
+    # Та же таблица с тем же промптом уже обрабатывалась — отдаем сохраненный результат
+    cache_key = make_cache_key(content_digest, source_kind, system_prompt, EXTRACTOR_VERSION)
+    result = RESULT_CACHE.get(cache_key)
+    cache_status = 'hit'
+    
+    if result is None:
+        cache_status = 'miss'
+        # Обработка через DeepSeek API (полноценный анализ).
+        # Диалоги читаются один раз, куски с ошибкой API разбираются fallback-парсером
+        knowledge = KnowledgeCollector()
+        extracted_data = with_vector_index(
+            source_id, dialogs(),
+            lambda items: process_with_deepseek(items, system_prompt, knowledge, progress)
+        )
+        result = {
+            'dialogsCount': knowledge.dialogs_count,
+            'problems': extracted_data.get('problems', []),
+            'products': extracted_data.get('products', [])
+        }
+        # Результат fallback-парсера не кэшируем, чтобы повторная загрузка снова попробовала DeepSeek
+        if extracted_data.get('analysis') == 'deepseek':
+            RESULT_CACHE.put(cache_key, result)
+    
+    return {
+        'success': True,
+        'dialogsCount': result['dialogsCount'],
+        'problems': result['problems'],
+        'products': result['products'],
+        'cache': cache_status
+    }
+
+
+def run_job(job: Dict[str, Any], progress: JobProgress) -> Dict[str, Any]:
+    """Выполняет задачу из очереди; файл задачи читается через mmap, без копии в память"""
+    timer = METRICS.begin('analyse_job')
+    status = 500
+    try:
+        result = _run_job(job, progress)
+        status = 200
+        return result
+    finally:
+        METRICS.end(timer, status)
+
+
+def _run_job(job: Dict[str, Any], progress: JobProgress) -> Dict[str, Any]:
+    if not job['payload']:
+        return analyse_source(job['params'], None, progress)
+    
+    if os.path.getsize(job['payload']) == 0:
+        return analyse_source(job['params'], b'', progress)
+    
+    with open(job['payload'], 'rb') as payload_file:
+        payload = mmap.mmap(payload_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return analyse_source(job['params'], memoryview(payload), progress)
+    finally:
+        try:
+            payload.close()
+        except BufferError:
+            # На буфер еще ссылается трассировка ошибки — mmap закроет сборщик мусора
+            pass
+
+
+def handle_job_status(body: dict) -> dict:
+    """Статус фоновой задачи: status (queued/running/done/failed), phase, progress, result или error"""
+    job_id = body.get('jobId')
+    job = JOB_QUEUE.get(job_id) if job_id else None
+    if job is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Задача не найдена'}, ensure_ascii=False)
+        }
+    
+    # Задачи, оставшиеся в очереди после перезапуска инстанса, подхватываются при опросе
+    if job['status'] in ('queued', 'running'):
+        JOB_QUEUE.start_worker(run_job)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'job': job}, ensure_ascii=False)
+    }
+
+
+def resolve_source_id(body: dict) -> Optional[str]:
+    """Источник диалогов: sourceId, иначе id Google-таблицы или имя файла"""
+    if body.get('sourceId'):
+        return body['sourceId']
+    if body.get('googleSheetsUrl'):
+        return f"google-sheets:{google_sheet_id(body['googleSheetsUrl'])}"
+    if body.get('fileName'):
+        return f"file:{body['fileName']}"
+    return None
+
+
+def with_vector_index(source_id: str, dialogs: Iterable[Dict[str, Any]], process):
+    """Вызывает process(dialogs), попутно откладывая ситуации для векторной базы источника
+    
+    Сам индекс собирается при первом запросе action=query: загрузка не ждет
+    эмбеддингов и не загружает NumPy. Ошибка записи ситуаций не ломает анализ —
+    индекс просто остается прежним.
+    """
+    if not VECTOR_INDEX_ENABLED:
+        return process(dialogs)
+    
+    stager = SituationStager(source_id)
+    try:
+        result = process(stager.observe(dialogs))
+    except Exception:
+        stager.abort()
+        raise
+    
+    try:
+        stager.finish()
+        print(f'Векторная база {source_id}: {stager.count} ситуаций ждут индексации')
+    except Exception as e:
+        print(f'Не удалось сохранить ситуации для векторной базы: {str(e)}')
+    return result
+
+
+def handle_query(body: dict) -> dict:
+    """Ищет похожие сообщения клиентов и ответы операторов, которые за ними следовали
+    
+    Тело: action=query, query, sourceId (или googleSheetsUrl / fileName), topK
+    """
+    query = (body.get('query') or '').strip()
+    source_id = resolve_source_id(body)
+    if not query or not source_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Требуется query и sourceId (или googleSheetsUrl / fileName)'})
+        }
+    
+    try:
+        top_k = max(1, min(int(body.get('topK', 5)), QUERY_MAX_TOP_K))
+    except (TypeError, ValueError, OverflowError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'topK должен быть целым числом'}, ensure_ascii=False)
+        }
+    
+    from vector_index import build_pending_index, open_index
+    # После загрузки индекс собирается один раз, первым запросом к источнику
+    if os.path.exists(pending_path(source_id)):
+        with INDEX_BUILD_LOCK:
+            if build_pending_index(source_id):
+                current().lap('index_build')
+    index = open_index(source_id)
+    if index is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Векторная база для источника не найдена. Сначала загрузите таблицу'}, ensure_ascii=False)
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'sourceId': source_id,
+            'indexed': len(index),
+            'results': index.search(query, top_k)
+        }, ensure_ascii=False)
+    }
+
+
+def process_incremental(dialogs: Iterable[Dict[str, Any]], source_id: str, system_prompt: str,
+                        progress: Optional[JobProgress] = None) -> Dict[str, Any]:
+    """Анализирует только новые и изменившиеся диалоги источника
+    
+    Результат добавляется к знаниям, накопленным по источнику, и возвращаются
+    накопленные problems/products. Отпечатки и знания сохраняются, только если
+    анализ целиком прошел через DeepSeek, иначе изменения будут разобраны заново.
+    """
+    delta = DIALOG_STORE.delta(source_id, dialogs)
+    extracted_data = process_with_deepseek(delta, system_prompt, progress=progress)
+    accumulated = DIALOG_STORE.merge(delta, extracted_data, persist=extracted_data.get('analysis') == 'deepseek')
+    print(f'Источник {source_id}: диалогов {delta.total}, новых {delta.added}, изменившихся {delta.changed}')
+    
+    return {
+        'dialogsCount': delta.total,
+        'newDialogs': delta.added,
+        'changedDialogs': delta.changed,
+        **cap_extraction(accumulated)
+    }
+
+
+def parse_excel_file(file_base64: str, file_name: str) -> DialogTable:
     """Парсит Excel/CSV файл из base64"""
+    return parse_excel_bytes(decode_file(file_base64), file_name)
+
+
+def decode_file(file_base64: str) -> bytes:
+    try:
+        # a2b_base64 читает ASCII-строку напрямую, b64decode сначала копирует ее в bytes
+        return binascii.a2b_base64(file_base64)
+    except Exception as e:
+        raise ValueError(f'Ошибка чтения файла: {str(e)}')
+
+
+def parse_excel_bytes(file_bytes: Buffer, file_name: str) -> DialogTable:
+    """Парсит Excel/CSV файл из байтов или memoryview
+    
+    CSV разбирается модулем csv, Excel — потоковым чтением openpyxl.
+    """
     try:
-        file_bytes = base64.b64decode(file_base64)
-        file_io = BytesIO(file_bytes)
+        file_io = open_buffer(file_bytes)
         
         if file_name.endswith('.csv'):
-            df = pd.read_csv(file_io)
+            dialogs = parse_csv_file(file_io)
         else:
-            df = pd.read_excel(file_io, engine='openpyxl')
-        
-        if df.empty:
-            raise ValueError('Файл пустой')
-        
-        required_columns = ['phrase_source', 'phrase_content', 'dialog_id']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise ValueError(f'Отсутствуют колонки: {", ".join(missing_columns)}. Найдены: {", ".join(df.columns.tolist())}')
-        
-        dialogs = []
-        current_dialog_id = None
-        current_messages = []
-        
-        for _, row in df.iterrows():
-            phrase_source = str(row['phrase_source']).strip()
-            phrase_content = str(row['phrase_content']).strip()
-            dialog_id = str(row['dialog_id']).strip()
-            
-            if phrase_source == 'nan' or phrase_content == 'nan' or dialog_id == 'nan':
-                continue
-            
-            if dialog_id != current_dialog_id:
-                if current_messages:
-                    dialogs.append({
-                        'dialog_id': current_dialog_id,
-                        'messages': current_messages
-                    })
-                current_dialog_id = dialog_id
-                current_messages = []
-            
-            current_messages.append({
-                'source': phrase_source,
-                'content': phrase_content
-            })
-        
-        if current_messages:
-            dialogs.append({
-                'dialog_id': current_dialog_id,
-                'messages': current_messages
-            })
+            dialogs = DialogTable.from_dialogs(iter_xlsx_dialogs(file_io))
         
         if not dialogs:
             raise ValueError('Не удалось найти диалоги в файле')
@@ -151,49 +457,303 @@ def parse_excel_file(file_base64: str, file_name: str) -> List[Dict[str, Any]]:
         raise ValueError(f'Ошибка чтения файла: {str(e)}')
 
 
-def parse_google_sheets(url: str) -> List[Dict[str, Any]]:
-    """Парсит Google Sheets через публичный CSV экспорт"""
-    import csv
-    from io import StringIO
+def check_required_columns(columns: List[Any]) -> None:
+    required_columns = ['phrase_source', 'phrase_content', 'dialog_id']
+    missing_columns = [col for col in required_columns if col not in columns]
+    if missing_columns:
+        raise ValueError(f'Отсутствуют колонки: {", ".join(missing_columns)}. Найдены: {", ".join(map(str, columns))}')
+
+
+def parse_csv_file(file: IO[bytes]) -> DialogTable:
+    """Разбирает загруженный CSV модулем csv, без pandas
+    
+    Ячейки, которые pandas считал бы пропусками (пустые, NaN, NULL, N/A...),
+    отбрасываются так же. Отличие одно: dialog_id берется как есть, а не
+    через число ("007" остается "007", а не "7").
+    """
+    csv_reader = csv.reader(iter_text_lines(iter_file_chunks(file), 'utf-8-sig'))
+    header = next(csv_reader, None)
+    if not header:
+        raise ValueError('Файл пустой')
+    check_required_columns(header)
+    
+    first_row = next(csv_reader, None)
+    if first_row is None:
+        raise ValueError('Файл пустой')
+    
+    positions = [header.index(column) for column in ('phrase_source', 'phrase_content', 'dialog_id')]
+    width = max(positions) + 1
     
+    def cleaned_rows():
+        for row in chain([first_row], csv_reader):
+            if len(row) < width:
+                row += [''] * (width - len(row))
+            values = [row[position].strip() for position in positions]
+            if not any(value in MISSING_CELL_VALUES for value in values):
+                yield values
+    
+    return DialogTable.from_rows(cleaned_rows())
+
+
+def stream_excel_dialogs(file_bytes: Buffer) -> Iterator[Dict[str, Any]]:
+    """Поток диалогов из XLSX для handler: ошибки открытия книги — сразу, как у parse_excel_bytes"""
+    try:
+        return iter_xlsx_dialogs(open_buffer(file_bytes))
+    except Exception as e:
+        raise ValueError(f'Ошибка чтения файла: {str(e)}')
+
+
+def cell_text(value: Any) -> str:
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def iter_xlsx_dialogs(file: IO[bytes]) -> Iterator[Dict[str, Any]]:
+    """Потоково читает диалоги из XLSX через openpyxl в режиме read_only
+    
+    Берутся все листы, где в первых XLSX_HEADER_SCAN_ROWS строках есть
+    заголовок с phrase_source, phrase_content и dialog_id; из строк читаются
+    только эти три колонки. Каждый лист группируется отдельно. Книга
+    открывается и заголовки ищутся сразу, строки читаются лениво.
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheets = []
+        first_header = None
+        for worksheet in workbook.worksheets:
+            # Размеры в файле бывают неверными, без них openpyxl читает строки как есть
+            worksheet.reset_dimensions()
+            rows = worksheet.iter_rows(max_row=XLSX_HEADER_SCAN_ROWS, values_only=True)
+            for row_number, row in enumerate(rows, start=1):
+                header = [cell_text(value) for value in row]
+                if not any(header):
+                    continue
+                first_header = first_header or header
+                if all(column in header for column in ('phrase_source', 'phrase_content', 'dialog_id')):
+                    positions = [header.index(column) for column in ('phrase_source', 'phrase_content', 'dialog_id')]
+                    sheets.append((worksheet, row_number, positions))
+                    break
+        
+        if first_header is None:
+            raise ValueError('Файл пустой')
+        if not sheets:
+            check_required_columns([column for column in first_header if column])
+    except Exception:
+        workbook.close()
+        raise
+    
+    return _closing(_iter_xlsx_dialogs(sheets), workbook)
+
+
+def _iter_xlsx_dialogs(sheets: List[Tuple[Any, int, List[int]]]) -> Iterator[Dict[str, Any]]:
+    def cleaned_rows(worksheet, header_row, positions):
+        width = max(positions) + 1
+        for row in worksheet.iter_rows(min_row=header_row + 1, values_only=True):
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            values = [cell_text(row[position]) for position in positions]
+            if not any(value in MISSING_CELL_VALUES for value in values):
+                yield values
+    
+    found = False
+    for worksheet, header_row, positions in sheets:
+        for dialog in group_dialog_rows(cleaned_rows(worksheet, header_row, positions)):
+            found = True
+            yield dialog
+    
+    if not found:
+        raise ValueError('Не удалось найти диалоги в файле')
+
+
+def _closing(items: Iterator[Any], resource) -> Iterator[Any]:
+    try:
+        yield from items
+    finally:
+        resource.close()
+
+
+def google_sheet_id(url: str) -> str:
     sheet_id_match = re.search(r'/d/([a-zA-Z0-9-_]+)', url)
     if not sheet_id_match:
         raise ValueError('Неверная ссылка на Google Sheets')
+    return sheet_id_match.group(1)
+
+
+def open_google_sheet(url: str) -> 'requests.Response':
+    """Открывает потоковый ответ с CSV экспортом таблицы"""
+    from http_client import request
+    sheet_id = google_sheet_id(url)
+    csv_url = GOOGLE_SHEETS_EXPORT_URL.format(sheet_id=sheet_id)
     
-    sheet_id = sheet_id_match.group(1)
-    csv_url = f'https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv'
-    
-    response = requests.get(csv_url, timeout=30)
+    response = request('GET', csv_url, read_timeout=30, stream=True)
     if response.status_code != 200:
+        response.close()
         raise ValueError(f'Ошибка доступа к таблице (код {response.status_code}). Проверьте, что таблица доступна для просмотра по ссылке.')
     
-    if not response.text or len(response.text) < 10:
-        raise ValueError('Таблица пуста или недоступна. Откройте доступ: Файл → Доступ → Просмотр для всех, у кого есть ссылка')
+    return response
+
+
+class SharedFile:
+    """Файл, который читают несколько запросов
+    
+    readers задается до того, как файл достанется читателям, — столько
+    SharedFileReader будет открыто. Файл закрывается, когда закрыт последний.
+    """
+    
+    def __init__(self, file: IO[bytes]):
+        self.file = file
+        self.lock = threading.Lock()
+        self.readers = 0
     
-    csv_reader = csv.DictReader(StringIO(response.text))
-    rows = list(csv_reader)
+    def release(self) -> None:
+        with self.lock:
+            self.readers -= 1
+            last = self.readers == 0
+        if last:
+            self.file.close()
+
+
+class SharedFileReader(io.RawIOBase):
+    """Читатель общего файла со своей позицией
+    
+    Выгрузку, скачанную один раз для нескольких одновременных запросов,
+    каждый читает с начала: seek и read общего файла идут под блокировкой.
+    """
     
-    if not rows:
+    def __init__(self, shared: SharedFile):
+        self._shared = shared
+        self._position = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, target) -> int:
+        with self._shared.lock:
+            self._shared.file.seek(self._position)
+            data = self._shared.file.read(len(target))
+        target[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+    
+    def close(self) -> None:
+        if not self.closed:
+            self._shared.release()
+        super().close()
+
+
+def download_google_sheet(url: str) -> Tuple[IO[bytes], str, str]:
+    """Скачивает CSV экспорт таблицы, попутно считая его хэш для кэша
+    
+    Возвращает (файл с выгрузкой, кодировку, sha256). Большие выгрузки
+    сбрасываются во временный файл, а не держатся в памяти. Одновременные
+    запросы одной таблицы делят одно скачивание, у каждого свой читатель;
+    выгрузка закрывается вместе с последним читателем — закрыть его обязан
+    вызвавший.
+    """
+    csv_url = GOOGLE_SHEETS_EXPORT_URL.format(sheet_id=google_sheet_id(url))
+    
+    def share(result: Tuple[SharedFile, str, str], callers: int) -> None:
+        result[0].readers = callers
+    
+    (sheet, encoding, content_digest), _ = UPSTREAM_FLIGHTS.do(
+        flight_key('GET', csv_url), lambda: fetch_google_sheet(url), share
+    )
+    return io.BufferedReader(SharedFileReader(sheet)), encoding, content_digest
+
+
+def fetch_google_sheet(url: str) -> Tuple[SharedFile, str, str]:
+    response = open_google_sheet(url)
+    sheet = tempfile.SpooledTemporaryFile(max_size=SHEET_SPOOL_MEMORY)
+    digest = hashlib.sha256()
+    try:
+        for chunk in response.iter_content(chunk_size=CSV_CHUNK_SIZE):
+            digest.update(chunk)
+            sheet.write(chunk)
+    except BaseException:
+        sheet.close()
+        raise
+    finally:
+        response.close()
+    return SharedFile(sheet), response.encoding, digest.hexdigest()
+
+
+def iter_file_chunks(file: IO[bytes], chunk_size: int = CSV_CHUNK_SIZE) -> Iterator[bytes]:
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_csv_dialogs(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Разбирает CSV с колонками phrase_source, phrase_content, dialog_id из потока байтов
+    
+    Заголовок и первая строка читаются сразу, чтобы ошибки пустой таблицы
+    возникали до первого диалога; остальное читается лениво.
+    """
+    csv_reader = csv.DictReader(iter_text_lines(chunks, encoding))
+    if not csv_reader.fieldnames:
+        raise ValueError('Таблица пуста или недоступна. Откройте доступ: Файл → Доступ → Просмотр для всех, у кого есть ссылка')
+    
+    first_row = next(csv_reader, None)
+    if first_row is None:
         raise ValueError('В таблице нет данных')
     
-    dialogs = []
+    return _iter_csv_dialogs(chain([first_row], csv_reader))
+
+
+def _iter_csv_dialogs(rows: Iterable[Dict[str, str]]) -> Iterator[Dict[str, Any]]:
+    def cleaned_rows():
+        for row in rows:
+            phrase_source = (row.get('phrase_source') or '').strip()
+            phrase_content = (row.get('phrase_content') or '').strip()
+            dialog_id = (row.get('dialog_id') or '').strip()
+            
+            if phrase_source and phrase_content and dialog_id:
+                yield phrase_source, phrase_content, dialog_id
+    
+    found = False
+    for dialog in group_dialog_rows(cleaned_rows()):
+        found = True
+        yield dialog
+    
+    if not found:
+        raise ValueError('Не удалось найти диалоги. Проверьте формат: нужны колонки phrase_source, phrase_content, dialog_id')
+
+
+def iter_text_lines(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[str]:
+    """Построчно декодирует поток байтов с сохранением переводов строк (нужны csv для ячеек в кавычках)"""
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def group_dialog_rows(rows: Iterable[Tuple[str, str, str]]) -> Iterator[Dict[str, Any]]:
+    """Собирает подряд идущие строки (source, content, dialog_id) в диалоги
+    
+    Диалог отдается сразу при смене dialog_id, вся таблица не накапливается.
+    """
     current_dialog_id = None
     current_messages = []
     
-    for row in rows:
-        phrase_source = row.get('phrase_source', '').strip()
-        phrase_content = row.get('phrase_content', '').strip()
-        dialog_id = row.get('dialog_id', '').strip()
-        
-        if not phrase_source or not phrase_content or not dialog_id:
-            continue
-        
+    for phrase_source, phrase_content, dialog_id in rows:
         if dialog_id != current_dialog_id:
             if current_messages:
-                dialogs.append({
+                yield {
                     'dialog_id': current_dialog_id,
                     'messages': current_messages
-                })
+                }
             current_dialog_id = dialog_id
             current_messages = []
         
@@ -203,32 +763,13 @@ def parse_google_sheets(url: str) -> List[Dict[str, Any]]:
         })
     
     if current_messages:
-        dialogs.append({
+        yield {
             'dialog_id': current_dialog_id,
             'messages': current_messages
-        })
-    
-    if not dialogs:
-        raise ValueError('Не удалось найти диалоги. Проверьте формат: нужны колонки phrase_source, phrase_content, dialog_id')
-    
-    return dialogs
+        }
 
 
-def process_with_deepseek(dialogs: List[Dict[str, Any]], system_prompt: str) -> Dict[str, List[str]]:
-    """Обрабатывает диалоги через DeepSeek API с кастомным промптом"""
-    try:
-        api_key = os.environ.get('DEEPSEEK_API_KEY')
-        if not api_key:
-            raise ValueError('DEEPSEEK_API_KEY не настроен')
-        
-        # Берем все диалоги без обрезки, ограничиваем только общий объем
-        dialogs_text = '\n\n'.join([
-            f"Диалог {d['dialog_id']}:\n" + '\n'.join([
-                f"{m['source']}: {m['content']}" for m in d['messages']
-            ]) for d in dialogs
-        ])[:100000]  # Ограничение 100к символов для API
-        
-        analysis_prompt = f"""Проанализируй ВСЕ диалоги магазина оптики и извлеки ТОЛЬКО реальные проблемы клиентов.
+ANALYSIS_PROMPT = """Проанализируй ВСЕ диалоги магазина оптики и извлеки ТОЛЬКО реальные проблемы клиентов.
 
 ВАЖНО — НЕ извлекай:
 - Общие фразы: "Все проблема решена", "Вся проблема описана выше", "В чем может быть проблема"
@@ -249,104 +790,234 @@ def process_with_deepseek(dialogs: List[Dict[str, Any]], system_prompt: str) ->
 Диалоги:
 {dialogs_text}"""
 
-        response = requests.post(
-            'https://api.deepseek.com/chat/completions',
-            headers={
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': 'deepseek-chat',
-                'messages': [
-                    {'role': 'user', 'content': analysis_prompt}
-                ],
-                'temperature': 0.2,
-                'max_tokens': 10000
-            },
-            timeout=120
-        )
-        
-        if response.status_code != 200:
-            raise ValueError(f'DeepSeek API ошибка: {response.status_code}')
-        
-        result = response.json()
-        content = result['choices'][0]['message']['content']
-        
-        print(f'DeepSeek ответ (первые 500 символов): {content[:500]}')
+
+def format_dialog(dialog: Dict[str, Any]) -> str:
+    return f"Диалог {dialog['dialog_id']}:\n" + '\n'.join([
+        f"{m['source']}: {m['content']}" for m in dialog['messages']
+    ])
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_dialog_chunks(dialogs: Iterable[Dict[str, Any]],
+                       max_tokens: int = DEEPSEEK_CHUNK_TOKENS) -> Iterator[Tuple[List[Dict[str, Any]], str]]:
+    """Упаковывает диалоги в куски не больше max_tokens, не разрывая диалог
+    
+    Отдает пары (диалоги куска, текст куска). Диалог длиннее бюджета идет
+    отдельным куском и обрезается.
+    """
+    chunk_dialogs = []
+    parts = []
+    tokens = 0
+    
+    for dialog in dialogs:
+        text = format_dialog(dialog)
+        dialog_tokens = estimate_tokens(text)
         
-        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-        if json_match:
-            extracted = json.loads(json_match.group())
-            problems = extracted.get('problems', [])[:30]
-            products = extracted.get('products', [])[:100]
-            print(f'Извлечено проблем: {len(problems)}, товаров: {len(products)}')
-            return {
-                'problems': problems,
-                'products': products
-            }
+        if parts and tokens + dialog_tokens > max_tokens:
+            yield chunk_dialogs, '\n\n'.join(parts)
+            chunk_dialogs, parts, tokens = [], [], 0
         
-        print('DeepSeek не вернул JSON, используем fallback')
-        raise ValueError('Нет JSON в ответе')
+        if dialog_tokens > max_tokens:
+            text = text[:max_tokens * CHARS_PER_TOKEN]
+            dialog_tokens = max_tokens
         
-    except Exception as e:
-        print(f'DeepSeek обработка не удалась: {str(e)}')
-        fallback = extract_knowledge(dialogs)
-        return {
-            'problems': fallback['problems'][:30],
-            'products': fallback['products'][:100]
-        }
+        chunk_dialogs.append(dialog)
+        parts.append(text)
+        tokens += dialog_tokens
+    
+    if parts:
+        yield chunk_dialogs, '\n\n'.join(parts)
 
 
-def extract_knowledge(dialogs: List[Dict[str, Any]]) -> Dict[str, List[str]]:
-    """Быстрое извлечение проблем клиентов и товаров из диалогов"""
-    products = set()
-    problems = set()
+def analyze_chunk(dialogs_text: str, api_key: str) -> Dict[str, List[str]]:
+    """Отправляет один кусок диалогов в DeepSeek и разбирает JSON из ответа
     
-    problem_keywords = [
-        'не работает', 'не видим', 'не получается', 'не хватает', 'не могу',
-        'сломан', 'сломал', 'сломался', 'разбит', 'разбился',
-        'мутное', 'пятно', 'царапина', 'трещина',
-        'проблема', 'дефект', 'брак',
-        'как будто', 'почему', 'что делать'
-    ]
+    Такой же кусок, уже отправленный другим запросом (одну таблицу загрузили
+    одновременно), второй раз не отправляется — ждет тот ответ.
+    """
+    started = time.perf_counter()
+    payload = {
+        'model': 'deepseek-chat',
+        'messages': [
+            {'role': 'user', 'content': ANALYSIS_PROMPT.format(dialogs_text=dialogs_text)}
+        ],
+        'temperature': 0.2,
+        'max_tokens': 10000
+    }
+    result, coalesced = UPSTREAM_FLIGHTS.do(
+        flight_key(DEEPSEEK_URL, api_key, payload), lambda: request_deepseek(payload, api_key)
+    )
+    content = result['choices'][0]['message']['content']
+    # Куски идут в пуле потоков, вне таймера запроса: действие указывается явно.
+    # Токены общего ответа учитывает только тот, кто его запрашивал
+    usage = result.get('usage') or {}
+    if not coalesced:
+        METRICS.tokens(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0),
+                       time.perf_counter() - started, action='analyse')
     
-    product_keywords = ['микроскоп', 'телескоп', 'бинокль', 'прицел', 'лупа', 'окуляр', 'объектив']
+    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    if not json_match:
+        raise ValueError(f'Нет JSON в ответе: {content[:200]}')
     
-    for dialog in dialogs:
-        for msg in dialog['messages']:
-            content = msg['content']
-            content_lower = content.lower()
-            
-            # Извлекаем проблемы клиентов
-            if msg['source'] == 'Клиент':
-                # Разбиваем на предложения по точке и вопросу
-                sentences = content.replace('?', '.').split('.')
-                for sentence in sentences:
-                    sentence = sentence.strip()
-                    if any(word in sentence.lower() for word in problem_keywords):
-                        if len(sentence) > 200:
-                            sentence = sentence[:200] + '...'
-                        if len(sentence) > 10:
-                            problems.add(sentence)
-            
-            # Извлекаем названия товаров
-            if any(keyword in content_lower for keyword in product_keywords):
-                # Ищем паттерны: "слово цифры" или "слово слово цифры"
-                product_patterns = [
-                    r'[А-Яа-яA-Za-z]+\s+\d+[хx]?\d*',
-                    r'[А-Яа-я]+\s+[А-Яа-я]+\s+\d+',
-                    r'[А-Яа-я]+\s+[рРpP]\d+',
-                    r'детский\s+[А-Яа-я]+',
-                    r'[А-Яа-я]+-\d+',
-                ]
-                for pattern in product_patterns:
-                    matches = re.findall(pattern, content, re.IGNORECASE)
-                    for match in matches:
-                        cleaned = match.strip()
-                        if len(cleaned) > 4 and not cleaned.lower().startswith(('как ', 'что ', 'где ')):
-                            products.add(cleaned)
+    extracted = json.loads(json_match.group())
+    return {
+        'problems': extracted.get('problems', []),
+        'products': extracted.get('products', [])
+    }
+
+
+def request_deepseek(payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+    from http_client import request
+    response = request(
+        'POST',
+        DEEPSEEK_URL,
+        headers={
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        },
+        json=payload,
+        read_timeout=DEEPSEEK_TIMEOUT
+    )
     
+    if response.status_code != 200:
+        raise ValueError(f'DeepSeek API ошибка: {response.status_code}')
+    
+    return response.json()
+
+
+def merge_extractions(results: Iterable[Dict[str, List[str]]],
+                      fallback: Optional[KnowledgeCollector] = None) -> Dict[str, List[str]]:
+    """Объединяет ответы по кускам: схлопывает почти одинаковые элементы и ставит частые первыми
+    
+    Элемент ответа DeepSeek весит 1, элемент fallback-разбора — сколько раз
+    он встретился, так что частичный сбой API ранжирует так же, как путь без
+    ключа. От кластера остается самый частый вариант, при равной частоте
+    сохраняется порядок появления (ответы DeepSeek идут раньше fallback).
+    """
+    from near_duplicates import collapse_near_duplicates
+    results = list(results)
+    merged = {}
+    for field in ('problems', 'products'):
+        items = [(item, 1) for result in results for item in result.get(field, [])]
+        if fallback is not None:
+            items.extend(getattr(fallback, field).items())
+        merged[field] = collapse_near_duplicates(items)
+    return merged
+
+
+def process_with_deepseek(dialogs: Iterable[Dict[str, Any]], system_prompt: str,
+                          knowledge: Optional[KnowledgeCollector] = None,
+                          progress: Optional[JobProgress] = None) -> Dict[str, List[str]]:
+    """Обрабатывает диалоги через DeepSeek API с кастомным промптом
+    
+    Кроме problems/products возвращает analysis: deepseek, partial (часть
+    кусков разобрана fallback-парсером) или fallback.
+    
+    Map-reduce: диалоги пакуются в куски по бюджету токенов, куски уходят в
+    DeepSeek параллельно (не больше DEEPSEEK_CONCURRENCY запросов), ответы
+    объединяются. Диалоги кусков, которые не обработались, разбираются
+    extract_knowledge одним вызовом в конце (большой объем — в пуле
+    процессов). После DEEPSEEK_MAX_FAILURES неудачных кусков подряд API
+    считается недоступным: новые куски не отправляются, весь остаток потока
+    уходит в тот же fallback-разбор. dialogs читается один раз, счетчик
+    диалогов копится в knowledge. progress (для фоновых задач) получает фазу
+    analyse/extract и счетчики кусков.
+    """
+    if knowledge is None:
+        knowledge = KnowledgeCollector()
+    # Чтение диалогов, запросы и fallback перемежаются: отметки фаз ставятся
+    # на границах кусков — parse (чтение и упаковка), upstream (ожидание
+    # ответов), extract (fallback-разбор), merge
+    timer = current()
+    
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+    if not api_key:
+        print('DeepSeek обработка не удалась: DEEPSEEK_API_KEY не настроен')
+        if progress:
+            progress.report('extract')
+        knowledge.extend(dialogs)
+        timer.lap('extract')
+        return {**cap_extraction(knowledge.ranked()), 'analysis': 'fallback'}
+    
+    results = {}
+    # Диалоги кусков, не обработанных DeepSeek, копятся для одного fallback-разбора
+    failed_dialogs: List[Dict[str, Any]] = []
+    failed_chunks = []
+    consecutive_failures = 0
+    
+    def collect(future, index, chunk_dialogs):
+        nonlocal consecutive_failures
+        try:
+            results[index] = future.result()
+            consecutive_failures = 0
+        except Exception as e:
+            print(f'DeepSeek обработка куска {index} не удалась, используем fallback: {str(e)}')
+            failed_chunks.append(index)
+            failed_dialogs.extend(chunk_dialogs)
+            consecutive_failures += 1
+            if progress:
+                progress.advance('chunksFailed')
+        if progress:
+            progress.advance('chunksDone')
+    
+    remaining: Iterable[Dict[str, Any]] = ()
+    with ThreadPoolExecutor(max_workers=DEEPSEEK_CONCURRENCY) as executor:
+        pending = {}
+        chunks = pack_dialog_chunks(knowledge.count(dialogs))
+        for index, (chunk_dialogs, chunk_text) in enumerate(chunks):
+            timer.lap('parse')
+            # Не держим в памяти больше кусков, чем может обрабатываться одновременно
+            if len(pending) >= DEEPSEEK_CONCURRENCY:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, *pending.pop(future))
+                timer.lap('upstream')
+            if consecutive_failures >= DEEPSEEK_MAX_FAILURES:
+                print(f'DeepSeek недоступен ({consecutive_failures} кусков подряд с ошибкой), '
+                      f'остальные диалоги разбираются fallback-парсером')
+                failed_chunks.append(index)
+                failed_dialogs.extend(chunk_dialogs)
+                remaining = (dialog for rest, _ in chunks for dialog in rest)
+                break
+            future = executor.submit(analyze_chunk, chunk_text, api_key)
+            pending[future] = (index, chunk_dialogs)
+            if progress:
+                progress.report('analyse', chunksSubmitted=index + 1)
+        timer.lap('parse')
+        
+        for future in list(pending):
+            collect(future, *pending.pop(future))
+        timer.lap('upstream')
+    
+    ordered = [results[index] for index in sorted(results)]
+    fallback = None
+    if failed_chunks:
+        if progress:
+            progress.report('extract')
+        fallback = KnowledgeCollector()
+        fallback.extend(chain(failed_dialogs, remaining))
+        failed_dialogs.clear()
+        timer.lap('extract')
+    
+    extracted = cap_extraction(merge_extractions(ordered, fallback))
+    timer.lap('merge')
+    print(f'Кусков обработано DeepSeek: {len(results)}, fallback: {len(failed_chunks)}, '
+          f'извлечено проблем: {len(extracted["problems"])}, товаров: {len(extracted["products"])}')
+    
+    if not failed_chunks:
+        extracted['analysis'] = 'deepseek'
+    elif results:
+        extracted['analysis'] = 'partial'
+    else:
+        extracted['analysis'] = 'fallback'
+    return extracted
+
+
+def cap_extraction(extracted: Dict[str, List[str]]) -> Dict[str, List[str]]:
     return {
-        'products': sorted(list(products)),
-        'problems': sorted(list(problems))
-    }
\ No newline at end of file
+        'problems': extracted['problems'][:MAX_PROBLEMS],
+        'products': extracted['products'][:MAX_PRODUCTS]
+    }
@@ -0,0 +1,258 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from result_cache import CACHE_DIR
+
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', str(24 * 3600)))
+JOB_MAX_FINISHED = int(os.environ.get('JOB_MAX_FINISHED', '200'))
+# Задача в running без отметок прогресса дольше этого считается брошенной
+# (инстанс перезапустился) и возвращается в очередь
+JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', '600'))
+JOB_MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 1.0
+
+COUNTERS = ('dialogsParsed', 'messagesParsed', 'chunksSubmitted', 'chunksDone', 'chunksFailed')
+
+
+class JobProgress:
+    """Фаза (parse / extract / analyse) и счетчики задачи
+
+    Изменения копятся в памяти и пишутся в SQLite не чаще раза в
+    PROGRESS_INTERVAL секунд или при смене фазы; запись заодно служит
+    отметкой, что задача жива.
+    """
+
+    def __init__(self, queue: 'JobQueue', job_id: str):
+        self._queue = queue
+        self._job_id = job_id
+        self._lock = threading.Lock()
+        self.phase = 'parse'
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._saved_at = 0.0
+
+    def report(self, phase: Optional[str] = None, **counters: int) -> None:
+        with self._lock:
+            phase_changed = phase is not None and phase != self.phase
+            if phase is not None:
+                self.phase = phase
+            self.counters.update(counters)
+            self._save(force=phase_changed)
+
+    def advance(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] += amount
+            self._save()
+
+    def track(self, dialogs: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Пропускает диалоги насквозь, считая прочитанные диалоги и сообщения"""
+        for dialog in dialogs:
+            with self._lock:
+                self.counters['dialogsParsed'] += 1
+                self.counters['messagesParsed'] += len(dialog['messages'])
+                self._save()
+            yield dialog
+
+    def flush(self) -> None:
+        with self._lock:
+            self._save(force=True)
+
+    def _save(self, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self._saved_at < PROGRESS_INTERVAL:
+            return
+        self._saved_at = now
+        self._queue.save_progress(self._job_id, self.phase, self.counters)
+
+
+class JobQueue:
+    """Очередь задач анализа в SQLite и локальный воркер, который ее разбирает
+
+    Файл задачи лежит рядом с базой, в базе — параметры, фаза, счетчики и
+    итоговый результат. Воркер — фоновый поток процесса: запускается при
+    постановке задачи или опросе статуса и завершается, когда очередь пуста.
+    Завершенные задачи хранятся JOB_RETENTION секунд, не больше JOB_MAX_FINISHED.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, 'jobs.sqlite3')
+        self.payload_dir = os.path.join(os.path.dirname(self.path), 'jobs')
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(self.payload_dir, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, phase TEXT, params TEXT NOT NULL, '
+            'payload TEXT, progress TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL, '
+            'created REAL NOT NULL, updated REAL NOT NULL)'
+        )
+        return connection
+
+    def submit(self, params: Dict[str, Any], payload: Optional[bytes] = None) -> str:
+        """Ставит задачу в очередь; файл загрузки сохраняется на диск до конца обработки"""
+        job_id = uuid.uuid4().hex
+        connection = self._connect()
+        try:
+            payload_path = None
+            if payload is not None:
+                payload_path = os.path.join(self.payload_dir, f'{job_id}.bin')
+                with open(payload_path, 'wb') as payload_file:
+                    payload_file.write(payload)
+            now = time.time()
+            with connection:
+                connection.execute(
+                    'INSERT INTO jobs (id, status, phase, params, payload, progress, attempts, created, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)',
+                    (job_id, 'queued', None, json.dumps(params, ensure_ascii=False), payload_path,
+                     json.dumps(dict.fromkeys(COUNTERS, 0)), now, now)
+                )
+                self._cleanup(connection, now)
+        finally:
+            connection.close()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT status, phase, progress, result, error, created, updated FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+
+        status, phase, progress, result, error, created, updated = row
+        job = {
+            'jobId': job_id,
+            'status': status,
+            'phase': phase,
+            'progress': json.loads(progress),
+            'createdAt': created,
+            'updatedAt': updated,
+        }
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def save_progress(self, job_id: str, phase: str, counters: Dict[str, int]) -> None:
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    'UPDATE jobs SET phase = ?, progress = ?, updated = ? WHERE id = ?',
+                    (phase, json.dumps(counters), time.time(), job_id)
+                )
+        except sqlite3.Error as e:
+            print(f'Не удалось сохранить прогресс задачи {job_id}: {str(e)}')
+        finally:
+            connection.close()
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Берет самую старую задачу из очереди; брошенные running возвращает в очередь"""
+        connection = self._connect()
+        try:
+            with connection:
+                now = time.time()
+                connection.execute(
+                    "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated < ? AND attempts < ?",
+                    (now - JOB_STALE_AFTER, JOB_MAX_ATTEMPTS)
+                )
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                    "WHERE status = 'running' AND updated < ?",
+                    ('Обработка прерывалась слишком много раз', now, now - JOB_STALE_AFTER)
+                )
+                while True:
+                    row = connection.execute(
+                        "SELECT id, params, payload FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    # Задачу мог забрать воркер другого инстанса между SELECT и UPDATE
+                    claimed = connection.execute(
+                        "UPDATE jobs SET status = 'running', phase = 'parse', attempts = attempts + 1, updated = ? "
+                        "WHERE id = ? AND status = 'queued'",
+                        (now, row[0])
+                    ).rowcount
+                    if claimed:
+                        return {'id': row[0], 'params': json.loads(row[1]), 'payload': row[2]}
+        finally:
+            connection.close()
+
+    def _finish(self, job: Dict[str, Any], progress: JobProgress,
+                result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, phase = ?, progress = ?, result = ?, error = ?, '
+                    'payload = NULL, updated = ? WHERE id = ?',
+                    ('done' if error is None else 'failed', progress.phase, json.dumps(progress.counters),
+                     None if result is None else json.dumps(result, ensure_ascii=False), error,
+                     time.time(), job['id'])
+                )
+        finally:
+            connection.close()
+        remove_payload(job['payload'])
+
+    def _cleanup(self, connection: sqlite3.Connection, now: float) -> None:
+        expired = connection.execute(
+            "SELECT id, payload FROM jobs WHERE status IN ('done', 'failed') AND (updated < ? OR id IN ("
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed') ORDER BY updated DESC LIMIT -1 OFFSET ?))",
+            (now - JOB_RETENTION, JOB_MAX_FINISHED)
+        ).fetchall()
+        connection.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id, _ in expired])
+        for _, payload in expired:
+            remove_payload(payload)
+
+    def start_worker(self, run_job: Callable[[Dict[str, Any], JobProgress], Dict[str, Any]]) -> None:
+        """Запускает фоновый поток-воркер, если он еще не работает
+
+        run_job(job, progress) получает параметры задачи (job['params'], путь
+        к файлу job['payload']) и возвращает результат для статуса.
+        """
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._drain, args=(run_job,), daemon=True)
+            self._worker.start()
+
+    def _drain(self, run_job) -> None:
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f'Очередь задач недоступна: {str(e)}')
+                return
+            if job is None:
+                return
+
+            progress = JobProgress(self, job['id'])
+            try:
+                result = run_job(job, progress)
+            except Exception as e:
+                print(f'Задача {job["id"]} завершилась ошибкой: {str(e)}')
+                self._finish(job, progress, None, f'Ошибка обработки: {str(e)}')
+            else:
+                progress.phase = 'done'
+                self._finish(job, progress, result, None)
+
+
+def remove_payload(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,228 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Fallback-разбор: диалоги режутся на шарды по числу сообщений. Если шард
+# всего один или EXTRACT_WORKERS=1, разбор идет в текущем процессе, иначе шарды
+# уходят в пул процессов. По умолчанию пул выключен: os.cpu_count() видит
+# процессоры хоста, а не квоту инстанса, — число процессов задается явно
+EXTRACT_SHARD_MESSAGES = int(os.environ.get('EXTRACT_SHARD_MESSAGES', '50000'))
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', '1'))
+
+PROBLEM_KEYWORDS = [
+    'не работает', 'не видим', 'не получается', 'не хватает', 'не могу',
+    'сломан', 'сломал', 'сломался', 'разбит', 'разбился',
+    'мутное', 'пятно', 'царапина', 'трещина',
+    'проблема', 'дефект', 'брак',
+    'как будто', 'почему', 'что делать'
+]
+
+PRODUCT_KEYWORDS = ['микроскоп', 'телескоп', 'бинокль', 'прицел', 'лупа', 'окуляр', 'объектив']
+
+# Ищем паттерны: "слово цифры" или "слово слово цифры".
+# Паттерны не объединяются в один: findall каждого дает свои пересекающиеся
+# совпадения, и общая альтернатива изменила бы результат.
+# Lookbehind в начале не меняет совпадений: совпадение с середины слова
+# возможно, только если предыдущее совпадение закончилось буквой, а это
+# бывает лишь у первого паттерна после "цифра + х". Зато движок больше не
+# перебирает каждую позицию внутри слова.
+PRODUCT_PATTERNS_WITH_DIGITS = [
+    re.compile(r'(?:(?<![А-Яа-яA-Za-z])|(?<=\d[хx]))[А-Яа-яA-Za-z]+\s+\d+[хx]?\d*', re.IGNORECASE),
+    re.compile(r'(?<![А-Яа-я])[А-Яа-я]+\s+[А-Яа-я]+\s+\d+', re.IGNORECASE),
+    re.compile(r'(?<![А-Яа-я])[А-Яа-я]+\s+[рРpP]\d+', re.IGNORECASE),
+]
+CHILD_PRODUCT_PATTERN = re.compile(r'детский\s+[А-Яа-я]+', re.IGNORECASE)
+HYPHEN_PRODUCT_PATTERN = re.compile(r'(?<![А-Яа-я])[А-Яа-я]+-\d+', re.IGNORECASE)
+DIGIT_RE = re.compile(r'\d')
+
+# Все ключевые слова списка ищутся одним проходом по тексту в нижнем регистре
+PROBLEM_KEYWORDS_RE = re.compile('|'.join(re.escape(word) for word in PROBLEM_KEYWORDS))
+PRODUCT_KEYWORDS_RE = re.compile('|'.join(re.escape(word) for word in PRODUCT_KEYWORDS))
+
+
+class KnowledgeCollector:
+    """Накапливает проблемы клиентов и товары по мере чтения диалогов"""
+    
+    def __init__(self):
+        # Строка -> сколько раз встретилась: частота нужна для ранжирования кластеров
+        self.products: Dict[str, int] = {}
+        self.problems: Dict[str, int] = {}
+        self.dialogs_count = 0
+    
+    def count(self, dialogs: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Пропускает диалоги дальше, только считая их"""
+        for dialog in dialogs:
+            self.dialogs_count += 1
+            yield dialog
+    
+    def add(self, dialog: Dict[str, Any]) -> None:
+        self.dialogs_count += 1
+        
+        for msg in dialog['messages']:
+            content = msg['content']
+            content_lower = content.lower()
+            
+            # Извлекаем проблемы клиентов
+            if msg['source'] == 'Клиент':
+                self._add_problems(content, content_lower)
+            
+            # Извлекаем названия товаров
+            if PRODUCT_KEYWORDS_RE.search(content_lower):
+                self._add_products(content)
+    
+    def extend(self, dialogs: Iterable[Dict[str, Any]], workers: Optional[int] = None) -> None:
+        """Разбирает поток диалогов; большие объемы — параллельно в пуле процессов"""
+        workers = EXTRACT_WORKERS if workers is None else workers
+        shards = iter_shards(dialogs, EXTRACT_SHARD_MESSAGES)
+        head = list(islice(shards, 2))
+        shards = chain(head, shards)
+        
+        if workers > 1 and len(head) > 1:
+            self._extend_parallel(shards, workers)
+        else:
+            for shard in shards:
+                self._add_shard(shard)
+    
+    def _extend_parallel(self, shards: Iterator[List[Dict[str, Any]]], workers: int) -> None:
+        try:
+            # spawn, а не fork: пул создается и из потока очереди задач, а fork
+            # копирует блокировки, занятые другими потоками
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        except (OSError, NotImplementedError) as e:
+            # Например, нет /dev/shm для семафоров multiprocessing
+            print(f'Пул процессов недоступен, разбираем в одном процессе: {str(e)}')
+            for shard in shards:
+                self._add_shard(shard)
+            return
+        
+        pending = {}
+        with executor:
+            for shard in shards:
+                # Держим в памяти не больше двух шардов на процесс
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._merge_shard(future, pending.pop(future))
+                try:
+                    pending[executor.submit(extract_shard, shard)] = shard
+                except BrokenProcessPool:
+                    self._add_shard(shard)
+            
+            for future in list(pending):
+                self._merge_shard(future, pending.pop(future))
+    
+    def _merge_shard(self, future, shard: List[Dict[str, Any]]) -> None:
+        try:
+            products, problems = future.result()
+        except BrokenProcessPool:
+            self._add_shard(shard)
+            return
+        for item, count in products.items():
+            self.products[item] = self.products.get(item, 0) + count
+        for item, count in problems.items():
+            self.problems[item] = self.problems.get(item, 0) + count
+        self.dialogs_count += len(shard)
+    
+    def _add_shard(self, shard: List[Dict[str, Any]]) -> None:
+        for dialog in shard:
+            self.add(dialog)
+    
+    def _add_products(self, content: str) -> None:
+        # Все паттерны, кроме "детский ...", требуют цифру — без нее их не запускаем
+        if DIGIT_RE.search(content):
+            patterns = [*PRODUCT_PATTERNS_WITH_DIGITS, CHILD_PRODUCT_PATTERN, HYPHEN_PRODUCT_PATTERN]
+        else:
+            patterns = [CHILD_PRODUCT_PATTERN]
+        
+        for pattern in patterns:
+            matches = pattern.findall(content)
+            for match in matches:
+                cleaned = match.strip()
+                if len(cleaned) > 4 and not cleaned.lower().startswith(('как ', 'что ', 'где ')):
+                    self.products[cleaned] = self.products.get(cleaned, 0) + 1
+    
+    def _add_problems(self, content: str, content_lower: str) -> None:
+        """Добавляет предложения сообщения, в которых есть ключевые слова проблем
+        
+        Ключевые слова ищутся один раз по всему сообщению, затем совпадения
+        раскладываются по предложениям. Ключевые слова не содержат '.' и '?',
+        поэтому совпадение всегда лежит внутри одного предложения.
+        """
+        hits = [match.start() for match in PROBLEM_KEYWORDS_RE.finditer(content_lower)]
+        if not hits:
+            return
+        
+        # Разбиваем на предложения по точке и вопросу
+        sentences = content.replace('?', '.').split('.')
+        
+        if len(content_lower) != len(content):
+            # lower() изменил длину строки, позиции совпадений не переносятся на исходный текст
+            for sentence in sentences:
+                sentence = sentence.strip()
+                if PROBLEM_KEYWORDS_RE.search(sentence.lower()):
+                    self._add_problem(sentence)
+            return
+        
+        position = 0
+        hit_index = 0
+        for sentence in sentences:
+            end = position + len(sentence)
+            while hit_index < len(hits) and hits[hit_index] < position:
+                hit_index += 1
+            if hit_index < len(hits) and hits[hit_index] < end:
+                self._add_problem(sentence.strip())
+            position = end + 1
+    
+    def _add_problem(self, sentence: str) -> None:
+        if len(sentence) > 200:
+            sentence = sentence[:200] + '...'
+        if len(sentence) > 10:
+            self.problems[sentence] = self.problems.get(sentence, 0) + 1
+    
+    def result(self) -> Dict[str, List[str]]:
+        return {
+            'products': sorted(list(self.products)),
+            'problems': sorted(list(self.problems))
+        }
+    
+    def ranked(self) -> Dict[str, List[str]]:
+        """Без почти-дублей, самые частые кластеры первыми — для обрезки до MAX_PROBLEMS/MAX_PRODUCTS"""
+        from near_duplicates import collapse_near_duplicates
+        return {
+            'products': collapse_near_duplicates(self.products.items()),
+            'problems': collapse_near_duplicates(self.problems.items())
+        }
+
+
+def extract_knowledge(dialogs: Iterable[Dict[str, Any]], workers: Optional[int] = None) -> Dict[str, List[str]]:
+    """Быстрое извлечение проблем клиентов и товаров из диалогов"""
+    collector = KnowledgeCollector()
+    collector.extend(dialogs, workers)
+    return collector.result()
+
+
+def extract_shard(dialogs: List[Dict[str, Any]]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Разбор одного шарда в процессе пула; результат объединяет KnowledgeCollector"""
+    collector = KnowledgeCollector()
+    for dialog in dialogs:
+        collector.add(dialog)
+    return collector.products, collector.problems
+
+
+def iter_shards(dialogs: Iterable[Dict[str, Any]], shard_messages: int) -> Iterator[List[Dict[str, Any]]]:
+    """Режет поток диалогов на шарды примерно по shard_messages сообщений"""
+    shard = []
+    messages = 0
+    for dialog in dialogs:
+        shard.append(dialog)
+        messages += len(dialog['messages'])
+        if messages >= shard_messages:
+            yield shard
+            shard = []
+            messages = 0
+    if shard:
+        yield shard
@@ -0,0 +1,341 @@
+"""Метрики backend-функции в памяти инстанса: фазы запросов, задержки API, токены
+
+Гистограммы фиксированного размера в духе HDR Histogram: значение попадает в
+корзину логарифмической шкалы с SUB_BUCKETS корзинами на октаву (ошибка
+квантиля не больше 1/SUB_BUCKETS), память не растет с числом запросов.
+Фазы и токены запроса копятся в RequestTimer и записываются в гистограммы
+одним заходом под блокировкой в конце запроса: лишняя работа — около
+микросекунды на фазу, строка JSON-лога добавляет еще десяток.
+GET ?action=metrics отдает все в текстовом формате Prometheus — только с
+?token=<METRICS_TOKEN>; без METRICS_TOKEN выдача закрыта (403). Строка JSON
+по каждому запросу пишется в stdout только при METRICS_LOG=1.
+
+Функции деплоятся по отдельности, и копия модуля лежит в каталоге каждой
+из них — правки вносятся во все копии. Копия в chatgpt-polza написана
+по-английски; scripts/check_shared_modules.py проверяет, что код всех копий
+совпадает.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+METRICS_PREFIX = os.environ.get('METRICS_PREFIX', 'backend')
+METRICS_LOG = os.environ.get('METRICS_LOG', '0') == '1'
+# Метрики отдаются только с ?token=<METRICS_TOKEN>; пока токен не задан, выдача закрыта
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+# Значения до 2^40 единиц (для микросекунд — 12 дней), больше — в последнюю корзину
+MAX_BITS = 40
+BUCKETS = (MAX_BITS - SUB_BITS) * SUB_BUCKETS + 2 * SUB_BUCKETS
+
+# Границы le в выдаче Prometheus: мелкие корзины сворачиваются до них
+SECONDS_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                  0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """[нижняя, верхняя) граница корзины в единицах гистограммы"""
+    shift = max(0, (index >> SUB_BITS) - 1)
+    top = index - (shift << SUB_BITS)
+    return top << shift, (top + 1) << shift
+
+
+class Histogram:
+    """Гистограмма неотрицательных значений; scale — единиц на единицу значения
+
+    Для секунд scale=1e6: корзины в микросекундах. Запись не берет блокировку —
+    ее держит вызывающий (Metrics).
+    """
+
+    def __init__(self, scale: float):
+        self.scale = scale
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, value: float) -> None:
+        # Номер корзины: до 2·SUB_BUCKETS значения точные, дальше — SUB_BUCKETS на октаву
+        scaled = int(value * self.scale) if value > 0 else 0
+        bits = scaled.bit_length()
+        if bits <= SUB_BITS + 1:
+            index = scaled
+        elif bits > MAX_BITS:
+            index = BUCKETS - 1
+        else:
+            shift = bits - SUB_BITS - 1
+            index = (shift << SUB_BITS) + (scaled >> shift)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Середина корзины, в которую попадает квантиль q"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                lower, upper = bucket_bounds(index)
+                return (lower + upper) / 2 / self.scale
+        return 0.0
+
+    def cumulative(self, bounds: Tuple[float, ...]) -> List[int]:
+        """Число значений не больше каждой границы (корзина считается целиком по верхней границе)"""
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            limit = bound * self.scale
+            while index < BUCKETS and bucket_bounds(index)[1] <= limit:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class RequestTimer:
+    """Фазы одного запроса: lap(phase) относит время с прошлой отметки к phase"""
+
+    __slots__ = ('action', 'started', 'last', 'phases', 'tokens', 'token_seconds')
+
+    def __init__(self, action: str):
+        self.action = action
+        self.started = self.last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.tokens: Optional[Tuple[int, int]] = None
+        self.token_seconds = 0.0
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+
+class _NullTimer:
+    """Заглушка вне запроса (например, в потоках пула): отметки ничего не делают"""
+
+    action = None
+
+    def lap(self, phase: str) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+_current: contextvars.ContextVar = contextvars.ContextVar('request_timer', default=_NULL_TIMER)
+
+
+def current():
+    """Таймер текущего запроса или заглушка"""
+    return _current.get()
+
+
+class _ActionSeries:
+    """Гистограммы и счетчики одного действия: в конце запроса — без сборки меток"""
+
+    __slots__ = ('request', 'phases', 'statuses', 'tokens_in', 'tokens_out', 'rate')
+
+    def __init__(self, metrics: 'Metrics', action: str):
+        labels = (('action', action),)
+        self.request = metrics._histogram('request_seconds', labels, 1e6)
+        self.phases: Dict[str, Histogram] = {}
+        self.statuses: Dict[int, Labels] = {}
+        self.tokens_in = ('tokens_total', labels + (('direction', 'in'),))
+        self.tokens_out = ('tokens_total', labels + (('direction', 'out'),))
+        self.rate = metrics._histogram('tokens_per_second', labels, 1e3)
+
+
+class Metrics:
+    def __init__(self):
+        self.function = ''
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._actions: Dict[str, _ActionSeries] = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, name: str, labels: Labels, scale: float) -> Histogram:
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = Histogram(scale)
+        return histogram
+
+    def _add(self, name: str, labels: Labels, amount: float) -> None:
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _series(self, action: str) -> _ActionSeries:
+        """Вызывается под блокировкой"""
+        series = self._actions.get(action)
+        if series is None:
+            series = self._actions[action] = _ActionSeries(self, action)
+        return series
+
+    def _record_tokens(self, series: _ActionSeries, prompt_tokens: int, completion_tokens: int,
+                       seconds: Optional[float]) -> None:
+        """Вызывается под блокировкой"""
+        counters = self._counters
+        counters[series.tokens_in] = counters.get(series.tokens_in, 0) + prompt_tokens
+        counters[series.tokens_out] = counters.get(series.tokens_out, 0) + completion_tokens
+        if seconds and completion_tokens:
+            series.rate.record(completion_tokens / seconds)
+
+    def begin(self, action: str) -> RequestTimer:
+        timer = RequestTimer(action)
+        _current.set(timer)
+        return timer
+
+    def end(self, timer: RequestTimer, status: int) -> None:
+        elapsed = time.perf_counter() - timer.started
+        action = timer.action
+        phases = timer.phases
+        with self._lock:
+            series = self._series(action)
+            key = series.statuses.get(status)
+            if key is None:
+                key = series.statuses[status] = ('requests_total', (('action', action), ('status', str(status))))
+            self._counters[key] = self._counters.get(key, 0) + 1
+            series.request.record(elapsed)
+            for phase, seconds in phases.items():
+                histogram = series.phases.get(phase)
+                if histogram is None:
+                    histogram = series.phases[phase] = self._histogram(
+                        'phase_seconds', (('action', action), ('phase', phase)), 1e6)
+                histogram.record(seconds)
+            if timer.tokens:
+                self._record_tokens(series, timer.tokens[0], timer.tokens[1], timer.token_seconds)
+        _current.set(_NULL_TIMER)
+
+        if METRICS_LOG:
+            record = {
+                'function': self.function,
+                'action': action,
+                'status': status,
+                'ms': round(elapsed * 1000, 3),
+                'phases': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+            }
+            if timer.tokens:
+                record['tokens'] = {'in': timer.tokens[0], 'out': timer.tokens[1]}
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def upstream(self, host: str, status: str, seconds: float) -> None:
+        """Один запрос к внешнему API (каждая попытка отдельно); status — код или error"""
+        with self._lock:
+            self._histogram('upstream_seconds', (('host', host), ('status', status)), 1e6).record(seconds)
+
+    def tokens(self, prompt_tokens: int, completion_tokens: int, seconds: Optional[float] = None,
+               action: Optional[str] = None) -> None:
+        """Токены ответа модели; seconds — время запроса к API для tokens/s
+
+        Внутри запроса токены копятся в таймере и записываются вместе с ним в
+        end(). Вне запроса (в потоках пула) пишутся сразу, action передается явно.
+        """
+        timer = current()
+        if timer is not _NULL_TIMER and action in (None, timer.action):
+            previous = timer.tokens or (0, 0)
+            timer.tokens = (previous[0] + prompt_tokens, previous[1] + completion_tokens)
+            if seconds and completion_tokens:
+                timer.token_seconds += seconds
+            return
+        with self._lock:
+            self._record_tokens(self._series(action or timer.action or 'unknown'),
+                                prompt_tokens, completion_tokens, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Квантили и счетчики в виде словаря — для бенчмарков и отладки"""
+        with self._lock:
+            histograms = {
+                (name, labels): (histogram.count, histogram.quantile(0.5), histogram.quantile(0.95),
+                                 histogram.quantile(0.99))
+                for (name, labels), histogram in self._histograms.items()
+            }
+            counters = dict(self._counters)
+        return {'histograms': histograms, 'counters': counters}
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)"""
+        function = (('function', self.function),) if self.function else ()
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f'# TYPE {METRICS_PREFIX}_{name} counter')
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'{METRICS_PREFIX}_{name}{_labels(function + labels)} {value:g}')
+            for name in sorted({name for name, _ in self._histograms}):
+                bounds = RATE_BOUNDS if name == 'tokens_per_second' else SECONDS_BOUNDS
+                lines.append(f'# TYPE {METRICS_PREFIX}_{name} histogram')
+                for (histogram_name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+                    series = function + labels
+                    for bound, count in zip(bounds, histogram.cumulative(bounds)):
+                        lines.append(f'{METRICS_PREFIX}_{name}_bucket{_labels(series + (("le", f"{bound:g}"),))} {count}')
+                    lines.append(f'{METRICS_PREFIX}_{name}_bucket{_labels(series + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{METRICS_PREFIX}_{name}_sum{_labels(series)} {histogram.total:.6f}')
+                    lines.append(f'{METRICS_PREFIX}_{name}_count{_labels(series)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: Labels) -> str:
+    escaped = (
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+METRICS = Metrics()
+
+
+def metrics_response(event: dict) -> dict:
+    params = event.get('queryStringParameters') or {}
+    if not METRICS_TOKEN or params.get('token') != METRICS_TOKEN:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Forbidden'})
+        }
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        'body': METRICS.render()
+    }
+
+
+def instrumented(function: str, action: Callable[[dict], str]):
+    """Декоратор handler: таймер на каждый запрос и GET/POST ?action=metrics
+
+    action(event) — имя действия для меток; handler может уточнить его через
+    current().action. Время после последней отметки относится к фазе
+    serialize (сборка ответа), исключение handler записывается статусом 500.
+    """
+    METRICS.function = function
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            if (event.get('queryStringParameters') or {}).get('action') == 'metrics':
+                return metrics_response(event)
+            timer = METRICS.begin(action(event))
+            try:
+                response = handler(event, context)
+            except BaseException:
+                METRICS.end(timer, 500)
+                raise
+            timer.lap('serialize')
+            METRICS.end(timer, response.get('statusCode', 200))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,157 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from vector_index import char_ngram_hashes
+
+SHINGLE = 3
+NUM_PERM = 64
+BANDS = 16  # 16 полос по 4 строки: пары со сходством ~0.7 становятся кандидатами с вероятностью ~99%
+SIMILARITY_THRESHOLD = 0.7
+SIGNATURE_BATCH = 50000
+
+_NON_WORD_RE = re.compile(r'[\W_]+')
+_DIGITS_RE = re.compile(r'\d+')
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+_EMPTY = np.iinfo(np.uint64).max
+
+
+def normalize_item(item: str) -> str:
+    """Нижний регистр, без пунктуации и лишних пробелов: "Не работает!!" == "не работает" """
+    return ' '.join(_NON_WORD_RE.sub(' ', item.lower()).split())
+
+
+def model_key(normalized: str) -> str:
+    """Числа строки по порядку: "микромед р1" и "микромед р2" — разные модели, сколько бы букв ни совпало"""
+    return ' '.join(_DIGITS_RE.findall(normalized))
+
+
+def minhash_signatures(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """MinHash-подписи по символьным шинглам; второй массив — есть ли у текста шинглы"""
+    signatures = np.full((len(texts), NUM_PERM), _EMPTY, dtype=np.uint64)
+    has_shingles = np.zeros(len(texts), dtype=bool)
+
+    for start in range(0, len(texts), SIGNATURE_BATCH):
+        rows, hashes = char_ngram_hashes(texts[start:start + SIGNATURE_BATCH], SHINGLE)
+        if not len(hashes):
+            continue
+        # rows возрастают, поэтому минимум по тексту — reduceat по началам групп
+        group_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        present = rows[group_starts] + start
+        has_shingles[present] = True
+        for permutation in range(NUM_PERM):
+            permuted = hashes * _PERM_A[permutation] + _PERM_B[permutation]
+            signatures[present, permutation] = np.minimum.reduceat(permuted, group_starts)
+
+    return signatures, has_shingles
+
+
+def cluster_signatures(signatures: np.ndarray, candidates: np.ndarray, partitions: np.ndarray,
+                       threshold: float = SIMILARITY_THRESHOLD) -> np.ndarray:
+    """LSH по полосам подписи; возвращает номер кластера для каждого текста
+
+    В каждой корзине полосы текст сравнивается только с первым текстом
+    корзины, поэтому попарных сравнений O(n) на полосу, а не O(n²).
+    Тексты из разных partitions (номеров моделей) не склеиваются никогда:
+    номер входит в ключ полосы и сверяется у пары.
+    Связность кластеров считается проталкиванием минимальной метки.
+    """
+    count = len(signatures)
+    labels = np.arange(count)
+    indexes = np.flatnonzero(candidates)
+    if len(indexes) < 2:
+        return labels
+
+    rows_per_band = NUM_PERM // BANDS
+    edges_from = []
+    edges_to = []
+    for band in range(BANDS):
+        band_signature = signatures[indexes, band * rows_per_band:(band + 1) * rows_per_band]
+        band_key = partitions[indexes].astype(np.uint64)
+        for column in range(rows_per_band):
+            band_key = (band_key ^ band_signature[:, column]) * np.uint64(0x100000001B3)
+
+        order = np.argsort(band_key, kind='stable')
+        sorted_keys = band_key[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        group_sizes = np.diff(np.r_[group_start, len(order)])
+        heads = np.repeat(order[group_start], group_sizes)
+
+        members = indexes[order]
+        heads = indexes[heads]
+        not_head = members != heads
+        members, heads = members[not_head], heads[not_head]
+        if not len(members):
+            continue
+
+        agreement = (signatures[members] == signatures[heads]).mean(axis=1)
+        similar = (agreement >= threshold) & (partitions[members] == partitions[heads])
+        edges_from.append(members[similar])
+        edges_to.append(heads[similar])
+
+    if not edges_from:
+        return labels
+    edges_from = np.concatenate(edges_from)
+    edges_to = np.concatenate(edges_to)
+
+    while True:
+        lowest = np.minimum(labels[edges_from], labels[edges_to])
+        updated = labels.copy()
+        np.minimum.at(updated, edges_from, lowest)
+        np.minimum.at(updated, edges_to, lowest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def collapse_near_duplicates(weighted_items: Iterable[Tuple[str, int]],
+                             threshold: float = SIMILARITY_THRESHOLD) -> List[str]:
+    """Схлопывает почти одинаковые строки и ранжирует кластеры по частоте
+
+    weighted_items — пары (строка, сколько раз встретилась) в порядке
+    приоритета. От каждого кластера остается самый частый вариант; кластеры
+    упорядочены по суммарной частоте, при равенстве — по первому появлению.
+    Строки с разными числами (Celestron 114 и 130) остаются разными.
+    """
+    # Точные совпадения после нормализации склеиваем без MinHash
+    groups: Dict[str, List] = {}
+    for item, count in weighted_items:
+        if not isinstance(item, str) or not item.strip():
+            continue
+        item = item.strip()
+        key = normalize_item(item) or item.casefold()
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [item, count, count, len(groups)]
+            continue
+        group[2] += count
+        if count > group[1]:
+            group[0], group[1] = item, count
+
+    if not groups:
+        return []
+
+    keys = list(groups)
+    models: Dict[str, int] = {}
+    partitions = np.fromiter((models.setdefault(model_key(key), len(models)) for key in keys),
+                             dtype=np.int64, count=len(keys))
+    signatures, has_shingles = minhash_signatures(keys)
+    labels = cluster_signatures(signatures, has_shingles, partitions, threshold)
+
+    clusters: Dict[int, List] = {}
+    for key, label in zip(keys, labels.tolist()):
+        item, _, total, first_index = groups[key]
+        cluster = clusters.get(label)
+        if cluster is None:
+            clusters[label] = [item, total, total, first_index]
+            continue
+        cluster[2] += total
+        if total > cluster[1]:
+            cluster[0], cluster[1] = item, total
+
+    ranked = sorted(clusters.values(), key=lambda cluster: (-cluster[2], cluster[3]))
+    return [cluster[0] for cluster in ranked]
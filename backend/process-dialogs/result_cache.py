@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+CACHE_DIR = os.environ.get('PROCESS_DIALOGS_CACHE_DIR', '/tmp/process-dialogs')
+CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', str(7 * 24 * 3600)))
+
+
+def make_cache_key(content_digest: str, source_kind: str, system_prompt: str, extractor_version: str) -> str:
+    """Ключ кэша: хэш содержимого таблицы, способа разбора, промпта и версии извлечения"""
+    key = hashlib.sha256()
+    for part in (extractor_version, source_kind, content_digest, system_prompt):
+        key.update(part.encode('utf-8'))
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+class ResultCache:
+    """Кэш результатов обработки таблиц в SQLite с вытеснением по LRU и TTL
+
+    Ошибки SQLite не прерывают обработку: чтение превращается в промах,
+    запись пропускается.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = CACHE_MAX_BYTES, ttl: int = CACHE_TTL):
+        self.path = path or os.path.join(CACHE_DIR, 'results.sqlite3')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        return connection
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    now = time.time()
+                    row = connection.execute(
+                        'SELECT value FROM results WHERE key = ? AND created > ?',
+                        (key, now - self.ttl)
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    connection.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+                return json.loads(row[0])
+            finally:
+                connection.close()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f'Кэш результатов недоступен: {str(e)}')
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        if len(data) > self.max_bytes:
+            return
+
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    now = time.time()
+                    connection.execute(
+                        'INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                        (key, data, len(data), now, now)
+                    )
+                    self._evict(connection, now)
+            finally:
+                connection.close()
+        except (sqlite3.Error, OSError) as e:
+            print(f'Не удалось сохранить результат в кэш: {str(e)}')
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        connection.execute('DELETE FROM results WHERE created <= ?', (now - self.ttl,))
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Удаляем давно не использованные записи, пока не уложимся в лимит
+        for key, size in connection.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+            if total <= self.max_bytes:
+                break
+            connection.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
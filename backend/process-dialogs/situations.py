@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from result_cache import CACHE_DIR
+
+PENDING_DIR = os.path.join(CACHE_DIR, 'index-pending')
+
+CLIENT_SOURCE = 'Клиент'
+
+
+def iter_situations(dialog: Dict[str, Any]) -> Iterator[Tuple[str, str]]:
+    """Пары (сообщение клиента, ответ оператора сразу после него)"""
+    messages = dialog['messages']
+    for index, message in enumerate(messages):
+        if message['source'] != CLIENT_SOURCE:
+            continue
+        replies = []
+        for following in messages[index + 1:]:
+            if following['source'] == CLIENT_SOURCE:
+                break
+            replies.append(following['content'])
+        yield message['content'], '\n'.join(replies)
+
+
+def pending_path(source_id: str) -> str:
+    return os.path.join(PENDING_DIR, hashlib.sha256(source_id.encode('utf-8')).hexdigest()[:32] + '.jsonl')
+
+
+class SituationStager:
+    """Откладывает ситуации источника для векторной базы, не строя ее
+
+    Во время анализа ситуации только дописываются строками JSON во временный
+    файл — без NumPy и эмбеддингов. finish() атомарно кладет файл в очередь
+    источника; индекс собирается из него при первом запросе action=query
+    (vector_index.build_pending_index).
+    """
+
+    def __init__(self, source_id: str):
+        self.source_id = source_id
+        self.count = 0
+        os.makedirs(PENDING_DIR, exist_ok=True)
+        descriptor, self._path = tempfile.mkstemp(prefix='stage-', dir=PENDING_DIR)
+        self._file = os.fdopen(descriptor, 'w', encoding='utf-8')
+
+    def observe(self, dialogs: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Пропускает диалоги дальше, попутно откладывая их ситуации"""
+        for dialog in dialogs:
+            self.add(dialog)
+            yield dialog
+
+    def add(self, dialog: Dict[str, Any]) -> None:
+        for client_message, operator_reply in iter_situations(dialog):
+            self._file.write(json.dumps((client_message, operator_reply, dialog['dialog_id']), ensure_ascii=False))
+            self._file.write('\n')
+            self.count += 1
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    def finish(self) -> Optional[str]:
+        """Ставит ситуации в очередь на индексацию; None, если ситуаций нет и индекс остается прежним"""
+        self._file.close()
+        if self.count == 0:
+            self.abort()
+            return None
+        target = pending_path(self.source_id)
+        os.replace(self._path, target)
+        return target
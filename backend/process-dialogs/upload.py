@@ -0,0 +1,152 @@
+import binascii
+import io
+import json
+import re
+from typing import Any, Dict, Optional, Tuple, Union
+
+Buffer = Union[bytes, memoryview]
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_DISPOSITION_PARAM_RE = re.compile(rb'(name|filename)="([^"]*)"', re.IGNORECASE)
+# Параметры бинарной загрузки без JSON-обертки передаются в query string
+UPLOAD_FIELDS = ('fileName', 'systemPrompt', 'incremental', 'async', 'sourceId', 'googleSheetsUrl', 'action', 'jobId')
+BOOLEAN_FIELDS = ('incremental', 'async')
+
+
+class MemoryReader(io.RawIOBase):
+    """Файловый объект поверх memoryview: csv и openpyxl читают без копии буфера"""
+
+    def __init__(self, buffer: Buffer):
+        self._buffer = memoryview(buffer)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        size = min(len(target), len(self._buffer) - self._position)
+        if size <= 0:
+            return 0
+        target[:size] = self._buffer[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def open_buffer(buffer: Buffer) -> io.IOBase:
+    # BytesIO разделяет память с bytes, а срез memoryview пришлось бы копировать
+    if isinstance(buffer, bytes):
+        return io.BytesIO(buffer)
+    return io.BufferedReader(MemoryReader(buffer))
+
+
+def header(event: dict, name: str) -> str:
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+
+def is_json_request(event: dict) -> bool:
+    """Старый протокол: JSON с файлом в base64 (Content-Type не указан или application/json)"""
+    content_type = header(event, 'Content-Type').split(';')[0].strip().lower()
+    return content_type in ('', 'application/json', 'text/plain')
+
+
+def event_body_bytes(event: dict) -> bytes:
+    """Тело события в байтах: base64 декодируется сразу из строки, без ASCII-копии"""
+    raw_body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        try:
+            return binascii.a2b_base64(raw_body)
+        except (binascii.Error, ValueError) as e:
+            raise ValueError(f'Ошибка чтения файла: {str(e)}')
+    if isinstance(raw_body, bytes):
+        return raw_body
+    return raw_body.encode('utf-8')
+
+
+def read_binary_upload(event: dict) -> Tuple[Dict[str, Any], Optional[Buffer]]:
+    """Разбирает загрузку без JSON: multipart/form-data или сам файл в теле запроса
+
+    Возвращает параметры в том же виде, что и JSON-тело (fileName,
+    systemPrompt, incremental, ...), и содержимое файла. Файл из multipart —
+    memoryview на общий буфер тела, без копирования.
+    """
+    content_type = header(event, 'Content-Type')
+    data = event_body_bytes(event)
+
+    if content_type.lower().startswith('multipart/form-data'):
+        match = _BOUNDARY_RE.search(content_type)
+        if not match:
+            raise ValueError('Не указан boundary в multipart/form-data')
+        fields, file_part = parse_multipart(data, match.group(1).encode('latin-1'))
+    else:
+        params = event.get('queryStringParameters') or {}
+        fields = {name: params[name] for name in UPLOAD_FIELDS if params.get(name) is not None}
+        file_name = header(event, 'X-File-Name')
+        if file_name and 'fileName' not in fields:
+            fields['fileName'] = file_name
+        file_part = memoryview(data) if data else None
+
+    for name in BOOLEAN_FIELDS:
+        if isinstance(fields.get(name), str):
+            fields[name] = fields[name].lower() in ('1', 'true', 'yes')
+    return fields, file_part
+
+
+def parse_multipart(data: bytes, boundary: bytes) -> Tuple[Dict[str, Any], Optional[memoryview]]:
+    """Минимальный разбор multipart/form-data: текстовые поля и одна часть с файлом"""
+    delimiter = b'\r\n--' + boundary
+    view = memoryview(data)
+    fields: Dict[str, Any] = {}
+    file_part = None
+
+    # Первая граница может стоять в самом начале тела, без предшествующего CRLF
+    position = data.find(b'--' + boundary)
+    if position < 0:
+        raise ValueError('Некорректное тело multipart/form-data')
+    position += len(boundary) + 2
+
+    while not data.startswith(b'--', position):
+        position += 2  # CRLF после границы
+        headers_end = data.find(b'\r\n\r\n', position)
+        if headers_end < 0:
+            raise ValueError('Некорректное тело multipart/form-data')
+        part_end = data.find(delimiter, headers_end)
+        if part_end < 0:
+            raise ValueError('Некорректное тело multipart/form-data')
+
+        params = {}
+        for line in data[position:headers_end].split(b'\r\n'):
+            if line.lower().startswith(b'content-disposition:'):
+                params = {key.lower(): value for key, value in _DISPOSITION_PARAM_RE.findall(line)}
+        name = params.get(b'name', b'').decode('utf-8')
+        content = view[headers_end + 4:part_end]
+
+        if b'filename' in params:
+            file_part = content
+            fields.setdefault('fileName', params[b'filename'].decode('utf-8') or 'file.xlsx')
+        elif name == 'payload':
+            # Необязательная JSON-часть с параметрами вместо отдельных полей
+            fields.update(json.loads(bytes(content)))
+        elif name:
+            fields[name] = bytes(content).decode('utf-8')
+
+        position = part_end + len(delimiter)
+
+    return fields, file_part
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from result_cache import CACHE_DIR
+from situations import pending_path
+
+INDEX_DIR = os.path.join(CACHE_DIR, 'index')
+VECTOR_DIM = 256
+NGRAM = 3
+EMBED_BATCH = 20000
+IVF_MIN_VECTORS = 4096  # меньшие индексы просматриваются целиком
+IVF_TRAIN_SAMPLE = 20000
+IVF_TRAIN_ITERATIONS = 8
+IVF_NPROBE = int(os.environ.get('VECTOR_INDEX_NPROBE', '8'))
+SEARCH_BLOCK = 65536
+
+# Множители для смешивания кодов символов n-граммы (64-битное переполнение — часть хэша)
+_NGRAM_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+
+
+def char_ngram_hashes(texts: List[str], n: int = NGRAM) -> Tuple[np.ndarray, np.ndarray]:
+    """64-битные хэши всех символьных n-грамм текстов: (номера текстов, хэши)
+
+    Тексты склеиваются в один массив кодов символов, поэтому хэширование идет
+    операциями NumPy без цикла по n-граммам. Номера текстов возрастают.
+    """
+    codes = np.frombuffer('\0'.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    lengths = np.fromiter((len(text) + 1 for text in texts), dtype=np.int64, count=len(texts))
+    rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)[:len(codes)]
+    if len(codes) < n:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+
+    window = len(codes) - n + 1
+    mixed = np.zeros(window, dtype=np.uint64)
+    valid = np.ones(window, dtype=bool)
+    for offset in range(n):
+        part = codes[offset:offset + window]
+        mixed ^= part * _NGRAM_MULTIPLIERS[offset % len(_NGRAM_MULTIPLIERS)]
+        mixed = (mixed << np.uint64(13)) | (mixed >> np.uint64(51))
+        # n-грамма не должна захватывать разделитель между текстами
+        valid &= part != 0
+    mixed *= _NGRAM_MULTIPLIERS[0]
+    return rows[:window][valid], mixed[valid]
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Хэшированные символьные триграммы со знаком, нормированные по L2"""
+    vectors = np.zeros((len(texts), VECTOR_DIM), dtype=np.float32)
+    if not texts:
+        return vectors
+
+    padded = [' ' + ' '.join(text.lower().split()) + ' ' for text in texts]
+    rows, hashes = char_ngram_hashes(padded)
+    if len(hashes):
+        buckets = (hashes >> np.uint64(40)) % np.uint64(VECTOR_DIM)
+        signs = np.where((hashes >> np.uint64(20)) & np.uint64(1), 1.0, -1.0)
+        flat = rows * VECTOR_DIM + buckets.astype(np.int64)
+        vectors = np.bincount(flat, weights=signs, minlength=len(texts) * VECTOR_DIM)
+        vectors = vectors.reshape(len(texts), VECTOR_DIM).astype(np.float32)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def index_path(source_id: str) -> str:
+    return os.path.join(INDEX_DIR, hashlib.sha256(source_id.encode('utf-8')).hexdigest()[:32])
+
+
+class VectorIndexBuilder:
+    """Строит индекс похожих ситуаций, отложенных SituationStager
+
+    Векторы и тексты пишутся во временные файлы пачками по мере добавления
+    ситуаций, поэтому в памяти не копится вся таблица. finish() обучает
+    грубое IVF-разбиение, упорядочивает векторы по спискам и атомарно
+    заменяет индекс источника.
+    """
+
+    def __init__(self, source_id: str):
+        self.source_id = source_id
+        self.count = 0
+        self._batch: List[Tuple[str, str, str]] = []
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        self._workdir = tempfile.mkdtemp(prefix='build-', dir=INDEX_DIR)
+        self._vectors = open(os.path.join(self._workdir, 'vectors.tmp'), 'wb')
+        self._payload = open(os.path.join(self._workdir, 'payload.tmp'), 'wb')
+        self._payload_lengths: List[int] = []
+
+    def add_situation(self, client_message: str, operator_reply: str, dialog_id: str) -> None:
+        self._batch.append((client_message, operator_reply, dialog_id))
+        if len(self._batch) >= EMBED_BATCH:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._batch:
+            return
+        vectors = embed_texts([client_message for client_message, _, _ in self._batch])
+        self._vectors.write(vectors.astype(np.float16).tobytes())
+        for entry in self._batch:
+            data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+            self._payload.write(data)
+            self._payload_lengths.append(len(data))
+        self.count += len(self._batch)
+        self._batch = []
+
+    def abort(self) -> None:
+        self._vectors.close()
+        self._payload.close()
+        shutil.rmtree(self._workdir, ignore_errors=True)
+
+    def finish(self) -> Optional[str]:
+        """Дописывает индекс на диск; возвращает путь или None, если ситуаций нет"""
+        self._flush()
+        self._vectors.close()
+        self._payload.close()
+        if self.count == 0:
+            self.abort()
+            return None
+
+        try:
+            vectors = np.memmap(os.path.join(self._workdir, 'vectors.tmp'), dtype=np.float16,
+                                mode='r', shape=(self.count, VECTOR_DIM))
+            centroids = train_centroids(vectors)
+            lists = assign_lists(vectors, centroids)
+            order = np.argsort(lists, kind='stable')
+            offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(lists, minlength=len(centroids)), out=offsets[1:])
+
+            sorted_vectors = np.lib.format.open_memmap(
+                os.path.join(self._workdir, 'vectors.npy'), mode='w+', dtype=np.float16, shape=(self.count, VECTOR_DIM)
+            )
+            for start in range(0, self.count, SEARCH_BLOCK):
+                sorted_vectors[start:start + SEARCH_BLOCK] = vectors[order[start:start + SEARCH_BLOCK]]
+            sorted_vectors.flush()
+            del sorted_vectors, vectors
+
+            self._write_payload(order)
+            np.save(os.path.join(self._workdir, 'centroids.npy'), centroids)
+            np.save(os.path.join(self._workdir, 'offsets.npy'), offsets)
+            os.remove(os.path.join(self._workdir, 'vectors.tmp'))
+            os.remove(os.path.join(self._workdir, 'payload.tmp'))
+
+            return replace_index(self._workdir, index_path(self.source_id))
+        except Exception:
+            self.abort()
+            raise
+
+    def _write_payload(self, order: np.ndarray) -> None:
+        lengths = np.array(self._payload_lengths, dtype=np.int64)
+        starts = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+
+        raw = np.memmap(os.path.join(self._workdir, 'payload.tmp'), dtype=np.uint8, mode='r')
+        payload_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        with open(os.path.join(self._workdir, 'payload.bin'), 'wb') as payload:
+            for position, entry in enumerate(order):
+                start = starts[entry]
+                payload.write(raw[start:start + lengths[entry]].tobytes())
+                payload_offsets[position + 1] = payload_offsets[position] + lengths[entry]
+        del raw
+        np.save(os.path.join(self._workdir, 'payload_offsets.npy'), payload_offsets)
+
+
+def train_centroids(vectors: np.ndarray) -> np.ndarray:
+    """Сферический k-means на выборке: около sqrt(N) списков"""
+    count = len(vectors)
+    if count < IVF_MIN_VECTORS:
+        return np.zeros((1, VECTOR_DIM), dtype=np.float32)
+
+    list_count = min(1024, int(np.sqrt(count)))
+    rng = np.random.default_rng(0)
+    sample_size = min(count, max(IVF_TRAIN_SAMPLE, list_count * 8))
+    sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, list_count, replace=False)].copy()
+
+    for _ in range(IVF_TRAIN_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Пустой список получает случайную точку выборки
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        norms[empty] = 1.0
+        centroids = sums / norms
+
+    return centroids.astype(np.float32)
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    lists = np.zeros(len(vectors), dtype=np.int64)
+    if len(centroids) == 1:
+        return lists
+    for start in range(0, len(vectors), SEARCH_BLOCK):
+        block = np.asarray(vectors[start:start + SEARCH_BLOCK], dtype=np.float32)
+        lists[start:start + SEARCH_BLOCK] = np.argmax(block @ centroids.T, axis=1)
+    return lists
+
+
+def build_pending_index(source_id: str) -> bool:
+    """Собирает индекс из отложенных при анализе ситуаций; False, если в очереди пусто
+
+    Файл очереди сначала забирается переименованием, поэтому новая загрузка
+    того же источника во время сборки кладет свою очередь, а не теряется.
+    """
+    pending = pending_path(source_id)
+    claimed = f'{pending}.building-{os.getpid()}-{time.time_ns()}'
+    try:
+        os.replace(pending, claimed)
+    except FileNotFoundError:
+        return False
+
+    builder = VectorIndexBuilder(source_id)
+    try:
+        with open(claimed, encoding='utf-8') as situations:
+            for line in situations:
+                builder.add_situation(*json.loads(line))
+    except Exception:
+        builder.abort()
+        raise
+    finally:
+        os.remove(claimed)
+    builder.finish()
+    return True
+
+
+def replace_index(workdir: str, target: str) -> str:
+    """Подменяет каталог индекса: новая версия появляется целиком или не появляется"""
+    previous = None
+    if os.path.exists(target):
+        previous = f'{target}.old-{os.getpid()}-{time.time_ns()}'
+        os.replace(target, previous)
+    os.replace(workdir, target)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+    return target
+
+
+class VectorIndex:
+    """Индекс, открытый через memory map; файлы читаются лениво по страницам"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        self.centroids = np.load(os.path.join(path, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.payload_offsets = np.load(os.path.join(path, 'payload_offsets.npy'), mmap_mode='r')
+        self.payload = np.memmap(os.path.join(path, 'payload.bin'), dtype=np.uint8, mode='r')
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def search(self, query: str, top_k: int = 5, nprobe: int = IVF_NPROBE) -> List[Dict[str, Any]]:
+        """Ищет top_k самых похожих сообщений клиентов в nprobe ближайших списках"""
+        query_vector = embed_texts([query])[0]
+        if not query_vector.any():
+            return []
+
+        probe = np.argsort(-(self.centroids @ query_vector))[:nprobe]
+        candidates = []
+        scores = []
+        for list_id in probe:
+            start, end = int(self.offsets[list_id]), int(self.offsets[list_id + 1])
+            for block_start in range(start, end, SEARCH_BLOCK):
+                block_end = min(end, block_start + SEARCH_BLOCK)
+                block = np.asarray(self.vectors[block_start:block_end], dtype=np.float32)
+                scores.append(block @ query_vector)
+                candidates.append(np.arange(block_start, block_end))
+
+        if not scores:
+            return []
+        scores = np.concatenate(scores)
+        candidates = np.concatenate(candidates)
+        top = np.argpartition(-scores, min(top_k, len(scores)) - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for position in top:
+            score = round(float(scores[position]), 4)
+            # Ни одной общей триграммы с запросом — не похожая ситуация; дальше только хуже
+            if score <= 0:
+                break
+            entry = int(candidates[position])
+            start, end = int(self.payload_offsets[entry]), int(self.payload_offsets[entry + 1])
+            client_message, operator_reply, dialog_id = json.loads(self.payload[start:end].tobytes())
+            results.append({
+                'score': score,
+                'clientMessage': client_message,
+                'operatorReply': operator_reply,
+                'dialogId': dialog_id,
+            })
+        return results
+
+
+_OPEN_INDEXES: Dict[str, Tuple[Tuple[int, int], VectorIndex]] = {}
+
+
+def open_index(source_id: str) -> Optional[VectorIndex]:
+    """Открывает индекс источника; между теплыми вызовами открытый индекс переиспользуется"""
+    path = index_path(source_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # Пересобранный индекс — это новый каталог, поэтому меняется inode
+    version = (stat.st_ino, stat.st_mtime_ns)
+    cached = _OPEN_INDEXES.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    index = VectorIndex(path)
+    _OPEN_INDEXES[path] = (version, index)
+    return index
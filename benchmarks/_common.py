@@ -0,0 +1,54 @@
+"""Общие помощники для бенчмарков backend-функций.
+
+Функции лежат в каталогах с дефисами (process-dialogs, deepseek-chat), поэтому
+их модули загружаются по пути к файлу, а не обычным import.
+"""
+
+import importlib.util
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from dialog_generator import make_rows  # noqa: F401 — бенчмарки импортируют make_rows отсюда
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+
+FUNCTIONS = {
+    'process-dialogs': BACKEND / 'process-dialogs' / 'index.py',
+    'deepseek-chat': BACKEND / 'deepseek-chat' / 'index.py',
+    'chatgpt-polza': BACKEND / 'extensions' / 'chatgpt-polza' / 'chatgpt' / 'index.py',
+}
+
+
+def check_shared_modules(*modules: str) -> None:
+    """Падает, если копии общих модулей в функциях разошлись (scripts/check_shared_modules.py)"""
+    subprocess.run([sys.executable, str(ROOT / 'scripts' / 'check_shared_modules.py'), *modules], check=True)
+
+
+def load_function(name: str):
+    """Загружает index.py функции как отдельный модуль"""
+    path = FUNCTIONS[name]
+    module_name = 'bench_' + name.replace('-', '_')
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    function_dir = str(path.parent)
+    if function_dir not in sys.path:
+        sys.path.insert(0, function_dir)
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(func: Callable[[], Any], repeat: int = 1) -> float:
+    """Лучшее время выполнения func за repeat запусков, в секундах"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
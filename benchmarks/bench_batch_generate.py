@@ -0,0 +1,75 @@
+"""batch_generate chatgpt-polza: пропускная способность в зависимости от concurrency.
+
+Polza подменяется локальной заглушкой с задержкой --latency и лимитом
+--upstream-limit одновременных запросов (сверх него — 429 с Retry-After,
+как у провайдера под нагрузкой). Сначала --items запросов идут по одному
+через generate (как ночная задача сейчас), затем одним batch_generate с
+разными concurrency. Печатается время, запросы в секунду, число ответов 429
+от заглушки и ошибки по элементам.
+
+Запуск: python benchmarks/bench_batch_generate.py [--items 64] [--latency 0.2] [--upstream-limit 8]
+"""
+
+import argparse
+import json
+import os
+import time
+
+from _common import load_function
+from fake_servers import FakeDeepSeek
+
+
+def make_items(count: int):
+    return [{
+        'messages': [{'role': 'user', 'content': f'Сценарий {number}: клиент недоволен задержкой заказа'}],
+        'model': 'openai/gpt-4o-mini',
+        'max_tokens': 200,
+    } for number in range(count)]
+
+
+def call(polza, action: str, body: dict) -> dict:
+    response = polza.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'action': action},
+        'body': json.dumps(body, ensure_ascii=False),
+    }, None)
+    assert response['statusCode'] == 200, response['body']
+    return json.loads(response['body'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--upstream-limit', type=int, default=8)
+    parser.add_argument('--concurrency', default='1,2,4,8,16')
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    with FakeDeepSeek(latency=args.latency, jitter=args.latency / 4, max_concurrent=args.upstream_limit) as upstream:
+        os.environ.update({'POLZA_BASE_URL': upstream.base_url, 'POLZA_AI_API_KEY': 'bench'})
+        polza = load_function('chatgpt-polza')
+        print(f'{"mode":>18} {"time, s":>8} {"req/s":>7} {"429":>5} {"failed":>7}  usage')
+
+        def report(mode, elapsed, failed, usage, limited_before):
+            print(f'{mode:>18} {elapsed:>8.2f} {args.items / elapsed:>7.1f} '
+                  f'{upstream.rate_limited - limited_before:>5} {failed:>7}  {usage["total_tokens"]}')
+
+        limited_before = upstream.rate_limited
+        started = time.perf_counter()
+        usage = {'total_tokens': 0}
+        for item in items:
+            usage['total_tokens'] += call(polza, 'generate', item)['usage']['total_tokens']
+        report('generate x1', time.perf_counter() - started, 0, usage, limited_before)
+
+        for concurrency in map(int, args.concurrency.split(',')):
+            limited_before = upstream.rate_limited
+            started = time.perf_counter()
+            result = call(polza, 'batch_generate', {'items': items, 'concurrency': concurrency})
+            assert [r['index'] for r in result['results']] == list(range(args.items))
+            report(f'batch c={result["concurrency"]}', time.perf_counter() - started, result['failed'],
+                   result['usage'], limited_before)
+
+
+if __name__ == '__main__':
+    main()
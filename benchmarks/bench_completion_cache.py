@@ -0,0 +1,117 @@
+"""Кэш ответов deepseek-chat и chatgpt-polza на повторяющейся нагрузке.
+
+Нагрузка — поток запросов generate: реплики открытия сценариев и оценки с
+низкой temperature повторяются (распределение Ципфа по --distinct вариантам),
+часть запросов — живой диалог с высокой temperature, который кэш пропускает.
+Оба API подменяются локальной заглушкой с задержкой --latency. Для каждой
+функции печатаются доля попаданий, медианы задержки попадания и промаха и
+сэкономленное время; затем проверяется, что записи на диске переживают
+перезапуск инстанса.
+
+Запуск: python benchmarks/bench_completion_cache.py [--requests 300] [--distinct 30] [--latency 0.2]
+"""
+
+import argparse
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from _common import FUNCTIONS, load_function
+from fake_servers import FakeDeepSeek
+
+SCENARIOS = ['Микроскоп не фокусируется', 'Телескоп пришел с царапиной', 'Подсветка не работает',
+             'Хочу вернуть бинокль', 'Не хватает окуляра в комплекте', 'Заказ задерживается']
+
+
+def make_workload(count: int, distinct: int, live_ratio: float, seed: int = 42):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    for number in range(count):
+        if rng.random() < live_ratio:
+            # Живой диалог: уникальная история и высокая температура
+            yield {'messages': [{'role': 'user', 'content': f'Реплика стажера {number}'}], 'temperature': 0.8}
+            continue
+        variant = rng.choices(range(distinct), weights)[0]
+        scenario = SCENARIOS[variant % len(SCENARIOS)]
+        yield {
+            'messages': [
+                {'role': 'system', 'content': f'Ты клиент магазина оптики. Сценарий: {scenario}. Вариант {variant}.'},
+                {'role': 'user', 'content': 'Начни диалог.'},
+            ],
+            'temperature': 0.2,
+            'max_tokens': 300,
+        }
+
+
+def event(function: str, body: dict) -> dict:
+    body = {**body, 'cache': True}
+    if function == 'chatgpt-polza':
+        body['model'] = 'openai/gpt-4o-mini'
+        return {'httpMethod': 'POST', 'queryStringParameters': {'action': 'generate'}, 'body': json.dumps(body)}
+    return {'httpMethod': 'POST', 'body': json.dumps(body)}
+
+
+def run(function: str, module, workload) -> None:
+    latencies = {'hit': [], 'miss': [], None: []}
+    for body in workload:
+        started = time.perf_counter()
+        response = module.handler(event(function, body), None)
+        elapsed = time.perf_counter() - started
+        assert response['statusCode'] == 200, response['body']
+        latencies[json.loads(response['body']).get('cache')].append(elapsed)
+
+    stats = module.COMPLETION_CACHE.stats()
+
+    def median_ms(values):
+        return f'{statistics.median(values) * 1000:.2f}' if values else '-'
+
+    print(f'{function:>14} {stats["hitRatio"]:>10.1%} {len(latencies[None]):>9} {median_ms(latencies["hit"]):>8} '
+          f'{median_ms(latencies["miss"]):>9} {stats["savedMs"] / 1000:>9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--distinct', type=int, default=30)
+    parser.add_argument('--live-ratio', type=float, default=0.3, help='доля запросов с высокой temperature')
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir, FakeDeepSeek(latency=args.latency) as upstream:
+        # Настройки читаются при импорте модулей
+        os.environ.update({
+            'DEEPSEEK_URL': upstream.url,
+            'DEEPSEEK_API_KEY': 'bench',
+            'POLZA_BASE_URL': upstream.base_url,
+            'POLZA_AI_API_KEY': 'bench',
+        })
+        print(f'{"function":>14} {"hit ratio":>10} {"bypassed":>9} {"hit, ms":>8} {"miss, ms":>9} {"saved, s":>9}')
+        for function in ('deepseek-chat', 'chatgpt-polza'):
+            # У функций общий модуль completion_cache, но свои файлы кэша
+            os.environ['COMPLETION_CACHE_DIR'] = os.path.join(cache_dir, function)
+            sys.modules.pop('completion_cache', None)
+            sys.path.insert(0, str(FUNCTIONS[function].parent))
+            module = load_function(function)
+            run(function, module, make_workload(args.requests, args.distinct, args.live_ratio))
+
+            # Новый инстанс с тем же каталогом: промахов по уже виденным запросам быть не должно
+            restarted = importlib.import_module('completion_cache').CompletionCache()
+            cacheable = [body for body in make_workload(args.requests, args.distinct, args.live_ratio)
+                         if body['temperature'] <= restarted.max_temperature]
+            hits = sum(1 for body in cacheable if restarted.get(restarted_key(module, function, body)) is not None)
+            print(f'{"":>14} после перезапуска с диска: {hits}/{len(cacheable)} попаданий')
+
+
+def restarted_key(module, function: str, body: dict) -> str:
+    model = 'openai/gpt-4o-mini' if function == 'chatgpt-polza' else 'deepseek-chat'
+    max_tokens = body.get('max_tokens') if function == 'chatgpt-polza' else body.get('max_tokens', 500)
+    return module.completion_key(model, body['messages'], body['temperature'], max_tokens)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Память и скорость обхода: список словарей против DialogTable.
+
+retained — сколько держит готовая структура, peak — пик при разборе CSV.
+
+Запуск: python benchmarks/bench_dialog_memory.py [--sizes 100000 1000000]
+"""
+
+import argparse
+import gc
+import tracemalloc
+from io import BytesIO
+
+import pandas as pd
+
+from _common import load_function, make_rows, timed
+
+
+def measure(build):
+    """Пиковая и удерживаемая память (МБ) при построении структуры"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained / 2 ** 20, peak / 2 ** 20
+
+
+def parse_to_dicts(csv_bytes: bytes) -> list:
+    """Прежнее представление: список словарей с сообщениями"""
+    df = pd.read_csv(BytesIO(csv_bytes), dtype=str)
+    rows = zip(df['phrase_source'].tolist(), df['phrase_content'].tolist(), df['dialog_id'].tolist())
+    return list(load_function('process-dialogs').group_dialog_rows(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    process_dialogs = load_function('process-dialogs')
+
+    print(f'{"messages":>10} {"layout":>12} {"retained, MB":>13} {"peak, MB":>9} '
+          f'{"extract, s":>11} {"pack, s":>8}')
+    for size in args.sizes:
+        csv_bytes = pd.DataFrame(make_rows(size)).to_csv(index=False).encode('utf-8')
+        # Обе структуры строятся из одного CSV, DataFrame после разбора освобождается
+        layouts = [
+            ('list[dict]', lambda: parse_to_dicts(csv_bytes)),
+            ('DialogTable', lambda: process_dialogs.parse_excel_bytes(csv_bytes, 'dialogs.csv')),
+        ]
+        expected = None
+        for name, build in layouts:
+            dialogs, retained, peak = measure(build)
+            result = process_dialogs.extract_knowledge(dialogs, workers=1)
+            if expected is None:
+                expected = result
+            assert result == expected, 'результат разбора зависит от представления диалогов'
+
+            extract = timed(lambda: process_dialogs.extract_knowledge(dialogs, workers=1))
+            pack = timed(lambda: sum(1 for _ in process_dialogs.pack_dialog_chunks(
+                dialogs, process_dialogs.DEEPSEEK_CHUNK_TOKENS)))
+            print(f'{size:>10} {name:>12} {retained:>13.1f} {peak:>9.1f} {extract:>11.2f} {pack:>8.2f}')
+            del dialogs
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Пропускная способность extract_knowledge (сообщений в секунду) до и после
+перехода на предкомпилированный поиск ключевых слов.
+
+Запуск: python benchmarks/bench_extract_knowledge.py [--sizes 10000 100000]
+"""
+
+import argparse
+import re
+
+from _common import load_function, make_rows, timed
+
+
+def extract_knowledge_legacy(dialogs):
+    """Прежняя реализация: any(... in sentence.lower()) и re.findall на каждое сообщение"""
+    products = set()
+    problems = set()
+    problem_keywords = [
+        'не работает', 'не видим', 'не получается', 'не хватает', 'не могу',
+        'сломан', 'сломал', 'сломался', 'разбит', 'разбился',
+        'мутное', 'пятно', 'царапина', 'трещина',
+        'проблема', 'дефект', 'брак',
+        'как будто', 'почему', 'что делать'
+    ]
+    product_keywords = ['микроскоп', 'телескоп', 'бинокль', 'прицел', 'лупа', 'окуляр', 'объектив']
+    for dialog in dialogs:
+        for msg in dialog['messages']:
+            content = msg['content']
+            content_lower = content.lower()
+            if msg['source'] == 'Клиент':
+                sentences = content.replace('?', '.').split('.')
+                for sentence in sentences:
+                    sentence = sentence.strip()
+                    if any(word in sentence.lower() for word in problem_keywords):
+                        if len(sentence) > 200:
+                            sentence = sentence[:200] + '...'
+                        if len(sentence) > 10:
+                            problems.add(sentence)
+            if any(keyword in content_lower for keyword in product_keywords):
+                product_patterns = [
+                    r'[А-Яа-яA-Za-z]+\s+\d+[хx]?\d*',
+                    r'[А-Яа-я]+\s+[А-Яа-я]+\s+\d+',
+                    r'[А-Яа-я]+\s+[рРpP]\d+',
+                    r'детский\s+[А-Яа-я]+',
+                    r'[А-Яа-я]+-\d+',
+                ]
+                for pattern in product_patterns:
+                    for match in re.findall(pattern, content, re.IGNORECASE):
+                        cleaned = match.strip()
+                        if len(cleaned) > 4 and not cleaned.lower().startswith(('как ', 'что ', 'где ')):
+                            products.add(cleaned)
+    return {'products': sorted(products), 'problems': sorted(problems)}
+
+
+EDGE_CASES = [
+    'ПОЧЕМУ МИКРОСКОП НЕ РАБОТАЕТ? А телескоп Атом 800х цел.',
+    'İstanbul: бинокль сломался... почему так?',
+    'Не работает' + ' очень' * 60 + ' подсветка.',
+    'Трещина.пятно.брак?как будто мутное стекло в окуляре 25',
+    'разбитый объектив 4х, Микромед Р1 и детский микроскоп',
+]
+
+
+def make_dialogs(process_dialogs, size):
+    rows = [(r['phrase_source'], r['phrase_content'], r['dialog_id']) for r in make_rows(size)]
+    dialogs = list(process_dialogs.group_dialog_rows(rows))
+    dialogs.append({'dialog_id': 'edge', 'messages': [
+        {'source': 'Клиент', 'content': text} for text in EDGE_CASES
+    ]})
+    return dialogs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    process_dialogs = load_function('process-dialogs')
+
+    print(f'{"messages":>10} {"before, msg/s":>14} {"after, msg/s":>14} {"speedup":>8}')
+    for size in args.sizes:
+        dialogs = make_dialogs(process_dialogs, size)
+        messages = sum(len(d['messages']) for d in dialogs)
+        assert process_dialogs.extract_knowledge(dialogs) == extract_knowledge_legacy(dialogs), \
+            'результат extract_knowledge изменился'
+
+        before = timed(lambda: extract_knowledge_legacy(dialogs), repeat=3)
+        after = timed(lambda: process_dialogs.extract_knowledge(dialogs), repeat=3)
+        print(f'{messages:>10} {messages / before:>14,.0f} {messages / after:>14,.0f} {before / after:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
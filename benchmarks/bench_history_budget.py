@@ -0,0 +1,79 @@
+"""Размер промпта по ходу длинной сессии тренажера: вся история против бюджета токенов.
+
+Сессия из --turns ходов прогоняется через handle_generate chatgpt-polza дважды:
+с history_budget=0 (как раньше — вся история каждый ход) и с бюджетом. Polza
+подменяется локальной заглушкой, prompt_tokens которой растет с длиной
+промпта. Печатается размер промпта по ходам и число вызовов суммаризации.
+
+Запуск: python benchmarks/bench_history_budget.py [--turns 40] [--budget 1500]
+"""
+
+import argparse
+import json
+import os
+
+from _common import load_function
+from fake_servers import FakeDeepSeek
+
+SYSTEM_PROMPT = ('Ты — разозлённый клиент интернет-магазина оптики. Ты заказал микроскоп 5 дней назад, '
+                 'но он до сих пор не пришёл. Веди себя агрессивно в начале, но постепенно успокаивайся, '
+                 'если сотрудник поддержки проявляет эмпатию и предлагает конкретные решения.')
+AGENT_REPLIES = [
+    'Понимаю ваше недовольство, давайте я проверю статус заказа. Подскажите номер, пожалуйста.',
+    'Спасибо. Вижу, что посылка задержалась на сортировочном центре в Подольске из-за загрузки.',
+    'Приношу извинения за задержку. Могу оформить бесплатную доставку курьером на завтра.',
+    'Если удобнее, можем вернуть деньги полностью, это займет до трех рабочих дней.',
+    'Дополнительно начислю промокод на 10% на следующий заказ в качестве компенсации.',
+]
+
+
+def run_session(polza, turns: int, budget: int, session_id: str):
+    history = [{'role': 'user', 'content': 'Где мой заказ?! Уже пять дней жду, это издевательство!'}]
+    rows = []
+    for turn in range(turns):
+        history.append({'role': 'assistant', 'content': f'{AGENT_REPLIES[turn % len(AGENT_REPLIES)]} (ход {turn + 1})'})
+        body = {
+            'messages': [{'role': 'system', 'content': SYSTEM_PROMPT}, *history],
+            'model': 'openai/gpt-4o-mini',
+            'temperature': 0.8,
+            'max_tokens': 200,
+            'session_id': session_id,
+            'history_budget': budget,
+        }
+        response = polza.handler({
+            'httpMethod': 'POST',
+            'queryStringParameters': {'action': 'generate'},
+            'body': json.dumps(body, ensure_ascii=False),
+        }, None)
+        assert response['statusCode'] == 200, response['body']
+        result = json.loads(response['body'])
+        history.append({'role': 'user', 'content': result['content']})
+        rows.append((result['usage']['prompt_tokens'], (result.get('history') or {}).get('summary', 'none')))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=40)
+    parser.add_argument('--budget', type=int, default=1500)
+    args = parser.parse_args()
+
+    with FakeDeepSeek(latency=0.0) as upstream:
+        os.environ.update({'POLZA_BASE_URL': upstream.base_url, 'POLZA_AI_API_KEY': 'bench'})
+        polza = load_function('chatgpt-polza')
+
+        full = run_session(polza, args.turns, 0, 'full')
+        requests_before = upstream.requests
+        budgeted = run_session(polza, args.turns, args.budget, 'budgeted')
+        summaries = upstream.requests - requests_before - args.turns
+
+    print(f'{"turn":>5} {"full history":>13} {"budget " + str(args.budget):>12}  summary')
+    for turn, ((full_tokens, _), (tokens, summary)) in enumerate(zip(full, budgeted), 1):
+        if turn % 5 == 0 or summary == 'updated':
+            print(f'{turn:>5} {full_tokens:>13} {tokens:>12}  {summary}')
+    print(f'всего prompt_tokens: {sum(t for t, _ in full)} -> {sum(t for t, _ in budgeted)}, '
+          f'вызовов суммаризации: {summaries}')
+
+
+if __name__ == '__main__':
+    main()
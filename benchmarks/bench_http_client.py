@@ -0,0 +1,129 @@
+"""Задержка вызова API: новый requests.post на каждый вызов против общей сессии http_client.
+
+Сервер — локальная TLS-заглушка с самоподписанным сертификатом (нужен openssl).
+--rtt имитирует сеть: новое соединение стоит лишний RTT до рукопожатия, каждый
+запрос — еще один RTT. Сервер считает открытые соединения, чтобы было видно
+переиспользование пула. Заодно проверяется, что код копий http_client.py во
+всех функциях совпадает.
+
+Запуск: python benchmarks/bench_http_client.py [--calls 50] [--rtt 0.02] [--threads 4]
+"""
+
+import argparse
+import json
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from _common import FUNCTIONS, check_shared_modules
+
+
+class TLSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, context: ssl.SSLContext, rtt: float):
+        self.context = context
+        self.rtt = rtt
+        self.connections = 0
+        self._lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), Handler)
+
+    def finish_request(self, request, client_address):
+        # Рукопожатие в потоке соединения, а не в accept: иначе соединения шли бы по очереди
+        with self._lock:
+            self.connections += 1
+        time.sleep(self.rtt)
+        try:
+            request = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(request, client_address)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят разными write: без TCP_NODELAY keep-alive ловит задержку ACK в 40 мс
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.rtt)
+        data = json.dumps({'choices': [{'message': {'content': 'OK'}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_certificate(directory: Path):
+    cert, key = directory / 'cert.pem', directory / 'key.pem'
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+         '-keyout', str(key), '-out', str(cert)],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def run(call, calls: int, threads: int) -> list:
+    def timed_call(_):
+        started = time.perf_counter()
+        response = call()
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(timed_call, range(calls)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--rtt', type=float, default=0.02, help='имитация сетевой задержки, с')
+    parser.add_argument('--threads', type=int, default=1, help='одновременных вызовов')
+    args = parser.parse_args()
+
+    check_shared_modules('http_client.py')
+    sys.path.insert(0, str(FUNCTIONS['deepseek-chat'].parent))
+    import http_client
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(Path(directory))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server = TLSServer(context, args.rtt)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'https://127.0.0.1:{server.server_address[1]}/chat/completions'
+        payload = {'model': 'deepseek-chat', 'messages': [{'role': 'user', 'content': 'ping'}]}
+
+        modes = {
+            'requests.post': lambda: requests.post(url, json=payload, timeout=30, verify=str(cert)),
+            'http_client': lambda: http_client.request('POST', url, read_timeout=30, json=payload, verify=str(cert)),
+        }
+        print(f'rtt {args.rtt * 1000:.0f} ms, {args.calls} calls, {args.threads} threads')
+        print(f'{"mode":>14} {"p50, ms":>8} {"p95, ms":>8} {"mean, ms":>9} {"connections":>12}')
+        for name, call in modes.items():
+            connections = server.connections
+            latencies = sorted(run(call, args.calls, args.threads))
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f'{name:>14} {statistics.median(latencies) * 1000:>8.1f} {p95 * 1000:>8.1f} '
+                  f'{statistics.mean(latencies) * 1000:>9.1f} {server.connections - connections:>12}')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
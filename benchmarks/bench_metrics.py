@@ -0,0 +1,127 @@
+"""Инструментирование backend-функций: накладные расходы и выдача ?action=metrics.
+
+1. Проверяется, что код копий metrics.py и http_client.py во всех функциях совпадает.
+2. Накладные расходы на запрос: begin, --laps отметок фаз, tokens и end
+   (запись в гистограммы), с JSON-логом и без него — в микросекундах.
+3. Каждая функция в отдельном процессе (модули metrics у функций общие по
+   имени) обрабатывает --requests запросов против локальных заглушек, затем
+   печатаются квантили фаз из гистограмм и начало выдачи GET ?action=metrics.
+
+Запуск: python benchmarks/bench_metrics.py [--iterations 200000] [--requests 50]
+"""
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from _common import FUNCTIONS, check_shared_modules, load_function, make_rows
+from dialog_generator import to_csv_bytes
+from fake_servers import FakeDeepSeek
+
+SHARED_MODULES = ('metrics.py', 'http_client.py')
+
+
+def overhead(iterations: int, laps: int):
+    sys.path.insert(0, str(FUNCTIONS['deepseek-chat'].parent))
+    import metrics
+
+    phases = ['body_parse', 'prepare', 'upstream', 'history', 'lexical', 'judge'][:laps]
+
+    def run():
+        started = time.perf_counter()
+        for _ in range(iterations):
+            timer = metrics.METRICS.begin('generate')
+            for phase in phases:
+                timer.lap(phase)
+            metrics.METRICS.tokens(120, 40, 0.5)
+            metrics.METRICS.end(timer, 200)
+        return (time.perf_counter() - started) / iterations * 1e6
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    empty = (time.perf_counter() - started) / iterations * 1e6
+
+    metrics.METRICS_LOG = False
+    without_log = run() - empty
+    metrics.METRICS_LOG = True
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        with_log = run() - empty
+    print(f'накладные расходы на запрос ({laps} фаз + токены): {without_log:.2f} мкс без лога, '
+          f'{with_log:.2f} мкс с JSON-логом')
+
+
+def exercise(name: str, requests_count: int):
+    """Запросы к одной функции; печатает квантили фаз и начало выдачи metrics"""
+    with tempfile.TemporaryDirectory() as directory, FakeDeepSeek(latency=0.02, jitter=0.01) as upstream:
+        os.environ.update({
+            'PROCESS_DIALOGS_CACHE_DIR': directory,
+            'DEEPSEEK_URL': upstream.url,
+            'DEEPSEEK_API_KEY': 'bench',
+            'POLZA_BASE_URL': upstream.base_url,
+            'POLZA_AI_API_KEY': 'bench',
+            'METRICS_LOG': '0',
+            'METRICS_TOKEN': 'bench',
+            'VECTOR_INDEX_ENABLED': '0',
+        })
+        function = load_function(name)
+
+        for number in range(requests_count):
+            if name == 'process-dialogs':
+                csv_bytes = to_csv_bytes(make_rows(200, seed=number))
+                body = {'file': base64.b64encode(csv_bytes).decode(), 'fileName': f'dialogs-{number}.csv'}
+            else:
+                body = {'messages': [{'role': 'user', 'content': f'Где мой заказ номер {number}?'}]}
+            event = {'httpMethod': 'POST', 'body': json.dumps(body, ensure_ascii=False)}
+            if name == 'chatgpt-polza':
+                event['queryStringParameters'] = {'action': 'generate'}
+            response = function.handler(event, None)
+            assert response['statusCode'] == 200, response['body']
+
+        from metrics import METRICS
+        print(f'\n{name}: {requests_count} запросов')
+        print(f'{"гистограмма":>15} {"метки":<40} {"n":>5} {"p50, мс":>8} {"p95, мс":>8} {"p99, мс":>8}')
+        for (metric, labels), (count, p50, p95, p99) in sorted(METRICS.snapshot()['histograms'].items()):
+            scale = 1 if metric == 'tokens_per_second' else 1000
+            label_text = ','.join(f'{key}={value}' for key, value in labels)
+            print(f'{metric:>15} {label_text:<40} {count:>5} {p50 * scale:>8.2f} {p95 * scale:>8.2f} {p99 * scale:>8.2f}')
+
+        response = function.handler({'httpMethod': 'GET', 'queryStringParameters': {'action': 'metrics'}}, None)
+        assert response['statusCode'] == 403, 'метрики отданы без токена'
+        response = function.handler(
+            {'httpMethod': 'GET', 'queryStringParameters': {'action': 'metrics', 'token': 'bench'}}, None)
+        assert response['statusCode'] == 200, response['body']
+        lines = response['body'].splitlines()
+        print(f'GET ?action=metrics&token=...: {response["headers"]["Content-Type"]}, {len(lines)} строк, например:')
+        for line in [line for line in lines if 'tokens_total' in line or 'le="0.05"' in line][:6]:
+            print(f'  {line}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--laps', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--function', choices=list(FUNCTIONS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.function:
+        exercise(args.function, args.requests)
+        return
+
+    check_shared_modules(*SHARED_MODULES)
+    overhead(args.iterations, args.laps)
+    for name in FUNCTIONS:
+        subprocess.run([sys.executable, str(Path(__file__)), '--function', name, '--requests', str(args.requests)],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Действие models chatgpt-polza: живой запрос каталога против кэша.
+
+Polza подменяется локальной заглушкой с задержкой --latency. Меряется:
+  cold     — первый вызов без снимка на диске (ждет провайдера);
+  snapshot — первый вызов нового инстанса со снимком на диске;
+  warm     — вызовы при свежем кэше;
+  stale    — --concurrency одновременных вызовов после истечения TTL: все
+             получают старый список сразу, к провайдеру уходит один запрос.
+
+Запуск: python benchmarks/bench_models_cache.py [--latency 0.3] [--calls 1000] [--concurrency 20]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import load_function
+from fake_servers import FakeDeepSeek
+
+EVENT = {'httpMethod': 'GET', 'queryStringParameters': {'action': 'models'}}
+
+
+def call(polza) -> tuple:
+    started = time.perf_counter()
+    response = polza.handler(EVENT, None)
+    elapsed = time.perf_counter() - started
+    assert response['statusCode'] == 200, response['body']
+    return elapsed, json.loads(response['body'])['cache']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, FakeDeepSeek(latency=args.latency) as upstream:
+        os.environ.update({
+            'POLZA_BASE_URL': upstream.base_url,
+            'POLZA_AI_API_KEY': 'bench',
+            'MODELS_SNAPSHOT_PATH': os.path.join(directory, 'models.json'),
+        })
+        polza = load_function('chatgpt-polza')
+        print(f'{"case":>9} {"calls":>6} {"median, ms":>11} {"max, ms":>8} {"upstream":>9}  cache')
+
+        def report(case, results, upstream_before):
+            latencies = [elapsed for elapsed, _ in results]
+            statuses = sorted({status for _, status in results})
+            print(f'{case:>9} {len(results):>6} {statistics.median(latencies) * 1000:>11.3f} '
+                  f'{max(latencies) * 1000:>8.3f} {upstream.requests - upstream_before:>9}  {", ".join(statuses)}')
+
+        before = upstream.requests
+        report('cold', [call(polza)], before)
+
+        # Новый инстанс: каталог в памяти пуст, но снимок на диске уже есть
+        polza.MODEL_CATALOG = polza.ModelCatalog(polza.fetch_openai_models)
+        before = upstream.requests
+        report('snapshot', [call(polza)], before)
+
+        before = upstream.requests
+        report('warm', [call(polza) for _ in range(args.calls)], before)
+
+        # TTL истек: все получают старый список, обновление одно и в фоне
+        polza.MODEL_CATALOG.ttl = 0
+        before = upstream.requests
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda _: call(polza), range(args.concurrency)))
+        time.sleep(args.latency * 2)
+        report('stale', results, before)
+
+
+if __name__ == '__main__':
+    main()
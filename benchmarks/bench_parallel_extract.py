@@ -0,0 +1,39 @@
+"""Масштабирование fallback-разбора extract_knowledge по числу процессов.
+
+Запуск: python benchmarks/bench_parallel_extract.py [--messages 1000000] [--workers 1 2 4 8]
+"""
+
+import argparse
+import os
+
+from _common import load_function, make_rows, timed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    process_dialogs = load_function('process-dialogs')
+    from knowledge import EXTRACT_SHARD_MESSAGES
+    rows = [(r['phrase_source'], r['phrase_content'], r['dialog_id']) for r in make_rows(args.messages)]
+    dialogs = list(process_dialogs.group_dialog_rows(rows))
+
+    print(f'messages: {args.messages}, shard: {EXTRACT_SHARD_MESSAGES}, cpu: {os.cpu_count()}')
+    print(f'{"workers":>8} {"time, s":>9} {"msg/s":>12} {"speedup":>8}')
+    expected = None
+    serial = None
+    for workers in args.workers:
+        result = process_dialogs.extract_knowledge(dialogs, workers=workers)
+        if expected is None:
+            expected = result
+        assert result == expected, 'параллельный разбор расходится с последовательным'
+
+        elapsed = timed(lambda: process_dialogs.extract_knowledge(dialogs, workers=workers))
+        serial = serial or elapsed
+        print(f'{workers:>8} {elapsed:>9.2f} {args.messages / elapsed:>12,.0f} {serial / elapsed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
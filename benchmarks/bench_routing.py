@@ -0,0 +1,89 @@
+"""Маршрутизация generate между Polza и DeepSeek: хвостовые задержки и отказы.
+
+Обе модели подменяются локальными OpenAI-совместимыми заглушками. Сценарии:
+  tail   — у Polza медиана ниже, но --slow-rate ответов идут --slow-latency секунд;
+  errors — Polza отвечает 500 на --fail-rate запросов.
+В каждом сценарии запросы идут напрямую в Polza (как раньше) и через
+route=auto. Печатаются p50/p95/p99, число ошибок, доля хеджированных запросов
+и распределение ответов по провайдерам.
+
+Запуск: python benchmarks/bench_routing.py [--requests 200] [--slow-rate 0.08] [--fail-rate 0.4]
+"""
+
+import argparse
+import collections
+import json
+import os
+import time
+
+from _common import load_function
+from fake_servers import FakeDeepSeek
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(polza, count: int, route: str):
+    latencies, errors, hedged, providers = [], 0, 0, collections.Counter()
+    for number in range(count):
+        body = {
+            'messages': [{'role': 'user', 'content': f'Где мой заказ номер {number}?'}],
+            'model': 'openai/gpt-4o-mini',
+            'route': route,
+        }
+        started = time.perf_counter()
+        response = polza.handler({
+            'httpMethod': 'POST',
+            'queryStringParameters': {'action': 'generate'},
+            'body': json.dumps(body, ensure_ascii=False),
+        }, None)
+        latencies.append(time.perf_counter() - started)
+        if response['statusCode'] != 200:
+            errors += 1
+            continue
+        routing = json.loads(response['body']).get('routing') or {'provider': 'polza'}
+        providers[routing['provider']] += 1
+        hedged += bool(routing.get('hedged'))
+    return latencies, errors, hedged, providers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--slow-rate', type=float, default=0.08)
+    parser.add_argument('--slow-latency', type=float, default=1.5)
+    parser.add_argument('--fail-rate', type=float, default=0.4)
+    args = parser.parse_args()
+
+    scenarios = {
+        'tail': dict(slow_rate=args.slow_rate, slow_latency=args.slow_latency),
+        'errors': dict(fail_rate=args.fail_rate),
+    }
+    print(f'{"scenario":>9} {"mode":>7} {"p50, ms":>8} {"p95, ms":>8} {"p99, ms":>8} {"errors":>7} {"hedged":>7}  providers')
+    for scenario, polza_faults in scenarios.items():
+        with FakeDeepSeek(latency=0.1, jitter=0.02, **polza_faults) as polza_upstream, \
+                FakeDeepSeek(latency=0.18, jitter=0.03, seed=7) as deepseek_upstream:
+            os.environ.update({
+                'POLZA_BASE_URL': polza_upstream.base_url,
+                'POLZA_AI_API_KEY': 'bench',
+                'DEEPSEEK_BASE_URL': deepseek_upstream.base_url,
+                'DEEPSEEK_API_KEY': 'bench',
+                # Повторы http_client скрыли бы отказы прямого пути
+                'HTTP_MAX_RETRIES': '0',
+            })
+            polza = load_function('chatgpt-polza')
+            polza.PROVIDER_BASE_URL = polza_upstream.base_url
+            polza.DEEPSEEK_BASE_URL = deepseek_upstream.base_url
+            polza._router = None
+
+            for route in ('off', 'auto'):
+                latencies, errors, hedged, providers = run(polza, args.requests, route)
+                print(f'{scenario:>9} {route:>7} {percentile(latencies, 0.5) * 1000:>8.0f} '
+                      f'{percentile(latencies, 0.95) * 1000:>8.0f} {percentile(latencies, 0.99) * 1000:>8.0f} '
+                      f'{errors:>7} {hedged:>7}  {dict(providers)}')
+
+
+if __name__ == '__main__':
+    main()
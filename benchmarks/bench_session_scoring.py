@@ -0,0 +1,150 @@
+"""score_sessions chatgpt-polza: пакетная оценка сессий тренажера.
+
+Генерируется --sessions синтетических сессий: у оператора вежливый, сухой
+или грубый стиль, в доле --mixed реплик он отвечает не в своем стиле. Замеряется:
+  loop    — построчный перенос analyzeResponse (TrainerTab) на Python, как
+            если бы каждую реплику оценивали по отдельности;
+  lexical — действие score_sessions с judge=false (тот же цикл в scoring.py
+            плюс разбор JSON и сборка ответа);
+  judge   — то же с LLM-судьей для неоднозначных сессий (Polza — заглушка
+            с задержкой --latency).
+Оценки lexical сверяются с loop, печатается доля сессий, ушедших к судье.
+
+Запуск: python benchmarks/bench_session_scoring.py [--sessions 10000] [--latency 0.3]
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+from _common import load_function
+from fake_servers import FakeDeepSeek
+
+# Стиль оператора держится всю сессию, кроме доли --mixed реплик
+OPERATOR_STYLES = {
+    'вежливый': [
+        'Понимаю ваше недовольство, сейчас проверю статус заказа.',
+        'Приношу извинения за задержку, доставка будет завтра.',
+        'Уточню в системе и вернусь с ответом через минуту.',
+        'Сожалею, что так вышло. Помогу оформить возврат.',
+        'Извините, пожалуйста, это наша ошибка.',
+    ],
+    'сухой': [
+        'Номер заказа подскажите, пожалуйста.',
+        'Ожидайте.',
+        'Хорошо, записал.',
+        'Да, конечно, сейчас посмотрю.',
+    ],
+    'грубый': [
+        'Это не моя проблема, обращайтесь в службу доставки.',
+        'Что вы хотите от меня? Сами виноваты, указали неверный адрес.',
+        'Ожидайте.',
+    ],
+}
+CLIENT_PHRASES = [
+    'Где мой заказ?! Я жду уже пять дней!',
+    'Когда будет доставка?',
+    'Хочу вернуть деньги.',
+    'Спасибо, а можно быстрее?',
+]
+
+
+def make_sessions(count: int, seed: int, mixed: float = 0.1):
+    rng = random.Random(seed)
+    styles = list(OPERATOR_STYLES)
+    sessions = []
+    for number in range(count):
+        ts = 1_700_000_000 + number * 3600
+        style = rng.choices(styles, weights=[6, 3, 1])[0]
+        messages = []
+        for _ in range(rng.randint(3, 8)):
+            messages.append({'sender': 'ai', 'text': rng.choice(CLIENT_PHRASES), 'ts': ts})
+            ts += rng.randint(5, 240)
+            turn_style = rng.choice(styles) if rng.random() < mixed else style
+            messages.append({'sender': 'user', 'text': rng.choice(OPERATOR_STYLES[turn_style]), 'ts': ts})
+            ts += rng.randint(3, 20)
+        sessions.append({'id': f'session-{number}', 'messages': messages})
+    return sessions
+
+
+def analyze_response(text: str):
+    """analyzeResponse из TrainerTab без скорости: (empathy, professionalism)"""
+    lower = text.lower()
+    empathy = professionalism = 50
+    for word in ['понимаю', 'извините', 'приношу извинения', 'сожалею', 'помогу', 'поддержка']:
+        if word in lower:
+            empathy += 15
+    for word in ['заказ', 'доставка', 'возврат', 'проверю', 'уточню', 'система', 'статус']:
+        if word in lower:
+            professionalism += 12
+    for word in ['ваша вина', 'не моя проблема', 'сами виноваты', 'что вы хотите']:
+        if word in lower:
+            empathy -= 30
+            professionalism -= 20
+    if len(text) < 20:
+        professionalism -= 10
+    return min(100, max(0, empathy)), min(100, max(0, professionalism))
+
+
+def loop_scores(sessions):
+    scores = []
+    for session in sessions:
+        pairs = [analyze_response(message['text']) for message in session['messages'] if message['sender'] == 'user']
+        scores.append((sum(p[0] for p in pairs) / len(pairs), sum(p[1] for p in pairs) / len(pairs)))
+    return scores
+
+
+def score(polza, sessions, judge: bool) -> dict:
+    response = polza.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'action': 'score_sessions'},
+        'body': json.dumps({'sessions': sessions, 'judge': judge}, ensure_ascii=False),
+    }, None)
+    assert response['statusCode'] == 200, response['body']
+    return json.loads(response['body'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--mixed', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    sessions = make_sessions(args.sessions, args.seed, args.mixed)
+    operator_messages = sum(m['sender'] == 'user' for s in sessions for m in s['messages'])
+    print(f'сессий: {len(sessions)}, реплик оператора: {operator_messages}')
+
+    started = time.perf_counter()
+    expected = loop_scores(sessions)
+    print(f'loop:    {time.perf_counter() - started:.3f} с')
+
+    with FakeDeepSeek(latency=args.latency, jitter=args.latency / 4) as upstream:
+        os.environ.update({'POLZA_BASE_URL': upstream.base_url, 'POLZA_AI_API_KEY': 'bench'})
+        polza = load_function('chatgpt-polza')
+        score(polza, sessions[:10], judge=False)  # прогрев
+
+        started = time.perf_counter()
+        lexical = score(polza, sessions, judge=False)
+        elapsed = time.perf_counter() - started
+        mismatches = sum(
+            abs(result['empathy'] - round(empathy, 1)) > 0.05 or abs(result['professionalism'] - round(professionalism, 1)) > 0.05
+            for result, (empathy, professionalism) in zip(lexical['results'], expected)
+        )
+        print(f'lexical: {elapsed:.3f} с в обработчике (из них оценка {lexical["summary"]["lexical_ms"] / 1000:.3f} с), '
+              f'расхождений с loop: {mismatches}')
+
+        started = time.perf_counter()
+        judged = score(polza, sessions, judge=True)
+        summary = judged['summary']
+        print(f'judge:   {time.perf_counter() - started:.3f} с, к судье ушло {summary["escalated"]} сессий '
+              f'({summary["escalated_share"]:.1%}) в {summary["judge_requests"]} запросах '
+              f'(заглушка получила {upstream.requests}), оценено судьей {summary["judged"]}, '
+              f'ошибок {summary["judge_errors"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Склейка одинаковых одновременных запросов к внешним API (single-flight).
+
+--clients одинаковых запросов стартуют одновременно (threading.Barrier) против
+медленной заглушки (--latency): ping test и один и тот же generate у
+chatgpt-polza, один и тот же чат у deepseek-chat, анализ одной таблицы Google
+Sheets у process-dialogs — и те же сценарии с ошибкой upstream (заглушка
+отвечает 500 или таблицы нет). Со склейкой каждый сценарий должен дать ровно
+одно обращение к заглушке, а ответ (или ошибку) — получить все клиенты;
+для сравнения те же сценарии прогоняются с SINGLE_FLIGHT=0.
+
+Каждая функция — в отдельном процессе: модули http_client, metrics и
+singleflight у функций общие по имени. Повторы http_client отключены
+(HTTP_MAX_RETRIES=0), чтобы ответ 500 тоже был одним обращением.
+
+Запуск: python benchmarks/bench_singleflight.py [--clients 20] [--latency 0.5]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from _common import FUNCTIONS, check_shared_modules, load_function, make_rows
+from dialog_generator import to_csv_bytes
+from fake_servers import FakeDeepSeek, FakeSheets
+
+SHEET_ID = 'bench-sheet'
+
+
+def burst(function, event: dict, clients: int):
+    """clients одинаковых вызовов handler, отпущенных одновременно"""
+    barrier = threading.Barrier(clients)
+
+    def call(_):
+        barrier.wait()
+        response = function.handler(dict(event), None)
+        body = json.loads(response['body'])
+        # Поля, которые различаются у склеенных ответов, в сравнение не входят
+        for field in ('coalesced', 'cacheStats'):
+            body.pop(field, None)
+        return response['statusCode'], json.dumps(body, sort_keys=True, ensure_ascii=False)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        outcomes = list(pool.map(call, range(clients)))
+    return outcomes, time.perf_counter() - started
+
+
+def scenarios(name: str):
+    """(сценарий, событие handler, ожидаемый статус); не 200 — upstream отвечает ошибкой"""
+    if name == 'chatgpt-polza':
+        generate = {'messages': [{'role': 'user', 'content': 'Начать сценарий: клиент ждет заказ неделю'}]}
+        return [
+            ('test', {'queryStringParameters': {'action': 'test'}, 'body': '{}'}, 200),
+            ('generate', {'queryStringParameters': {'action': 'generate'}, 'body': json.dumps(generate)}, 200),
+            ('generate 500', {'queryStringParameters': {'action': 'generate'}, 'body': json.dumps(generate)}, 400),
+        ]
+    if name == 'deepseek-chat':
+        chat = {'messages': [{'role': 'user', 'content': 'Начать сценарий: клиент ждет заказ неделю'}]}
+        return [
+            ('chat', {'body': json.dumps(chat)}, 200),
+            ('chat 500', {'body': json.dumps(chat)}, 500),
+        ]
+    sheet = {'googleSheetsUrl': f'https://docs.google.com/spreadsheets/d/{SHEET_ID}/edit'}
+    missing = {'googleSheetsUrl': 'https://docs.google.com/spreadsheets/d/missing-sheet/edit'}
+    return [
+        ('sheet', {'body': json.dumps(sheet)}, 200),
+        ('sheet 404', {'body': json.dumps(missing)}, 500),
+    ]
+
+
+def exercise(name: str, clients: int, latency: float):
+    csv_data = to_csv_bytes(make_rows(300, seed=7))
+    with tempfile.TemporaryDirectory() as directory, \
+            FakeDeepSeek(latency=latency) as upstream, FakeSheets({SHEET_ID: csv_data}, latency=latency) as sheets:
+        os.environ.update({
+            'PROCESS_DIALOGS_CACHE_DIR': directory,
+            'DEEPSEEK_URL': upstream.url,
+            'DEEPSEEK_API_KEY': 'bench',
+            'POLZA_BASE_URL': upstream.base_url,
+            'POLZA_AI_API_KEY': 'bench',
+            'GOOGLE_SHEETS_EXPORT_URL': sheets.export_url_template,
+            'HTTP_MAX_RETRIES': '0',
+            'METRICS_LOG': '0',
+            'VECTOR_INDEX_ENABLED': '0',
+        })
+        function = load_function(name)
+        enabled = function.UPSTREAM_FLIGHTS.enabled
+
+        for scenario, event, status in scenarios(name):
+            upstream.fail_rate = 0.0 if status == 200 else 1.0
+            upstream.requests = sheets.requests = 0
+            shared_before = function.UPSTREAM_FLIGHTS.stats()['shared']
+            event = {'httpMethod': 'POST', **event}
+            outcomes, elapsed = burst(function, event, clients)
+
+            hits = upstream.requests + sheets.requests
+            statuses = sorted({status for status, _ in outcomes})
+            distinct = len({body for _, body in outcomes})
+            shared = function.UPSTREAM_FLIGHTS.stats()['shared'] - shared_before
+            print(f'{name:>15} {scenario:<13} {"on" if enabled else "off":>5} {elapsed:>7.2f} '
+                  f'{upstream.requests:>8} {sheets.requests:>7} {shared:>7}  {statuses} x{clients}, '
+                  f'разных ответов: {distinct}')
+            # Без склейки заглушка под залпом может и оборвать часть соединений
+            if enabled:
+                assert statuses == [status], f'{scenario}: статусы {statuses}, ожидался {status}'
+                assert distinct == 1, 'клиенты получили разные ответы'
+                # Анализ таблицы: одно скачивание и один кусок диалогов в DeepSeek
+                expected = 2 if scenario == 'sheet' else 1
+                assert hits == expected, f'{scenario}: обращений к заглушкам {hits}, ожидалось {expected}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--function', choices=list(FUNCTIONS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.function:
+        exercise(args.function, args.clients, args.latency)
+        return
+
+    check_shared_modules('singleflight.py')
+    print(f'{"функция":>15} {"сценарий":<13} {"склейка":>5} {"время, с":>7} {"DeepSeek":>8} '
+          f'{"Sheets":>7} {"общих":>7}  статусы')
+    for single_flight in ('1', '0'):
+        for name in FUNCTIONS:
+            subprocess.run([sys.executable, str(Path(__file__)), '--function', name,
+                            '--clients', str(args.clients), '--latency', str(args.latency)],
+                           env={**os.environ, 'SINGLE_FLIGHT': single_flight}, check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Холодный старт функций: время импорта модуля и первого/второго запроса.
+
+Каждый сценарий запускается в отдельном процессе, как новый инстанс функции.
+Запросы не ходят в сеть: ключи API не заданы, кэш лежит во временном каталоге.
+
+Запуск: python benchmarks/bench_startup.py [--functions process-dialogs ...] [--repeat 3] [--json]
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from _common import FUNCTIONS, load_function, make_rows
+
+HEAVY_MODULES = ('requests', 'pandas', 'numpy', 'openpyxl')
+
+
+def upload_event(file_format: str) -> dict:
+    # pandas нужен только родительскому процессу: в дочернем он исказил бы замер
+    import pandas as pd
+
+    df = pd.DataFrame(make_rows(500))
+    if file_format == 'csv':
+        data = df.to_csv(index=False).encode('utf-8')
+    else:
+        output = BytesIO()
+        df.to_excel(output, index=False)
+        data = output.getvalue()
+    return {
+        'httpMethod': 'POST',
+        'headers': {'Content-Type': 'application/octet-stream'},
+        'queryStringParameters': {'fileName': f'startup.{file_format}'},
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True,
+    }
+
+
+def scenarios(function: str) -> dict:
+    options = {'httpMethod': 'OPTIONS'}
+    if function == 'process-dialogs':
+        return {
+            'options': lambda: options,
+            'csv-upload': lambda: upload_event('csv'),
+            'xlsx-upload': lambda: upload_event('xlsx'),
+        }
+    if function == 'deepseek-chat':
+        return {
+            'options': lambda: options,
+            'chat-no-key': lambda: {'httpMethod': 'POST', 'body': json.dumps({'messages': [{'role': 'user', 'content': 'hi'}]})},
+        }
+    return {
+        'options': lambda: options,
+        'generate-no-key': lambda: {
+            'httpMethod': 'POST',
+            'queryStringParameters': {'action': 'generate'},
+            'body': json.dumps({'messages': [{'role': 'user', 'content': 'hi'}]}),
+        },
+    }
+
+
+def child(function: str, event_path: str) -> None:
+    # Событие собрано родительским процессом: pandas бенчмарка не попадает в замер
+    with open(event_path, encoding='utf-8') as event_file:
+        event = json.load(event_file)
+    preloaded = {name for name in HEAVY_MODULES if name in sys.modules}
+
+    started = time.perf_counter()
+    module = load_function(function)
+    imported = time.perf_counter()
+    module.handler(event, None)
+    first = time.perf_counter()
+    module.handler(event, None)
+    second = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'first_ms': (first - imported) * 1000,
+        'second_ms': (second - first) * 1000,
+        'loaded': [name for name in HEAVY_MODULES if name in sys.modules and name not in preloaded],
+    }))
+
+
+def run_child(function: str, event_path: str, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', function, event_path],
+        check=True, capture_output=True, text=True, env=env
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--functions', nargs='+', choices=sorted(FUNCTIONS), default=sorted(FUNCTIONS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = {key: value for key, value in os.environ.items()
+               if key not in ('DEEPSEEK_API_KEY', 'POLZA_AI_API_KEY')}
+        env['PROCESS_DIALOGS_CACHE_DIR'] = cache_dir
+        for function in args.functions:
+            for scenario, make_event in scenarios(function).items():
+                event_path = os.path.join(cache_dir, f'{function}-{scenario}.json')
+                with open(event_path, 'w', encoding='utf-8') as event_file:
+                    json.dump(make_event(), event_file)
+                runs = [run_child(function, event_path, env) for _ in range(args.repeat)]
+                results.append({
+                    'function': function,
+                    'scenario': scenario,
+                    **{key: statistics.median(run[key] for run in runs)
+                       for key in ('import_ms', 'first_ms', 'second_ms')},
+                    'loaded': runs[-1]['loaded'],
+                })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f'{"function":>16} {"scenario":>16} {"import, ms":>11} {"1st req, ms":>12} {"2nd req, ms":>12}  heavy modules')
+    for result in results:
+        print(f'{result["function"]:>16} {result["scenario"]:>16} {result["import_ms"]:>11.1f} '
+              f'{result["first_ms"]:>12.1f} {result["second_ms"]:>12.1f}  {", ".join(result["loaded"]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
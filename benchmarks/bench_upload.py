@@ -0,0 +1,136 @@
+"""Пиковая память и время приема загрузки: JSON+base64 против multipart и сырого тела.
+
+Измеряется только прием и разбор файла (до извлечения знаний). Каждый случай
+запускается в отдельном процессе; пик RSS сбрасывается через
+/proc/self/clear_refs после того, как событие уже собрано.
+
+Запуск: python benchmarks/bench_upload.py [--sizes-mb 10 50 100] [--format csv|xlsx]
+"""
+
+import argparse
+import base64
+import gc
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+
+from _common import load_function, make_rows
+
+MODES = ('legacy-json', 'json', 'multipart', 'raw')
+BOUNDARY = 'benchUploadBoundary7MA4YWxkTrZu0gW'
+BYTES_PER_ROW = {'csv': 90, 'xlsx': 45}
+
+
+def make_file(size_mb: int, file_format: str) -> bytes:
+    """Таблица примерно заданного размера"""
+    rows = make_rows(size_mb * 2 ** 20 // BYTES_PER_ROW[file_format])
+    df = pd.DataFrame(rows)
+    if file_format == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+    output = BytesIO()
+    df.to_excel(output, index=False)
+    return output.getvalue()
+
+
+def make_event(mode: str, data: bytes, file_name: str) -> dict:
+    if mode in ('legacy-json', 'json'):
+        body = json.dumps({'file': base64.b64encode(data).decode('ascii'), 'fileName': file_name})
+        return {'httpMethod': 'POST', 'headers': {'Content-Type': 'application/json'}, 'body': body}
+    if mode == 'multipart':
+        payload = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8') + data
+        payload += f'\r\n--{BOUNDARY}--\r\n'.encode('ascii')
+        return {
+            'httpMethod': 'POST',
+            'headers': {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'},
+            'body': base64.b64encode(payload).decode('ascii'),
+            'isBase64Encoded': True,
+        }
+    return {
+        'httpMethod': 'POST',
+        'headers': {'Content-Type': 'application/octet-stream'},
+        'queryStringParameters': {'fileName': file_name},
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True,
+    }
+
+
+def receive(process_dialogs, mode: str, event: dict):
+    """Путь от события до диалогов, как в handler"""
+    if mode == 'legacy-json':
+        # Прежний путь: strip() для проверки пустого тела, json.loads и base64.b64decode
+        if event['body'].strip() == '':
+            return []
+        body = json.loads(event['body'])
+        return process_dialogs.parse_excel_bytes(base64.b64decode(body['file']), body['fileName'])
+    if mode == 'json':
+        body = json.loads(event['body'])
+        return process_dialogs.parse_excel_bytes(process_dialogs.decode_file(body['file']), body['fileName'])
+    body, file_payload = process_dialogs.read_binary_upload(event)
+    return process_dialogs.parse_excel_bytes(file_payload, body['fileName'])
+
+
+def read_rss_kb(field: str) -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def child(path: str, mode: str, file_name: str) -> None:
+    process_dialogs = load_function('process-dialogs')
+    data = Path(path).read_bytes()
+    event = make_event(mode, data, file_name)
+    del data
+    gc.collect()
+
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+    baseline = read_rss_kb('VmRSS')
+    started = time.perf_counter()
+    dialogs = receive(process_dialogs, mode, event)
+    elapsed = time.perf_counter() - started
+    peak = read_rss_kb('VmHWM')
+    print(json.dumps({'seconds': elapsed, 'peak_mb': (peak - baseline) / 1024, 'dialogs': len(dialogs)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--format', choices=sorted(BYTES_PER_ROW), default='csv')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    file_name = f'dialogs.{args.format}'
+    print(f'{"file, MB":>9} {"mode":>12} {"time, s":>8} {"peak RSS over event, MB":>24}')
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes_mb:
+            path = Path(directory) / file_name
+            path.write_bytes(make_file(size, args.format))
+            actual_mb = path.stat().st_size / 2 ** 20
+            dialogs = None
+            for mode in args.modes:
+                output = subprocess.run(
+                    [sys.executable, __file__, '--child', str(path), mode, file_name],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                dialogs = dialogs or result['dialogs']
+                assert result['dialogs'] == dialogs, 'режимы загрузки дают разное число диалогов'
+                print(f'{actual_mb:>9.1f} {mode:>12} {result["seconds"]:>8.2f} {result["peak_mb"]:>24.1f}')
+
+
+if __name__ == '__main__':
+    main()
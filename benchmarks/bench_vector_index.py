@@ -0,0 +1,68 @@
+"""Построение векторной базы похожих ситуаций и задержка запросов к ней.
+
+Загрузка только откладывает ситуации (stage), индекс собирается первым
+запросом action=query (build); замеряются обе части.
+
+Запуск: python benchmarks/bench_vector_index.py [--messages 1000000] [--queries 200]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from _common import load_function, make_rows
+
+QUERIES = [
+    'микроскоп не фокусируется',
+    'в телескопе мутное стекло',
+    'есть ли в наличии бинокль',
+    'сломалась подсветка у детского микроскопа',
+    'царапина на объективе, что делать',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault('PROCESS_DIALOGS_CACHE_DIR', tempfile.mkdtemp(prefix='bench-index-'))
+    process_dialogs = load_function('process-dialogs')
+    import situations  # каталог функции добавлен в sys.path загрузчиком
+    import vector_index
+
+    rows = [(r['phrase_source'], r['phrase_content'], r['dialog_id']) for r in make_rows(args.messages)]
+    # Уникальный хвост, чтобы тексты не схлопывались в несколько шаблонов
+    rows = [(source, f'{content} #{index % 9973}', dialog_id) for index, (source, content, dialog_id) in enumerate(rows)]
+
+    started = time.perf_counter()
+    stager = situations.SituationStager('bench')
+    for dialog in process_dialogs.group_dialog_rows(rows):
+        stager.add(dialog)
+    stager.finish()
+    stage_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vector_index.build_pending_index('bench')
+    build_time = time.perf_counter() - started
+
+    index = vector_index.open_index('bench')
+    print(f'messages: {args.messages}, situations: {len(index)}, lists: {len(index.centroids)}, '
+          f'stage: {stage_time:.1f} s, build: {build_time:.1f} s')
+
+    latencies = []
+    for number in range(args.queries):
+        started = time.perf_counter()
+        index.search(QUERIES[number % len(QUERIES)], top_k=5)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f'query latency: p50 {p50:.2f} ms, p95 {p95:.2f} ms')
+    print('top result:', index.search(QUERIES[0], top_k=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Память и время разбора XLSX: pandas.read_excel против потокового openpyxl read_only.
+
+В книге кроме трех нужных колонок есть лишние — как в реальных выгрузках.
+Потоковый режим только обходит диалоги, не накапливая их, как это делает handler.
+
+Запуск: python benchmarks/bench_xlsx_stream.py [--sizes 20000 100000 200000] [--extra-columns 20]
+"""
+
+import argparse
+import gc
+import time
+from io import BytesIO
+
+import pandas as pd
+
+from _common import load_function, make_rows
+from bench_group_dialogs import group_dialog_frame
+
+
+def make_workbook(size: int, extra_columns: int) -> bytes:
+    df = pd.DataFrame(make_rows(size))
+    for column in range(extra_columns):
+        df[f'extra_{column}'] = f'служебное поле {column}'
+    output = BytesIO()
+    df.to_excel(output, index=False)
+    return output.getvalue()
+
+
+def read_with_pandas(process_dialogs, data: bytes) -> int:
+    df = pd.read_excel(BytesIO(data), engine='openpyxl')
+    return len(group_dialog_frame(df))
+
+
+def read_streaming(process_dialogs, data: bytes) -> int:
+    return sum(1 for _ in process_dialogs.stream_excel_dialogs(data))
+
+
+def read_rss_kb(field: str) -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(read, process_dialogs, data: bytes):
+    """Время и прирост пикового RSS (tracemalloc замедляет openpyxl в десятки раз)"""
+    gc.collect()
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+    baseline = read_rss_kb('VmRSS')
+    started = time.perf_counter()
+    dialogs = read(process_dialogs, data)
+    elapsed = time.perf_counter() - started
+    return dialogs, elapsed, (read_rss_kb('VmHWM') - baseline) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20_000, 100_000, 200_000])
+    parser.add_argument('--extra-columns', type=int, default=20)
+    args = parser.parse_args()
+
+    process_dialogs = load_function('process-dialogs')
+
+    print(f'{"rows":>8} {"file, MB":>9} {"mode":>10} {"time, s":>8} {"peak RSS, MB":>13}')
+    for size in args.sizes:
+        data = make_workbook(size, args.extra_columns)
+        expected = None
+        # Потоковый режим первым: память после pandas не всегда возвращается ОС
+        for name, read in (('streaming', read_streaming), ('pandas', read_with_pandas)):
+            dialogs, elapsed, peak = measure(read, process_dialogs, data)
+            expected = expected or dialogs
+            assert dialogs == expected, 'потоковый разбор нашел другое число диалогов'
+            print(f'{size:>8} {len(data) / 2 ** 20:>9.1f} {name:>10} {elapsed:>8.2f} {peak:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Детерминированный генератор выгрузок диалогов магазина оптики.
+
+Одинаковые seed и размер дают байт-в-байт одинаковые файлы, поэтому замеры
+разных коммитов сравнимы. Можно запускать отдельно, чтобы получить файл:
+
+    python benchmarks/dialog_generator.py --messages 100000 --format xlsx --output dialogs.xlsx
+"""
+
+import argparse
+import csv
+import io
+import random
+from typing import Dict, List
+
+PRODUCTS = ['микроскоп Эврика 1280', 'телескоп Атом 800х', 'детский микроскоп', 'Микромед Р1',
+            'бинокль БПЦ 10х50', 'прицел ПО-4', 'лупа 20x', 'окуляр 25', 'объектив 4х']
+CLIENT_PHRASES = [
+    'Здравствуйте, у меня {p} не работает подсветка.',
+    'Купил {p}, а там царапина на стекле. Что делать?',
+    '{p} не фокусируется, как будто мутное стекло.',
+    'Почему в {p} ничего не видно?',
+    'Подскажите, есть ли в наличии {p}?',
+    'Сломался {p} через неделю, это брак?',
+    'Спасибо, всё понятно.',
+]
+OPERATOR_PHRASES = [
+    'Добрый день! Уточните, пожалуйста, номер заказа.',
+    'Попробуйте снять крышку с объектива и настроить резкость.',
+    'Мы оформим замену {p} по гарантии.',
+    'Да, {p} есть в наличии, доставка 2-3 дня.',
+    'Спасибо за обращение!',
+]
+
+# Расширенный словарь для generate_rows: больше товаров, жалоб и служебных колонок
+EXTRA_PRODUCTS = ['телескоп Levenhuk Skyline 90', 'микроскоп Levenhuk 2L', 'бинокль Nikon Aculon 8x42',
+                  'монокуляр Бушнелл 10х42', 'зрительная труба Veber 20-60x60', 'налобная лупа 2,5х',
+                  'фильтр лунный 1,25"', 'линза Барлоу 2х', 'штатив для телескопа', 'предметные стекла 50 шт']
+EXTRA_CLIENT_PHRASES = [
+    'Добрый вечер! {p} не собирается, не хватает винта.',
+    'Заказ пришёл, но {p} треснул при доставке.',
+    'Можно ли вернуть {p}, если не подошёл?',
+    'В {p} изображение двоится, это нормально?',
+    'Не могу разобраться с настройкой {p}, помогите.',
+    'Ребёнку 7 лет, подойдёт {p}?',
+]
+EXTRA_OPERATOR_PHRASES = [
+    'Пришлите, пожалуйста, фото дефекта, передадим в сервис.',
+    'Возврат возможен в течение 14 дней при сохранении упаковки.',
+    'Проверьте, что батарейки установлены правильно.',
+    'Для {p} есть видеоинструкция, отправлю ссылку.',
+    'Переведу вас на старшего специалиста.',
+]
+SERVICE_COLUMNS = ['channel', 'operator_login', 'created_at', 'rating', 'tags']
+
+
+def make_rows(message_count: int, seed: int = 42) -> List[Dict[str, str]]:
+    """Детерминированно генерирует строки выгрузки: phrase_source, phrase_content, dialog_id"""
+    rng = random.Random(seed)
+    rows = []
+    dialog_number = 0
+    while len(rows) < message_count:
+        dialog_number += 1
+        product = rng.choice(PRODUCTS)
+        for turn in range(rng.randint(2, 12)):
+            if turn % 2 == 0:
+                source, template = 'Клиент', rng.choice(CLIENT_PHRASES)
+            else:
+                source, template = 'Оператор', rng.choice(OPERATOR_PHRASES)
+            rows.append({
+                'phrase_source': source,
+                'phrase_content': template.format(p=product),
+                'dialog_id': str(dialog_number),
+            })
+            if len(rows) == message_count:
+                break
+    return rows
+
+
+def generate_rows(message_count: int, seed: int = 42, service_columns: bool = True,
+                  missing_ratio: float = 0.01) -> List[Dict[str, str]]:
+    """Выгрузка, похожая на настоящую: расширенный словарь, служебные колонки, пустые ячейки"""
+    rng = random.Random(seed)
+    products = PRODUCTS + EXTRA_PRODUCTS
+    client_phrases = CLIENT_PHRASES + EXTRA_CLIENT_PHRASES
+    operator_phrases = OPERATOR_PHRASES + EXTRA_OPERATOR_PHRASES
+    rows = []
+    dialog_number = 0
+    while len(rows) < message_count:
+        dialog_number += 1
+        product = rng.choice(products)
+        channel = rng.choice(['чат', 'телефон', 'почта'])
+        operator = f'operator{rng.randint(1, 40):02d}'
+        for turn in range(rng.randint(2, 16)):
+            if turn % 2 == 0:
+                source, template = 'Клиент', rng.choice(client_phrases)
+            else:
+                source, template = 'Оператор', rng.choice(operator_phrases)
+            content = template.format(p=product)
+            if rng.random() < missing_ratio:
+                content = ''
+            row = {'phrase_source': source, 'phrase_content': content, 'dialog_id': str(100000 + dialog_number)}
+            if service_columns:
+                row.update({
+                    'channel': channel,
+                    'operator_login': operator,
+                    'created_at': f'2024-{1 + dialog_number % 12:02d}-{1 + turn % 28:02d} 10:{turn:02d}',
+                    'rating': str(rng.randint(1, 5)),
+                    'tags': rng.choice(['', 'гарантия', 'доставка', 'консультация']),
+                })
+            rows.append(row)
+            if len(rows) == message_count:
+                break
+    return rows
+
+
+def to_csv_bytes(rows: List[Dict[str, str]]) -> bytes:
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(rows[0]), lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+def to_xlsx_bytes(rows: List[Dict[str, str]]) -> bytes:
+    """XLSX через openpyxl write_only: без pandas и без книги целиком в памяти"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Диалоги')
+    columns = list(rows[0])
+    sheet.append(columns)
+    for row in rows:
+        sheet.append([row[column] for column in columns])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def generate_file(message_count: int, file_format: str, seed: int = 42) -> bytes:
+    rows = generate_rows(message_count, seed)
+    return to_csv_bytes(rows) if file_format == 'csv' else to_xlsx_bytes(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=10_000)
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    data = generate_file(args.messages, args.format, args.seed)
+    with open(args.output, 'wb') as output:
+        output.write(data)
+    print(f'{args.output}: {args.messages} сообщений, {len(data) / 2 ** 20:.1f} МБ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Локальные заглушки внешних сервисов для бенчмарков: DeepSeek и экспорт Google Sheets.
+
+Серверы поднимаются на 127.0.0.1 в фоновом потоке и работают как контекстные
+менеджеры. Задержка DeepSeek настраивается, чтобы замер показывал вклад
+параллельной отправки кусков, а не скорость реального API.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+SHEET_PATH = re.compile(r'^/spreadsheets/d/([^/]+)/export')
+
+
+class _FakeServer:
+    handler_class = BaseHTTPRequestHandler
+
+    def __init__(self):
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __enter__(self):
+        owner = self
+
+        class Handler(self.handler_class):
+            server_owner = owner
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count_request(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+class _DeepSeekHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Каталог моделей в формате OpenAI-совместимого /models
+        fake = self.server_owner
+        fake.count_request()
+        time.sleep(fake.delay())
+        models = [f'openai/gpt-4o{suffix}' for suffix in ('', '-mini', '-2024-08-06')] + \
+                 ['openai/gpt-4.1', 'openai/o3-mini', 'anthropic/claude-sonnet', 'google/gemini-pro', 'deepseek/deepseek-chat']
+        self._send(200, {'object': 'list', 'data': [{'id': model, 'object': 'model'} for model in models]})
+
+    def do_POST(self):
+        fake = self.server_owner
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        number = fake.count_request()
+        if not fake.acquire():
+            self._send(429, {'error': {'message': 'rate limit exceeded'}}, {'Retry-After': str(fake.retry_after)})
+            return
+        try:
+            self._complete(body, number)
+        finally:
+            fake.release()
+
+    def _complete(self, body: Dict, number: int):
+        fake = self.server_owner
+        time.sleep(fake.delay())
+
+        if fake.rng_failure():
+            self._send(500, {'error': {'message': 'fake failure'}})
+            return
+
+        prompt = body['messages'][-1]['content']
+        content = fake.reply(prompt, number)
+        prompt_chars = sum(len(message.get('content') or '') for message in body['messages'])
+        usage = {'prompt_tokens': prompt_chars // 3, 'completion_tokens': len(content) // 3}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        self._send(200, {
+            'model': body.get('model'),
+            'choices': [{'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': usage,
+        })
+
+    def _send(self, status: int, payload: Dict, headers: Dict[str, str] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeDeepSeek(_FakeServer):
+    """Заглушка /chat/completions
+
+    На промпт анализа диалогов отвечает JSON с проблемами, на промпт оценки
+    сессий (scoring) — JSON с оценками, на остальные — репликой клиента.
+    latency — задержка ответа, jitter — ее разброс (в секундах), fail_rate —
+    доля ответов 500, slow_rate — доля «хвостовых» ответов с задержкой
+    slow_latency, max_concurrent — лимит одновременных запросов, сверх него
+    ответ 429 с Retry-After: retry_after (0 — без лимита). Случайность
+    детерминирована seed, чтобы прогоны были сравнимы.
+    """
+
+    handler_class = _DeepSeekHandler
+    PROBLEM = re.compile(r'Клиент: ([^\n]{10,80}?)[.?]')
+    JUDGED_SESSION = re.compile(r'^Session (\d+):$', re.MULTILINE)
+    CHAT_REPLY = ('Здравствуйте! Купил у вас микроскоп Эврика 1280 неделю назад, а подсветка '
+                  'не включается. Батарейки новые, переключатель щелкает, но света нет. Ребенок '
+                  'очень расстроен, это был подарок на день рождения. Что мне теперь делать, '
+                  'везти его в магазин или можно как-то проверить самому?')
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, fail_rate: float = 0.0, seed: int = 42,
+                 slow_rate: float = 0.0, slow_latency: float = 0.0,
+                 max_concurrent: int = 0, retry_after: float = 0.1):
+        super().__init__()
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self._rng = random.Random(seed)
+
+    def delay(self) -> float:
+        with self._lock:
+            if self._rng.random() < self.slow_rate:
+                return self.slow_latency
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                self.rate_limited += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def rng_failure(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.fail_rate
+
+    def reply(self, prompt: str, number: int) -> str:
+        sessions = self.JUDGED_SESSION.findall(prompt)
+        if sessions:
+            return json.dumps({'scores': [
+                {'session': int(session), 'empathy': (number * 37 + int(session) * 11) % 61 + 40,
+                 'professionalism': (number * 23 + int(session) * 17) % 51 + 45}
+                for session in sessions
+            ]})
+        if 'Клиент:' not in prompt:
+            return self.CHAT_REPLY
+        problems = sorted(set(self.PROBLEM.findall(prompt)))[:20] or [f'проблема {number}']
+        return json.dumps({'problems': problems, 'products': ['микроскоп Эврика 1280']}, ensure_ascii=False)
+
+    @property
+    def url(self) -> str:
+        return f'{self.base_url}/chat/completions'
+
+
+class _SheetsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        fake = self.server_owner
+        fake.count_request()
+        time.sleep(fake.latency)
+        match = SHEET_PATH.match(self.path)
+        data = fake.sheets.get(match.group(1)) if match else None
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        # Частями, как большой ответ по сети
+        for start in range(0, len(data), 64 * 1024):
+            self.wfile.write(data[start:start + 64 * 1024])
+
+
+class FakeSheets(_FakeServer):
+    """Заглушка экспорта Google Sheets: отдает CSV по /spreadsheets/d/<id>/export
+
+    latency — задержка перед ответом в секундах.
+    """
+
+    handler_class = _SheetsHandler
+
+    def __init__(self, sheets: Dict[str, bytes], latency: float = 0.0):
+        super().__init__()
+        self.sheets = sheets
+        self.latency = latency
+
+    @property
+    def export_url_template(self) -> str:
+        """Значение для GOOGLE_SHEETS_EXPORT_URL в process-dialogs"""
+        return f'{self.base_url}/spreadsheets/d/{{sheet_id}}/export?format=csv'
@@ -0,0 +1,254 @@
+"""Набор бенчмарков process-dialogs с результатами в JSON для сравнения коммитов.
+
+Случаи:
+  parse-csv, parse-xlsx — parse_excel_file на синтетической выгрузке;
+  sheets — скачивание и разбор Google Sheets против локальной заглушки экспорта;
+  extract — extract_knowledge по уже разобранным диалогам;
+  handler-miss, handler-hit — полный handler с заглушкой DeepSeek
+  (первый запрос с новым промптом и повтор из кэша результатов).
+
+Сеть не используется: адреса DeepSeek и Google Sheets подменяются окружением,
+кэш и очередь задач лежат во временном каталоге.
+
+Запуск:
+  python benchmarks/suite.py [--sizes 1000 10000 100000] [--cases ...] [--latency 0.2]
+                             [--output results.json] [--compare baseline.json --threshold 0.2]
+"""
+
+import argparse
+import base64
+import contextlib
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from _common import ROOT, load_function
+from dialog_generator import generate_rows, to_csv_bytes, to_xlsx_bytes
+from fake_servers import FakeDeepSeek, FakeSheets
+
+CASES = ('parse-csv', 'parse-xlsx', 'sheets', 'extract', 'handler-miss', 'handler-hit')
+SHEET_ID = 'benchSheet'
+
+
+def read_rss_kb(field: str) -> Optional[int]:
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> Optional[int]:
+    """Сбрасывает VmHWM (только Linux) и возвращает текущий RSS в КБ"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return None
+    return read_rss_kb('VmRSS')
+
+
+def measure(run: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Медиана и минимум времени за repeat запусков, прирост пикового RSS за первый"""
+    timings = []
+    peak_mb = None
+    for attempt in range(repeat):
+        gc.collect()
+        baseline = reset_peak_rss() if attempt == 0 else None
+        started = time.perf_counter()
+        # Функция печатает ход обработки в stdout — в замере он только мешает
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run()
+        timings.append(time.perf_counter() - started)
+        if baseline is not None:
+            peak_mb = (read_rss_kb('VmHWM') - baseline) / 1024
+    return {
+        'seconds': statistics.median(timings),
+        'best_seconds': min(timings),
+        'peak_rss_mb': peak_mb,
+    }
+
+
+def upload_event(data: bytes, file_name: str, system_prompt: str) -> dict:
+    return {
+        'httpMethod': 'POST',
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'file': base64.b64encode(data).decode('ascii'),
+            'fileName': file_name,
+            'systemPrompt': system_prompt,
+        }),
+    }
+
+
+def call_handler(process_dialogs, event: dict, expected_cache: str) -> None:
+    response = process_dialogs.handler(event, None)
+    assert response['statusCode'] == 200, response['body']
+    cache = json.loads(response['body'])['cache']
+    assert cache == expected_cache, f'ожидался cache={expected_cache}, получен {cache}'
+
+
+def call_handler_quietly(process_dialogs, event: dict) -> None:
+    """Первый запрос, который заполняет кэш результатов"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        call_handler(process_dialogs, event, 'miss')
+
+
+def parse_google_sheet(process_dialogs, url: str):
+    """Путь handler для googleSheetsUrl: скачивание выгрузки и потоковый разбор CSV"""
+    load_dialogs, _, _, close_source = process_dialogs.open_source({'googleSheetsUrl': url}, None)
+    try:
+        return process_dialogs.DialogTable.from_dialogs(load_dialogs())
+    finally:
+        close_source()
+
+
+def run_size(process_dialogs, size: int, cases: List[str], repeat: int, deepseek: FakeDeepSeek) -> List[Dict[str, Any]]:
+    rows = generate_rows(size)
+    csv_data = to_csv_bytes(rows)
+    xlsx_data = to_xlsx_bytes(rows) if 'parse-xlsx' in cases else None
+    del rows
+    csv_base64 = base64.b64encode(csv_data).decode('ascii')
+    dialogs = process_dialogs.parse_excel_file(csv_base64, 'dialogs.csv')
+
+    results = []
+
+    def record(case: str, file_bytes: Optional[int], run: Callable[[], Any], case_repeat: int = repeat, **extra):
+        result = {
+            'case': case,
+            'messages': size,
+            'dialogs': len(dialogs),
+            'file_mb': None if file_bytes is None else round(file_bytes / 2 ** 20, 3),
+            **measure(run, case_repeat),
+            **extra,
+        }
+        results.append(result)
+        print(f'{case:>13} {size:>9} {result["seconds"]:>9.3f} '
+              f'{"-" if result["peak_rss_mb"] is None else format(result["peak_rss_mb"], ".1f"):>13}',
+              file=sys.stderr)
+
+    if 'parse-csv' in cases:
+        record('parse-csv', len(csv_data), lambda: process_dialogs.parse_excel_file(csv_base64, 'dialogs.csv'))
+
+    if 'parse-xlsx' in cases:
+        xlsx_base64 = base64.b64encode(xlsx_data).decode('ascii')
+        record('parse-xlsx', len(xlsx_data), lambda: process_dialogs.parse_excel_file(xlsx_base64, 'dialogs.xlsx'))
+        del xlsx_base64
+
+    if 'sheets' in cases:
+        with FakeSheets({SHEET_ID: csv_data}) as sheets:
+            process_dialogs.GOOGLE_SHEETS_EXPORT_URL = sheets.export_url_template
+            url = f'https://docs.google.com/spreadsheets/d/{SHEET_ID}/edit'
+            record('sheets', len(csv_data), lambda: parse_google_sheet(process_dialogs, url))
+
+    if 'extract' in cases:
+        record('extract', None, lambda: process_dialogs.extract_knowledge(dialogs))
+
+    if 'handler-miss' in cases or 'handler-hit' in cases:
+        # Новый промпт на каждый прогон — иначе второй запуск попадет в кэш результатов
+        prompts = iter(range(10 ** 9))
+        deepseek.requests = 0
+        if 'handler-miss' in cases:
+            record('handler-miss', len(csv_data), lambda: call_handler(
+                process_dialogs, upload_event(csv_data, 'dialogs.csv', f'miss {size} {next(prompts)}'), 'miss'
+            ), deepseek_latency=deepseek.latency)
+            results[-1]['deepseek_requests'] = deepseek.requests // repeat
+
+        if 'handler-hit' in cases:
+            hit_event = upload_event(csv_data, 'dialogs.csv', f'hit {size}')
+            call_handler_quietly(process_dialogs, hit_event)
+            record('handler-hit', len(csv_data), lambda: call_handler(process_dialogs, hit_event, 'hit'))
+
+    return results
+
+
+def metadata(args) -> Dict[str, Any]:
+    def git(*command):
+        try:
+            return subprocess.run(['git', *command], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'sizes': args.sizes,
+        'repeat': args.repeat,
+        'deepseek_latency': args.latency,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> int:
+    """Печатает изменения относительно базового прогона; возвращает число регрессий"""
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = {(item['case'], item['messages']): item for item in json.load(baseline_file)['results']}
+
+    regressions = 0
+    print(f'\n{"case":>13} {"messages":>9} {"base, s":>9} {"now, s":>9} {"change":>8}', file=sys.stderr)
+    for result in results:
+        base = baseline.get((result['case'], result['messages']))
+        if base is None:
+            continue
+        change = result['seconds'] / base['seconds'] - 1 if base['seconds'] else 0.0
+        mark = ''
+        if change > threshold:
+            regressions += 1
+            mark = '  РЕГРЕССИЯ'
+        print(f'{result["case"]:>13} {result["messages"]:>9} {base["seconds"]:>9.3f} '
+              f'{result["seconds"]:>9.3f} {change:>+8.1%}{mark}', file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.2, help='задержка заглушки DeepSeek, с')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля ответов 500 от заглушки DeepSeek')
+    parser.add_argument('--output', help='файл для результатов в JSON (по умолчанию stdout)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление, доля')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir, \
+            FakeDeepSeek(args.latency, args.jitter, args.fail_rate) as deepseek:
+        # Окружение читается при импорте модуля, поэтому задается до load_function
+        os.environ['PROCESS_DIALOGS_CACHE_DIR'] = cache_dir
+        os.environ['DEEPSEEK_URL'] = deepseek.url
+        os.environ['DEEPSEEK_API_KEY'] = 'bench'
+        process_dialogs = load_function('process-dialogs')
+
+        print(f'{"case":>13} {"messages":>9} {"median, s":>9} {"peak RSS, MB":>13}', file=sys.stderr)
+        results = []
+        for size in args.sizes:
+            results.extend(run_size(process_dialogs, size, args.cases, args.repeat, deepseek))
+
+    report = {'meta': metadata(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
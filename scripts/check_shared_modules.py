@@ -0,0 +1,85 @@
+"""Проверка копий общих модулей backend-функций.
+
+Функции деплоятся по отдельности, поэтому общие модули лежат копией в
+каталоге каждой функции, которой нужны. Копии в process-dialogs и
+deepseek-chat должны совпадать побайтно. Копия в chatgpt-polza написана
+по-английски (докстроки, комментарии, сообщения print, двойные кавычки),
+поэтому она сравнивается по AST: без докстрок и аргументов print код
+должен совпадать с остальными копиями.
+
+Запуск: python scripts/check_shared_modules.py [http_client.py ...]
+Код выхода 1, если какие-то копии разошлись.
+"""
+
+import argparse
+import ast
+import sys
+from pathlib import Path
+from typing import List
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+# Первая найденная копия — эталон для остальных
+RUSSIAN_COPIES = (BACKEND / 'deepseek-chat', BACKEND / 'process-dialogs')
+ENGLISH_COPIES = (BACKEND / 'extensions' / 'chatgpt-polza' / 'chatgpt',)
+SHARED_MODULES = ('completion_cache.py', 'http_client.py', 'metrics.py', 'singleflight.py')
+
+
+class _CodeShape(ast.NodeTransformer):
+    """Убирает из дерева то, что в копиях переводится: докстроки и аргументы print"""
+
+    def _without_docstring(self, node):
+        self.generic_visit(node)
+        first = node.body[0] if node.body else None
+        if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+            node.body = node.body[1:] or [ast.Pass()]
+        return node
+
+    visit_Module = visit_ClassDef = visit_FunctionDef = visit_AsyncFunctionDef = _without_docstring
+
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id == 'print':
+            node.args = []
+        return node
+
+
+def code_shape(path: Path) -> str:
+    tree = ast.parse(path.read_text(encoding='utf-8'), filename=str(path))
+    return ast.dump(_CodeShape().visit(tree))
+
+
+def check_module(module: str) -> List[str]:
+    """Описания расхождений копий module; пустой список — копии совпадают"""
+    russian = [directory / module for directory in RUSSIAN_COPIES if (directory / module).exists()]
+    english = [directory / module for directory in ENGLISH_COPIES if (directory / module).exists()]
+    if len(russian) + len(english) < 2:
+        return [f'{module}: найдено меньше двух копий']
+
+    reference = (russian or english)[0]
+    problems = []
+    for copy in russian[1:]:
+        if copy.read_bytes() != reference.read_bytes():
+            problems.append(f'{copy.relative_to(BACKEND)} отличается от {reference.relative_to(BACKEND)}')
+    shape = code_shape(reference)
+    for copy in english:
+        if copy != reference and code_shape(copy) != shape:
+            problems.append(f'код {copy.relative_to(BACKEND)} отличается от {reference.relative_to(BACKEND)}')
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', default=list(SHARED_MODULES))
+    args = parser.parse_args()
+
+    problems = [problem for module in args.modules for problem in check_module(module)]
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        return 1
+    print(f'копии {", ".join(args.modules)} совпадают')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -7,7 +7,32 @@ import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import { Textarea } from '@/components/ui/textarea';
 import Icon from '@/components/ui/icon';
 
+const PROCESS_DIALOGS_URL = 'https://functions.poehali.dev/d502ef50-1926-4db0-b56d-67f43e16998c';
+// Фоновая задача только для больших файлов: очередь живет на одном инстансе функции,
+// поэтому небольшие файлы и Google Sheets анализируются одним запросом
+const ASYNC_UPLOAD_MIN_BYTES = 10 * 1024 * 1024;
+const JOB_POLL_INTERVAL = 2000;
+const JOB_MAX_WAIT = 30 * 60 * 1000;
+const JOB_MAX_POLL_ERRORS = 3;
+const JOB_LOST_ERROR = 'Задача потеряна: сервер перезапустился или запрос попал на другой инстанс. Загрузите файл еще раз';
+const JOB_PHASES: Record<string, string> = {
+  parse: 'чтение таблицы',
+  extract: 'разбор диалогов',
+  analyse: 'анализ DeepSeek',
+};
+
+const waitFor = (ms: number, signal: AbortSignal) => new Promise<void>((resolve, reject) => {
+  const timer = setTimeout(resolve, ms);
+  signal.addEventListener('abort', () => {
+    clearTimeout(timer);
+    reject(signal.reason);
+  }, { once: true });
+});
+
+const isAbortError = (error: unknown) => error instanceof DOMException && error.name === 'AbortError';
+
 const SettingsTab = () => {
+  const analysisRef = useRef<AbortController | null>(null);
   const [uploadedFile, setUploadedFile] = useState<File | null>(null);
   const [isUploading, setIsUploading] = useState(false);
   const [uploadStatus, setUploadStatus] = useState<string>('');
@@ -48,6 +73,65 @@ const SettingsTab = () => {
     setUploadStatus(`Выбран файл: ${file.name} (${(file.size / 1024 / 1024).toFixed(2)} МБ)`);
   };
 
+  // Уход со страницы прерывает запрос и опрос задачи
+  useEffect(() => () => analysisRef.current?.abort(), []);
+
+  // Обычный запрос сразу возвращает результат; с async=true сервер отвечает jobId,
+  // и прогресс опрашивается через action=status не дольше JOB_MAX_WAIT
+  const runAnalysis = async (init: RequestInit) => {
+    analysisRef.current?.abort();
+    const controller = new AbortController();
+    analysisRef.current = controller;
+    const { signal } = controller;
+    const timeout = setTimeout(() => controller.abort(new DOMException('Analysis timed out', 'TimeoutError')), JOB_MAX_WAIT);
+
+    try {
+      const response = await fetch(PROCESS_DIALOGS_URL, { method: 'POST', ...init, signal });
+      const submitted = await response.json();
+      if (!submitted.success || !submitted.jobId) return submitted;
+
+      let pollErrors = 0;
+      while (true) {
+        await waitFor(JOB_POLL_INTERVAL, signal);
+        let status;
+        try {
+          const statusResponse = await fetch(PROCESS_DIALOGS_URL, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ action: 'status', jobId: submitted.jobId }),
+            signal
+          });
+          if (statusResponse.status === 404) return { success: false, error: JOB_LOST_ERROR };
+          status = await statusResponse.json();
+        } catch (error) {
+          if (signal.aborted) throw error;
+          status = null;
+        }
+        if (!status?.success) {
+          pollErrors += 1;
+          if (pollErrors >= JOB_MAX_POLL_ERRORS) {
+            return { success: false, error: status?.error ?? 'Сервер не отвечает на запросы статуса задачи' };
+          }
+          continue;
+        }
+        pollErrors = 0;
+
+        const job = status.job;
+        if (job.status === 'done') return job.result;
+        if (job.status === 'failed') return { success: false, error: job.error };
+        const phase = JOB_PHASES[job.phase] ?? 'в очереди';
+        setUploadStatus(`Обработка: ${phase}, прочитано ${job.progress.dialogsParsed} диалогов...`);
+      }
+    } catch (error) {
+      if (signal.reason instanceof DOMException && signal.reason.name === 'TimeoutError') {
+        return { success: false, error: `Анализ не завершился за ${JOB_MAX_WAIT / 60000} минут` };
+      }
+      throw error;
+    } finally {
+      clearTimeout(timeout);
+    }
+  };
+
   const handleGoogleSheetsImport = async () => {
     if (!googleSheetsUrl.trim()) {
       setUploadStatus('Ошибка: Введите ссылку на Google Таблицу');
@@ -58,26 +142,26 @@ const SettingsTab = () => {
     setUploadStatus('Импорт из Google Sheets...');
 
     try {
-      const response = await fetch('https://functions.poehali.dev/d502ef50-1926-4db0-b56d-67f43e16998c', {
-        method: 'POST',
+      const result = await runAnalysis({
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ googleSheetsUrl, systemPrompt })
+        body: JSON.stringify({ googleSheetsUrl, systemPrompt, incremental: true })
       });
-
-      const result = await response.json();
       
       if (result.success) {
-        setDialogsCount(prev => prev + result.dialogsCount);
+        // В инкрементальном режиме dialogsCount — все диалоги таблицы, новые приходят в newDialogs
+        const addedDialogs = result.newDialogs ?? result.dialogsCount;
+        setDialogsCount(prev => prev + addedDialogs);
         setExtractedProblems(prev => [...new Set([...prev, ...(result.problems || [])])]);
         setExtractedProducts(prev => [...new Set([...prev, ...(result.products || [])])]);
-        const newTotal = dialogsCount + result.dialogsCount;
+        const newTotal = dialogsCount + addedDialogs;
         const newProblemsCount = extractedProblems.length + (result.problems?.length || 0);
         const newProductsCount = extractedProducts.length + (result.products?.length || 0);
-        setUploadStatus(`✓ Добавлено ${result.dialogsCount} диалогов. Всего: ${newTotal} диалогов, ${newProblemsCount} проблем, ${newProductsCount} товаров.`);
+        setUploadStatus(`✓ Добавлено ${addedDialogs} диалогов. Всего: ${newTotal} диалогов, ${newProblemsCount} проблем, ${newProductsCount} товаров.`);
       } else {
         setUploadStatus(`Ошибка: ${result.error}`);
       }
     } catch (error) {
+      if (isAbortError(error)) return;
       setUploadStatus('Ошибка соединения с сервером');
     } finally {
       setIsUploading(false);
@@ -91,19 +175,15 @@ const SettingsTab = () => {
     setUploadStatus('Обработка файла...');
 
     try {
-      const base64 = await fileToBase64(uploadedFile);
+      // multipart/form-data: файл уходит как есть, без base64 внутри JSON
+      const formData = new FormData();
+      formData.append('systemPrompt', systemPrompt);
+      if (uploadedFile.size >= ASYNC_UPLOAD_MIN_BYTES) {
+        formData.append('async', 'true');
+      }
+      formData.append('file', uploadedFile, uploadedFile.name);
       
-      const response = await fetch('https://functions.poehali.dev/d502ef50-1926-4db0-b56d-67f43e16998c', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ 
-          file: base64,
-          fileName: uploadedFile.name,
-          systemPrompt
-        })
-      });
-
-      const result = await response.json();
+      const result = await runAnalysis({ body: formData });
       
       if (result.success) {
         setDialogsCount(prev => prev + result.dialogsCount);
@@ -117,24 +197,13 @@ const SettingsTab = () => {
         setUploadStatus(`Ошибка: ${result.error}`);
       }
     } catch (error) {
+      if (isAbortError(error)) return;
       setUploadStatus(`Ошибка загрузки файла: ${error instanceof Error ? error.message : 'Неизвестная ошибка'}`);
     } finally {
       setIsUploading(false);
     }
   };
 
-  const fileToBase64 = (file: File): Promise<string> => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.readAsDataURL(file);
-      reader.onload = () => {
-        const base64 = (reader.result as string).split(',')[1];
-        resolve(base64);
-      };
-      reader.onerror = error => reject(error);
-    });
-  };
-
   return (
     <div className="animate-fade-in">
       <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
@@ -9,6 +9,8 @@ import Icon from '@/components/ui/icon';
 import { useChatGPT } from '@/components/extensions/chatgpt-polza/useChatGPT';
 
 const API_URL = 'https://functions.poehali.dev/9259f856-7eb7-426c-a8dd-f95343979e4d';
+// Длинные сессии: старые реплики сворачиваются в краткое содержание
+const HISTORY_TOKEN_BUDGET = 3000;
 
 interface Message {
   id: number;
@@ -51,6 +53,7 @@ const TrainerTab = () => {
   const [currentScenario, setCurrentScenario] = useState(SCENARIOS[0]);
   const [scores, setScores] = useState<Scores>({ empathy: 0, professionalism: 0, speed: 100 });
   const [sessionStartTime, setSessionStartTime] = useState<number>(Date.now());
+  const [sessionId, setSessionId] = useState(() => crypto.randomUUID());
   const [isSimulationActive, setIsSimulationActive] = useState(false);
 
   const analyzeResponse = (userMessage: string): Scores => {
@@ -103,6 +106,7 @@ const TrainerTab = () => {
     }]);
     setScores({ empathy: 0, professionalism: 0, speed: 100 });
     setSessionStartTime(Date.now());
+    setSessionId(crypto.randomUUID());
     setIsSimulationActive(true);
   };
 
@@ -135,7 +139,9 @@ const TrainerTab = () => {
       ],
       model: 'openai/gpt-4o-mini',
       temperature: 0.8,
-      max_tokens: 200
+      max_tokens: 200,
+      session_id: sessionId,
+      history_budget: HISTORY_TOKEN_BUDGET
     });
     
     if (result.success && result.content) {
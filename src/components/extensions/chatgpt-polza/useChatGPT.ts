@@ -25,6 +25,10 @@ interface GenerateParams {
   model?: string;
   temperature?: number;
   max_tokens?: number;
+  /** Trainer session id: lets the backend reuse the summary of old turns */
+  session_id?: string;
+  /** Prompt token budget: older turns are summarized once the history exceeds it */
+  history_budget?: number;
 }
 
 interface GenerateResult {
@@ -37,6 +41,11 @@ interface GenerateResult {
     total_tokens: number;
   };
   finish_reason?: string;
+  history?: {
+    prompt_tokens_estimate: number;
+    summarized_messages: number;
+    summary: string;
+  };
   error?: string;
 }
 
@@ -107,6 +116,7 @@ export function useChatGPT({ apiUrl }: UseChatGPTConfig): UseChatGPTReturn {
           model: data.model,
           usage: data.usage,
           finish_reason: data.finish_reason,
+          history: data.history,
         };
       } catch (err) {
         const message = err instanceof Error ? err.message : "Network error";